@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+
+
+"""
+Benchmark the fio-geoprocessing commands against synthetic data.
+
+Datasets are generated locally, each command is run as a separate `fio`
+process across every combination of `--jobs` and `--batch-size`, and the
+results, including the per-stage timings reported by `--stats`, are written
+to a JSON report that can be compared against a previous run.  Stops with
+a non-zero exit status as soon as any command fails:
+
+    $ python benchmarks/run.py --features 100000 --jobs 1 --jobs 4 \\
+        --batch-size 100 --batch-size 1000 --report after.json --compare before.json
+"""
+
+
+from __future__ import division
+
+from collections import OrderedDict
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import fiona as fio
+import shapely
+
+import fio_geoprocessing
+
+
+# Arguments for each command, not including INFILE and OUTFILE.  Distances
+# are in degrees because the synthetic data is in EPSG:4326.
+COMMANDS = OrderedDict([
+    ('buffer', ['--dist', '0.01']),
+    ('centroid', []),
+    ('filter', ['--expr', 'value > 0.5']),
+    ('reproject', ['--dst-crs', 'EPSG:3857']),
+])
+
+GEOMETRY_TYPES = ('point', 'line', 'polygon')
+
+# Synthetic data covers the contiguous United States
+EXTENT = (-124.0, 25.0, -67.0, 49.0)
+
+
+def _coords(x, y, vertices, radius, closed):
+    step = 2 * math.pi / vertices
+    coords = [(x + radius * math.cos(i * step), y + radius * math.sin(i * step))
+              for i in range(vertices)]
+    if closed:
+        coords.append(coords[0])
+    return coords
+
+
+def generate(path, geometry_type, features, vertices, seed=0):
+
+    """
+    Write a synthetic dataset.
+
+    Parameters
+    ----------
+    path : str
+        Output GeoPackage.
+    geometry_type : str
+        One of `GEOMETRY_TYPES`.
+    features : int
+        Number of features to write.
+    vertices : int
+        Vertices per line or polygon.  Ignored for points.
+    seed : int, optional
+        Seed for the random number generator so datasets are reproducible.
+    """
+
+    rand = random.Random(seed)
+    x_min, y_min, x_max, y_max = EXTENT
+
+    schema = {
+        'geometry': {'point': 'Point', 'line': 'LineString', 'polygon': 'Polygon'}[geometry_type],
+        'properties': OrderedDict([('id', 'int'), ('value', 'float'), ('name', 'str')])
+    }
+
+    def records():
+        for fid in range(features):
+            x = rand.uniform(x_min, x_max)
+            y = rand.uniform(y_min, y_max)
+            if geometry_type == 'point':
+                geom = {'type': 'Point', 'coordinates': (x, y)}
+            elif geometry_type == 'line':
+                geom = {'type': 'LineString',
+                        'coordinates': _coords(x, y, max(vertices, 2), 0.05, False)}
+            else:
+                geom = {'type': 'Polygon',
+                        'coordinates': [_coords(x, y, max(vertices, 3), 0.05, True)]}
+            yield {
+                'type': 'Feature',
+                'geometry': geom,
+                'properties': OrderedDict([
+                    ('id', fid), ('value', rand.random()), ('name', 'feature-%s' % fid)])
+            }
+
+    with fio.open(path, 'w', driver='GPKG', schema=schema, crs='EPSG:4326') as dst:
+        dst.writerecords(records())
+
+
+def run(args):
+
+    """
+    Run a command and measure it.
+
+    Parameters
+    ----------
+    args : list
+        Command to execute.
+
+    Returns
+    -------
+    dict
+        Wall clock, user, and system seconds, peak RSS of the process and its
+        workers in megabytes, and the exit code.
+    """
+
+    start = time.time()
+    proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.time() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    # Linux reports kilobytes, macOS reports bytes
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+
+    return {
+        'seconds': elapsed,
+        'user_seconds': usage.ru_utime,
+        'system_seconds': usage.ru_stime,
+        'peak_rss_mb': usage.ru_maxrss / scale,
+        'returncode': proc.returncode,
+        'stderr': stderr.decode('utf-8', 'replace').strip(),
+    }
+
+
+def parse_stats(stderr):
+
+    """
+    Find the final report written by `--stats`.
+
+    Parameters
+    ----------
+    stderr : str
+        Output from a command.
+
+    Returns
+    -------
+    dict or None
+    """
+
+    for line in reversed(stderr.splitlines()):
+        if line.startswith('{'):
+            try:
+                report = json.loads(line)
+            except ValueError:
+                continue
+            if report.get('final'):
+                return report
+    return None
+
+
+def environment():
+
+    """
+    Versions and hardware information to store alongside results.
+    """
+
+    return OrderedDict([
+        ('fio_geoprocessing', fio_geoprocessing.__version__),
+        ('python', platform.python_version()),
+        ('fiona', fio.__version__),
+        ('gdal', fio.__gdal_version__),
+        ('shapely', shapely.__version__),
+        ('geos', '.'.join(map(str, shapely.geos_version))),
+        ('platform', platform.platform()),
+        ('cpu_count', os.cpu_count()),
+    ])
+
+
+def _key(result):
+    return tuple(result[k] for k in (
+        'command', 'geometry', 'features', 'vertices', 'jobs', 'batch_size'))
+
+
+def compare(results, previous):
+
+    """
+    Print the change in throughput relative to a previous report.
+    """
+
+    before = {_key(r): r for r in previous['results']}
+    for result in results:
+        old = before.get(_key(result))
+        if not old or not old['features_per_second'] or not result['features_per_second']:
+            continue
+        change = result['features_per_second'] / old['features_per_second'] - 1
+        click.echo(
+            "{command:<10} {geometry:<8} jobs={jobs:<3} batch={batch_size:<6} "
+            "{before:>10.0f} -> {after:>10.0f} features/sec ({change:+.1%})".format(
+                before=old['features_per_second'], after=result['features_per_second'],
+                change=change, **result))
+
+
+@click.command()
+@click.option(
+    '-c', '--command', 'commands', multiple=True, type=click.Choice(list(COMMANDS)),
+    help="Command to benchmark.  May be given multiple times. (default: all)"
+)
+@click.option(
+    '-g', '--geometry', 'geometries', multiple=True, type=click.Choice(GEOMETRY_TYPES),
+    help="Geometry type of the synthetic data.  May be given multiple times. (default: all)"
+)
+@click.option(
+    '-n', '--features', type=click.IntRange(1, None), default=10000,
+    help="Number of features in each dataset. (default: 10000)"
+)
+@click.option(
+    '--vertices', type=click.IntRange(2, None), default=32,
+    help="Vertices per line and polygon. (default: 32)"
+)
+@click.option(
+    '-j', '--jobs', 'jobs_values', multiple=True, type=click.IntRange(1, None),
+    help="Value for `--jobs`.  May be given multiple times. (default: 1)"
+)
+@click.option(
+    '-b', '--batch-size', 'batch_sizes', multiple=True, type=click.IntRange(1, None),
+    help="Value for `--batch-size`.  May be given multiple times. (default: 100)"
+)
+@click.option(
+    '--repeat', type=click.IntRange(1, None), default=1,
+    help="Run each case this many times and keep the fastest. (default: 1)"
+)
+@click.option(
+    '--report', type=click.Path(dir_okay=False), default='benchmark.json',
+    help="Write results to this JSON file. (default: benchmark.json)"
+)
+@click.option(
+    '--compare', 'compare_path', type=click.Path(exists=True, dir_okay=False),
+    help="Compare results against a previous report."
+)
+@click.option(
+    '--workdir', type=click.Path(file_okay=False),
+    help="Directory for synthetic data and output.  Kept so datasets can be reused. "
+         "(default: a temporary directory that is removed)"
+)
+def main(commands, geometries, features, vertices, jobs_values, batch_sizes, repeat, report,
+         compare_path, workdir):
+
+    """
+    Benchmark fio-geoprocessing commands.
+    """
+
+    commands = commands or list(COMMANDS)
+    geometries = geometries or GEOMETRY_TYPES
+    jobs_values = jobs_values or (1, )
+    batch_sizes = batch_sizes or (100, )
+
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='fio-geoproc-benchmark-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    results = []
+    try:
+        for geometry in geometries:
+            infile = os.path.join(
+                workdir, '{0}-{1}-{2}.gpkg'.format(geometry, features, vertices))
+            if not os.path.exists(infile):
+                click.echo("Generating %s" % infile, err=True)
+                generate(infile, geometry, features, vertices)
+
+            for command in commands:
+                for jobs in jobs_values:
+                    for batch_size in batch_sizes:
+                        outfile = os.path.join(workdir, 'output.gpkg')
+                        args = ['fio', command, infile, outfile] + COMMANDS[command] + [
+                            '--jobs', str(jobs), '--batch-size', str(batch_size), '--stats']
+
+                        best = None
+                        for _ in range(repeat):
+                            if os.path.exists(outfile):
+                                os.remove(outfile)
+                            measured = run(args)
+                            if measured['returncode'] != 0:
+                                raise click.ClickException(
+                                    "`{cmd}` exited with {code}:\n{stderr}".format(
+                                        cmd=' '.join(args), code=measured['returncode'],
+                                        stderr=measured['stderr']))
+                            if best is None or measured['seconds'] < best['seconds']:
+                                best = measured
+
+                        result = OrderedDict([
+                            ('command', command),
+                            ('geometry', geometry),
+                            ('features', features),
+                            ('vertices', vertices),
+                            ('jobs', jobs),
+                            ('batch_size', batch_size),
+                            ('features_per_second', features / best['seconds']),
+                        ])
+                        result.update(best)
+                        result['stats'] = parse_stats(result.pop('stderr'))
+                        results.append(result)
+
+                        click.echo(
+                            "{command:<10} {geometry:<8} jobs={jobs:<3} batch={batch_size:<6} "
+                            "{seconds:>8.2f}s {features_per_second:>10.0f} features/sec "
+                            "{peak_rss_mb:>8.1f} MB".format(**result))
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(report, 'w') as f:
+        json.dump(OrderedDict([
+            ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('environment', environment()),
+            ('results', results),
+        ]), f, indent=2)
+    click.echo("Wrote %s" % report, err=True)
+
+    if compare_path:
+        with open(compare_path) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
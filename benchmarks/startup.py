@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+
+"""
+Check that this plugin does not slow down `fio` startup.
+
+`fio` loads every registered plugin command each time it runs, so loading
+this plugin's entry points must not import anything heavy.  Each check runs
+in a fresh interpreter:
+
+    $ python benchmarks/startup.py --repeat 10 --max-seconds 0.05
+
+Exits with a non-zero status if `fio --help` does not list every one of
+`COMMANDS`, or if loading the entry points imports one of `HEAVY_MODULES`
+or takes longer than `--max-seconds`.  The time taken by `fio --help` and by
+an unrelated command is reported for reference.
+"""
+
+
+from __future__ import division
+
+import json
+import subprocess
+import sys
+import time
+
+import click
+
+
+# Commands `fio` should list once the plugin is installed.
+COMMANDS = ('buffer', 'centroid', 'filter', 'geoproc', 'reproject')
+
+# Entry point group `fio` loads plugins from.
+GROUP = 'fiona.fio_plugins'
+
+# Modules that must not be imported just by loading the entry points.
+HEAVY_MODULES = (
+    'fiona', 'fiona.transform', 'shapely', 'numpy', 'pyproj', 'multiprocessing')
+
+# Runs in a fresh interpreter and prints the time spent loading this
+# plugin's entry points and the heavy modules they imported.
+_LOAD_SCRIPT = """
+import json
+import sys
+import time
+
+from importlib.metadata import entry_points
+
+group = %r
+eps = entry_points()
+eps = eps.select(group=group) if hasattr(eps, 'select') else eps.get(group, [])
+eps = [ep for ep in eps if ep.value.startswith('fio_geoprocessing')]
+before = set(sys.modules)
+
+start = time.time()
+for ep in eps:
+    ep.load()
+seconds = time.time() - start
+
+print(json.dumps({
+    'commands': sorted(ep.name for ep in eps),
+    'seconds': seconds,
+    'imported': sorted(m for m in %r if m in sys.modules and m not in before)
+}))
+"""
+
+
+def load_entry_points():
+
+    """
+    Load this plugin's entry points in a fresh interpreter.
+
+    Returns
+    -------
+    dict
+        `{'commands': list, 'seconds': float, 'imported': list}`
+    """
+
+    output = subprocess.check_output(
+        [sys.executable, '-c', _LOAD_SCRIPT % (GROUP, HEAVY_MODULES)])
+    return json.loads(output.decode('utf-8'))
+
+
+def listed_commands():
+
+    """
+    Get the commands listed by `fio --help`.
+
+    Returns
+    -------
+    list
+    """
+
+    output = subprocess.check_output(['fio', '--help']).decode('utf-8')
+    commands = output.split('Commands:', 1)[-1]
+    return sorted(line.split()[0] for line in commands.splitlines() if line.strip())
+
+
+def time_command(args, repeat):
+
+    """
+    Run a command several times and get the fastest wall time in seconds.
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@click.command()
+@click.option(
+    '--repeat', type=click.IntRange(1, None), default=5,
+    help="Run each measurement this many times and keep the fastest. (default: 5)"
+)
+@click.option(
+    '--max-seconds', type=click.FloatRange(0, None), default=0.05,
+    help="Fail if loading the entry points takes longer than this. (default: 0.05)"
+)
+def main(repeat, max_seconds):
+
+    """
+    Check the plugin's impact on fio startup time.
+    """
+
+    missing = sorted(set(COMMANDS) - set(listed_commands()))
+    if missing:
+        raise click.ClickException(
+            "fio --help does not list %s, is the plugin installed under %s?" % (
+                ', '.join(missing), GROUP))
+
+    loads = [load_entry_points() for _ in range(repeat)]
+    best = min(loads, key=lambda r: r['seconds'])
+    imported = sorted(set(m for r in loads for m in r['imported']))
+
+    click.echo("Entry points: %s" % ', '.join(best['commands']))
+    click.echo("Loading entry points: %.4f seconds" % best['seconds'])
+    click.echo("fio --help: %.4f seconds" % time_command(['fio', '--help'], repeat))
+    click.echo("fio info --help: %.4f seconds" % time_command(['fio', 'info', '--help'], repeat))
+
+    failed = False
+    if not best['commands']:
+        click.echo("FAIL: no entry points found, is the plugin installed?", err=True)
+        failed = True
+    if imported:
+        click.echo("FAIL: loading entry points imported %s" % ', '.join(imported), err=True)
+        failed = True
+    if best['seconds'] > max_seconds:
+        click.echo("FAIL: loading entry points took longer than %s seconds" % max_seconds,
+                   err=True)
+        failed = True
+
+    if failed:
+        raise SystemExit(1)
+    click.echo("OK")
+
+
+if __name__ == '__main__':
+    main()
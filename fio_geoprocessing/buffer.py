@@ -6,26 +6,40 @@ Core components for `fio buffer`.
 """
 
 
+from collections import OrderedDict
 import copy
 import logging
-from multiprocessing import Pool
+import math
+import time
 
 import click
-import fiona as fio
-from fiona.transform import transform_geom
 from shapely.geometry import CAP_STYLE
 from shapely.geometry import JOIN_STYLE
 from shapely.geometry import mapping
-from shapely.geometry import asShape
+from shapely.geometry import MultiPolygon
+from shapely.ops import unary_union
 
+from . import crscache
+from . import executor
 from . import helpers
 from . import options
+from . import partition
+from . import shard
+from . import stats
+from . import stream
+from . import transform
+from . import transport
+from . import writer
 
 
-logging.basicConfig()
 log = logging.getLogger('fio-geoproc-buffer')
 
 
+# Number of partially dissolved features unioned together by each task when
+# merging results from workers.
+_DISSOLVE_FAN_IN = 8
+
+
 def _cb_cap_style(ctx, param, value):
 
     """
@@ -56,56 +70,273 @@ def _cb_res(ctx, param, value):
     return value
 
 
-def _processor(args):
+def _adaptive_res(geom, distance, res):
 
     """
-    Process a single feature
+    Scale the number of segments used to approximate a quarter circle by the
+    buffer distance relative to the geometry's size.  Arcs around a large
+    geometry with a small buffer are barely visible and don't need `res`
+    segments each.
 
     Parameters
     ----------
-    args : dict
-        feat - A GeoJSON feature to process.
-        src_crs - The geometry's CRS.
-        buf_crs - Apply buffer after reprojecting to this CRS.
-        dst_crs - Reproject buffered geometry to this CRS before returning.
-        skip_failures - If True then Exceptions don't stop processing.
-        buf_args - Keyword arguments for the buffer operation.
+    geom : shapely.geometry.base.BaseGeometry
+        Geometry that will be buffered.
+    distance : float
+        Buffer distance.
+    res : int
+        Maximum number of segments.
 
     Returns
     -------
-    dict
-        GeoJSON feature with updated geometry.
-    """
-
-    feat = args['feat']
-    src_crs = args['src_crs']
-    buf_crs = args['buf_crs']
-    dst_crs = args['dst_crs']
-    skip_failures = args['skip_failures']
-    buf_args = args['buf_args']
-
-    try:
-        # src_crs -> buf_crs
-        reprojected = transform_geom(
-            src_crs, buf_crs, feat['geometry'],
-            antimeridian_cutting=True
-        )
+    int
+        Between `1` and `res`.
+    """
 
-        # buffering operation
-        buffered = asShape(reprojected).buffer(**buf_args)
+    x_min, y_min, x_max, y_max = geom.bounds
+    size = max(x_max - x_min, y_max - y_min)
+    distance = abs(distance)
+    if not size or not distance or size <= distance:
+        return res
+    return max(1, min(res, int(math.ceil(res * math.sqrt(distance / size)))))
 
-        # buf_crs -> dst_crs
-        feat['geometry'] = transform_geom(
-            buf_crs, dst_crs, mapping(buffered),
-            antimeridian_cutting=True
-        )
 
-        return feat
+def _dissolve_key(feat, dissolve_by):
+    return feat['properties'].get(dissolve_by) if dissolve_by else None
+
+
+def _union_groups(groups, dissolve_by, output_geom_type):
+
+    """
+    Union each group of geometries into a single feature.
+
+    Parameters
+    ----------
+    groups : dict
+        Lists of geometries keyed by their `dissolve_by` value.
+    dissolve_by : str or None
+        Property to store each group's key in.
+    output_geom_type : str or None
+        Output schema's geometry type.  Polygons are promoted to multipolygons
+        if this is `MultiPolygon`.
+
+    Returns
+    -------
+    list
+        GeoJSON features.
+    """
+
+    output = []
+    for key, geoms in groups.items():
+        geom = unary_union([g for g in geoms if not g.is_empty])
+        if geom.is_empty:
+            continue
+        if output_geom_type == 'MultiPolygon' and geom.geom_type == 'Polygon':
+            geom = MultiPolygon([geom])
+        output.append({
+            'type': 'Feature',
+            'geometry': mapping(geom),
+            'properties': {dissolve_by: key} if dissolve_by else {}
+        })
+
+    return output
+
+
+def _dissolve(feats, dissolve_by=None, output_geom_type=None):
+
+    """
+    Union the geometries of features that share the same value for a field.
+    A failed union would drop an entire group of features so errors are
+    always raised.
+
+    Parameters
+    ----------
+    feats : list
+        GeoJSON features.
+    dissolve_by : str, optional
+        Union features with the same value for this property.  If not given
+        all features are unioned together.
+    output_geom_type : str, optional
+        See `_union_groups()`.
+
+    Returns
+    -------
+    list
+        One feature per group with only the `dissolve_by` property.
+    """
+
+    groups = OrderedDict()
+    for feat in feats:
+        groups.setdefault(_dissolve_key(feat, dissolve_by), []).append(
+            helpers.to_shape(feat['geometry']))
+
+    return _union_groups(groups, dissolve_by, output_geom_type)
+
+
+def _merge_dissolved(features, dissolve_by, output_geom_type, **execute_args):
+
+    """
+    Merge partially dissolved features produced by workers as a tree.  Each
+    round sorts features by their `dissolve_by` value and unions groups of
+    `_DISSOLVE_FAN_IN` in parallel, so no single union ever has to process
+    every feature.
+
+    Parameters
+    ----------
+    features : iter
+        Features produced by `_dissolve()`.
+    dissolve_by : str or None
+        See `_dissolve()`.
+    output_geom_type : str or None
+        See `_dissolve()`.
+    execute_args : **execute_args
+        Additional arguments for `executor.execute()`.
+
+    Returns
+    -------
+    list
+        One feature per group.
+    """
 
-    except Exception:
-        log.exception("Feature with ID %s failed" % feat.get('id'))
-        if not skip_failures:
-            raise
+    job = {
+        'dissolve_by': dissolve_by,
+        'output_geom_type': output_geom_type
+    }
+
+    def sort_key(feat):
+        # Groups values together without requiring them to be comparable
+        return repr(_dissolve_key(feat, dissolve_by))
+
+    features = list(features)
+    groups = len(set(sort_key(f) for f in features))
+    while len(features) > groups:
+        log.debug("Merging %s dissolved features into %s groups" % (len(features), groups))
+        features.sort(key=sort_key)
+        merged = list(executor.execute(
+            _dissolve, features, job, batch_size=_DISSOLVE_FAN_IN, **execute_args))
+        if len(merged) == len(features):
+            # Every group was split across tasks - finish in one pass
+            merged = _dissolve(features, **job)
+        features = merged
+
+    return features
+
+
+def _processor(feats, src_crs, buf_crs, dst_crs, skip_failures, buf_args,
+               output_geom_type=None, simplify_input=None, simplify_output=None,
+               adaptive_res=False, dissolve=False, dissolve_by=None):
+
+    """
+    Process a batch of features.
+
+    Parameters
+    ----------
+    feats : list
+        GeoJSON features to process.
+    src_crs : str or dict
+        The geometry's CRS.
+    buf_crs : str or dict
+        Apply buffer after reprojecting to this CRS.
+    dst_crs : str or dict
+        Reproject buffered geometry to this CRS before returning.
+    skip_failures : bool
+        If True then Exceptions don't stop processing.
+    buf_args : dict
+        Keyword arguments for the buffer operation.
+    output_geom_type : str, optional
+        Output schema's geometry type.  Polygons are promoted to multipolygons
+        if this is `MultiPolygon`.
+    simplify_input : float, optional
+        Simplify geometries with this tolerance before buffering.  In
+        `buf_crs` units.
+    simplify_output : float, optional
+        Simplify buffered geometries with this tolerance.  In `buf_crs` units.
+    adaptive_res : bool, optional
+        Reduce the buffer's resolution for geometries that are large relative
+        to the buffer distance.  See `_adaptive_res()`.
+    dissolve : bool, optional
+        Union the batch's buffered geometries.  See `_dissolve()`.
+    dissolve_by : str, optional
+        Like `dissolve` but only union geometries with the same value for
+        this property.
+
+    Returns
+    -------
+    list
+        GeoJSON features with updated geometry.  Features that failed and were
+        skipped are not included.
+    """
+
+    # Either of these is `None` if the CRSes are equivalent
+    to_buf_crs = transform.get_shape_transformer(
+        src_crs, buf_crs, antimeridian_cutting=True)
+    to_dst_crs = transform.get_shape_transformer(
+        buf_crs, dst_crs, antimeridian_cutting=True)
+
+    # Buffered geometries to union when dissolving, by `dissolve_by` value
+    groups = OrderedDict() if dissolve or dissolve_by else None
+
+    # Seconds spent reprojecting and buffering, for `--stats`
+    transform_time = 0
+    buffer_time = 0
+
+    output = []
+    for feat in feats:
+        try:
+            geom = helpers.to_shape(feat['geometry'])
+
+            # src_crs -> buf_crs
+            if to_buf_crs is not None:
+                start = time.time()
+                geom = to_buf_crs(geom)
+                transform_time += time.time() - start
+
+            start = time.time()
+            if simplify_input:
+                geom = geom.simplify(simplify_input, preserve_topology=True)
+
+            # buffering operation
+            if adaptive_res:
+                res = _adaptive_res(geom, buf_args['distance'], buf_args['quad_segs'])
+                geom = geom.buffer(**dict(buf_args, quad_segs=res))
+            else:
+                geom = geom.buffer(**buf_args)
+
+            if simplify_output:
+                geom = geom.simplify(simplify_output, preserve_topology=True)
+            buffer_time += time.time() - start
+
+            # buf_crs -> dst_crs
+            if to_dst_crs is not None:
+                start = time.time()
+                geom = to_dst_crs(geom)
+                transform_time += time.time() - start
+
+            if groups is not None:
+                groups.setdefault(_dissolve_key(feat, dissolve_by), []).append(geom)
+                continue
+
+            if output_geom_type == 'MultiPolygon' and geom.geom_type == 'Polygon':
+                geom = MultiPolygon([geom])
+            feat['geometry'] = helpers.from_shape(geom, feat['geometry'])
+
+            output.append(feat)
+
+        except Exception:
+            log.exception("Feature with ID %s failed" % feat.get('id'))
+            if not skip_failures:
+                raise
+            stats.failure()
+
+    stats.timing('transform', transform_time)
+    stats.timing('buffer', buffer_time)
+
+    if groups is not None:
+        start = time.time()
+        output = _union_groups(groups, dissolve_by, output_geom_type)
+        stats.timing('dissolve', time.time() - start)
+
+    return output
 
 
 @click.command()
@@ -124,6 +355,30 @@ def _processor(args):
     '--res', type=click.INT, callback=_cb_res, default=16,
     help="Resolution of the buffer around each vertex of the object. (default: 16)"
 )
+@click.option(
+    '--adaptive-res', is_flag=True,
+    help="Use fewer than `--res` segments for geometries that are large relative to "
+         "`--dist`, where the extra detail would not be visible."
+)
+@click.option(
+    '--simplify-input', type=click.FloatRange(0, None), metavar='TOL',
+    help="Simplify geometries before buffering, preserving topology.  In `--buf-crs` "
+         "units."
+)
+@click.option(
+    '--simplify-output', type=click.FloatRange(0, None), metavar='TOL',
+    help="Simplify buffered geometries, preserving topology.  In `--buf-crs` units."
+)
+@click.option(
+    '--dissolve', is_flag=True,
+    help="Union all buffered geometries into a single feature.  Other properties are "
+         "dropped."
+)
+@click.option(
+    '--dissolve-by', metavar='FIELD',
+    help="Union buffered geometries with the same value for FIELD into a single "
+         "feature.  Other properties are dropped."
+)
 @click.option(
     '--mitre-limit', type=click.FLOAT, default=5.0,
     help="When using a mitre join, limit the maximum length of the join corner according to "
@@ -134,9 +389,7 @@ def _processor(args):
     help="Buffer distance in georeferenced units.  If `--buf-crs` is supplied, then units "
          "must match that CRS."
 )
-@click.option(
-    '--src-crs', help="Specify CRS for input data.  Not needed if specified in infile."
-)
+@options.src_crs
 @click.option(
     '--buf-crs', help="Perform buffer operations in a different CRS.  Defaults to `--src-crs` "
                       "if not specified."
@@ -151,9 +404,26 @@ def _processor(args):
 )
 @options.skip_failures
 @options.jobs
+@options.batch_size
+@options.batch_cost
+@options.transport
+@options.preserve_order
+@options.reorder_buffer
+@options.write_batch_size
+@options.max_inflight
+@options.start_method
+@options.maxtasksperchild
+@options.partitioned_read
+@options.shard_output
+@options.stats
+@options.stats_interval
+@options.profile
 @click.pass_context
-def buffer(ctx, infile, outfile, driver, cap_style, join_style, res, mitre_limit,
-           dist, src_crs, buf_crs, dst_crs, output_geom_type, skip_failures, jobs):
+def buffer(ctx, infile, outfile, driver, cap_style, join_style, res, adaptive_res, simplify_input,
+           simplify_output, dissolve, dissolve_by, mitre_limit, dist, src_crs, buf_crs, dst_crs,
+           output_geom_type, skip_failures, jobs, batch_size, batch_cost, transport_format,
+           preserve_order, reorder_buffer, write_batch_size, max_inflight, start_method,
+           maxtasksperchild, partitioned_read, shard_output, show_stats, stats_interval, profile):
 
     """
     Buffer geometries with shapely.
@@ -176,12 +446,30 @@ def buffer(ctx, infile, outfile, driver, cap_style, join_style, res, mitre_limit
             --res 5 \\
             --cap-style flat \\
             --join-style mitre \\
-            --mitre-limit 0.1\\
+            --mitre-limit 0.1
+
+    Buffer detailed geometries with less work and smaller output:
+    \b
+        $ fio buffer ${INFILE} ${OUTFILE} \\
+            --dist 100 \\
+            --buf-crs EPSG:3857 \\
+            --adaptive-res \\
+            --simplify-input 10 \\
+            --simplify-output 10
+
+    Buffer and dissolve overlapping buffers that share a value for a field:
+    \b
+        $ fio buffer ${INFILE} ${OUTFILE} \\
+            --dist 10 \\
+            --dissolve-by state
     """
 
     helpers.set_verbosity(ctx, log)
 
-    with fio.open(infile, 'r') as src:
+    if shard_output and not outfile.lower().endswith('.vrt'):
+        raise click.BadParameter("OUTFILE must end with `.vrt`", param_hint='--shard-output')
+
+    with stream.open_input(infile) as src:
 
         log.debug("Resolving CRS fall backs")
 
@@ -189,6 +477,14 @@ def buffer(ctx, infile, outfile, driver, cap_style, join_style, res, mitre_limit
         buf_crs = buf_crs or src_crs
         dst_crs = dst_crs or buf_crs
 
+        # Collapse equivalent CRSes so workers can skip the reprojection
+        if buf_crs is not src_crs and transform.crs_equal(src_crs, buf_crs):
+            log.debug("buf_crs is equivalent to src_crs")
+            buf_crs = src_crs
+        if dst_crs is not buf_crs and transform.crs_equal(buf_crs, dst_crs):
+            log.debug("dst_crs is equivalent to buf_crs")
+            dst_crs = buf_crs
+
         log.debug("src_crs=%s" % src_crs)
         log.debug("buf_crs=%s" % buf_crs)
         log.debug("dst_crs=%s" % dst_crs)
@@ -198,37 +494,94 @@ def buffer(ctx, infile, outfile, driver, cap_style, join_style, res, mitre_limit
             driver=driver or src.driver,
             crs=dst_crs
         )
+        # Fiona prefers `crs_wkt` over `crs` so the input CRS would win
+        meta.pop('crs_wkt', None)
         if output_geom_type:
             meta['schema'].update(geometry=output_geom_type)
+        if dissolve_by:
+            if dissolve_by not in meta['schema']['properties']:
+                raise click.BadParameter(
+                    "field '{field}' not in: {fields}".format(
+                        field=dissolve_by, fields=', '.join(meta['schema']['properties'])),
+                    param_hint='--dissolve-by')
+            meta['schema']['properties'] = OrderedDict(
+                [(dissolve_by, meta['schema']['properties'][dissolve_by])])
+        elif dissolve:
+            meta['schema']['properties'] = OrderedDict()
 
         log.debug("Creating output file %s" % outfile)
         log.debug("Meta=%s" % meta)
 
-        with fio.open(outfile, 'w', **meta) as dst:
-
-            # Keyword arguments for `<Geometry>.buffer()`
-            buf_args = {
-                'distance': dist,
-                'resolution': res,
-                'cap_style': cap_style,
-                'join_style': join_style,
-                'mitre_limit': mitre_limit
-            }
-
-            # A generator that produces the arguments required for `_processor()`
-            task_generator = (
-                {
-                    'feat': feat,
-                    'src_crs': src_crs,
-                    'buf_crs': buf_crs,
-                    'dst_crs': dst_crs,
+        run_stats = None
+        if show_stats or stats_interval:
+            run_stats = stats.Stats(jobs, interval=stats_interval,
+                                    aggregate=bool(dissolve or dissolve_by))
+
+        try:
+            shards = shard.Shards(meta, outfile) if shard_output else None
+            execute_inflight, write_inflight = executor.split_inflight(max_inflight)
+            with (shards or stream.open_output(outfile, **meta)) as dst, \
+                    writer.Writer(dst, batch_size=write_batch_size,
+                                  max_inflight=write_inflight, stats=run_stats) as sink:
+
+                # Keyword arguments for `<Geometry>.buffer()`
+                buf_args = {
+                    'distance': dist,
+                    'quad_segs': res,
+                    'cap_style': cap_style,
+                    'join_style': join_style,
+                    'mitre_limit': mitre_limit
+                }
+
+                # Constant arguments for `_processor()`.  Normalized CRS
+                # definitions are cheap to send to workers and to parse.
+                job = {
+                    'src_crs': crscache.normalize(src_crs),
+                    'buf_crs': crscache.normalize(buf_crs),
+                    'dst_crs': crscache.normalize(dst_crs),
                     'skip_failures': skip_failures,
-                    'buf_args': buf_args
-                } for feat in src)
-
-            for o_feat in Pool(jobs).imap_unordered(_processor, task_generator):
-                if o_feat is not None:
-                    dst.write(o_feat)
+                    'buf_args': buf_args,
+                    'output_geom_type': output_geom_type,
+                    'simplify_input': simplify_input,
+                    'simplify_output': simplify_output,
+                    'adaptive_res': adaptive_res,
+                    'dissolve': dissolve,
+                    'dissolve_by': dissolve_by
+                }
+
+                features = helpers.as_dicts(src)
+                if partitioned_read:
+                    features = partition.partitions(src, infile) or features
+
+                results = executor.execute(
+                    _processor, features, job, jobs=jobs,
+                    batch_size=batch_size, preserve_order=preserve_order,
+                    reorder_buffer=reorder_buffer,
+                    max_inflight=execute_inflight, start_method=start_method,
+                    maxtasksperchild=maxtasksperchild,
+                    # Partially dissolved features have to be merged in the parent
+                    shards=None if dissolve or dissolve_by else shards,
+                    stats=run_stats, profile=profile,
+                    batch_cost=batch_cost,
+                    transport=(transport.WKBTransport(src.schema, meta['schema'])
+                               if transport_format == 'wkb' else None))
+
+                # Workers dissolve each batch, which leaves one feature per group
+                # per batch to be merged
+                if dissolve or dissolve_by:
+                    results = _merge_dissolved(
+                        results, dissolve_by, output_geom_type, jobs=jobs,
+                        start_method=start_method, maxtasksperchild=maxtasksperchild)
+
+                for o_feat in results:
+                    sink.write(o_feat)
+
+            if run_stats is not None:
+                run_stats.report(final=True)
+        finally:
+            # Stop periodic reports even if processing failed
+            if run_stats is not None:
+                run_stats.close()
 
 
 if __name__ == '__main__':
@@ -8,86 +8,260 @@ Core components for `fio centroid`.
 
 import copy
 import logging
-from multiprocessing import Pool
 
 import click
-import fiona as fio
-from shapely.geometry import asShape
-from shapely.geometry import mapping
+from shapely.geometry.base import BaseGeometry
 
+from . import executor
 from . import options
+from . import partition
+from . import shard
+from . import sharedmem
 from . import helpers
+from . import stats
+from . import stream
+from . import transport
+from . import writer
+
+try:
+    import numpy as np
+    import shapely
+    HAS_VECTORIZED = hasattr(shapely, 'centroid')
+except ImportError:
+    HAS_VECTORIZED = False
 
 
-logging.basicConfig()
 log = logging.getLogger('fio-geoproc-centroid')
 
 
-def _processor(args):
+def _cb_engine(ctx, param, value):
+
+    """
+    Click callback to ensure the requirements for `--engine vectorized` are
+    available.
+    """
+
+    if value == 'vectorized' and not HAS_VECTORIZED:
+        raise click.BadParameter("requires NumPy and Shapely >= 2")
+
+    return value
+
+
+def _processor(feats, skip_failures):
+
+    """
+    Given a batch of GeoJSON features, compute their centroids and return the
+    features with updated geometry.
+
+    Parameters
+    ----------
+    feats : list
+        GeoJSON features.
+    skip_failures : bool
+        Specifies whether failures should crash or just be logged.
+
+    Returns
+    -------
+    list
+        Features that failed and were skipped are not included.
+    """
+
+    output = []
+    for feat in feats:
+        try:
+            geom = helpers.to_shape(feat['geometry'])
+            feat['geometry'] = helpers.from_shape(geom.centroid, feat['geometry'])
+            output.append(feat)
+        except Exception:
+            log.exception("Feature with ID %s failed" % feat.get('id'))
+            if not skip_failures:
+                raise
+            stats.failure()
+
+    return output
+
+
+def _vectorized_processor(feats, skip_failures):
 
     """
-    Given a GeoJSON feature, compute its centroid and return the feature with
-    updated geometry.
+    Like `_processor()` but computes all of the centroids in a batch with a
+    single call to Shapely's vectorized `centroid()`, and builds the output
+    geometries directly from a coordinate array rather than with `mapping()`.
+
+    If anything in the batch fails the entire batch is handed to
+    `_processor()`, which handles failures on a per-feature basis.
 
     Parameters
     ----------
-    args : dict
-        feat : dict
-            A GeoJSON feature.
-        skip_failures : bool
-            Specifies whether failures should crash or just be logged.
+    feats : list
+        GeoJSON features.
+    skip_failures : bool
+        Specifies whether failures should crash or just be logged.
 
     Returns
     -------
-    dict
+    list
     """
 
-    feat = args['feat']
-    skip_failures = args['skip_failures']
+    # Centroids need geometries rather than coordinates, so unlike
+    # `fio reproject` this copies the coordinates out of shared memory
+    if isinstance(feats, sharedmem.Batch):
+        feats.fill()
+
     try:
-        feat['geometry'] = mapping(asShape(feat['geometry']).centroid())
-        return feat
+        geoms = np.empty(len(feats), dtype=object)
+        geoms[:] = [helpers.to_shape(feat['geometry']) for feat in feats]
+        centroids = shapely.centroid(geoms)
     except Exception:
-        log.exception("Feature with ID %s failed" % feat.get('id'))
-        if not skip_failures:
-            raise
+        centroids = None
+
+    if centroids is None:
+        log.debug("Vectorized centroid failed - falling back to processing "
+                  "features one at a time")
+        return _processor(feats, skip_failures)
+
+    # Geometries received as WKB are sent back the same way.  See `transport`.
+    if feats and isinstance(feats[0]['geometry'], BaseGeometry):
+        for feat, geom in zip(feats, centroids.tolist()):
+            feat['geometry'] = geom
+        return feats
+
+    empty = shapely.is_empty(centroids)
+    coordinates = iter(shapely.get_coordinates(centroids).tolist())
+
+    for feat, is_empty in zip(feats, empty.tolist()):
+        feat['geometry'] = {
+            'type': 'Point',
+            'coordinates': () if is_empty else tuple(next(coordinates))
+        }
+
+    return feats
 
 
 @click.command(name='centroid')
 @options.infile
 @options.outfile
 @options.driver
+@options.src_crs
+@click.option(
+    '--engine', type=click.Choice(['rowwise', 'vectorized']), default='rowwise',
+    callback=_cb_engine,
+    help="Compute centroids one feature at a time or for an entire batch at once.  The "
+         "vectorized engine requires NumPy and Shapely >= 2 and benefits from a larger "
+         "`--batch-size`. (default: rowwise)"
+)
 @options.jobs
+@options.batch_size
+@options.batch_cost
+@options.transport
+@options.shared_memory
+@options.preserve_order
+@options.reorder_buffer
+@options.write_batch_size
+@options.max_inflight
+@options.start_method
+@options.maxtasksperchild
+@options.partitioned_read
+@options.shard_output
+@options.stats
+@options.stats_interval
+@options.profile
 @options.skip_failures
 @click.pass_context
-def centroid(ctx, infile, outfile, driver, skip_failures, jobs):
+def centroid(ctx, infile, outfile, driver, src_crs, engine, skip_failures, jobs, batch_size,
+             batch_cost, transport_format, shared_memory, preserve_order, reorder_buffer,
+             write_batch_size, max_inflight, start_method, maxtasksperchild, partitioned_read,
+             shard_output, show_stats, stats_interval, profile):
 
     """
     Compute geometric centroids.
+
+    Use Shapely's vectorized operations to process each batch at once:
+    \b
+        $ fio centroid ${INFILE} ${OUTFILE} \\
+            --engine vectorized \\
+            --batch-size 10000
     """
 
     helpers.set_verbosity(ctx, log)
 
-    with fio.open(infile, 'r') as src:
+    if shard_output and not outfile.lower().endswith('.vrt'):
+        raise click.BadParameter("OUTFILE must end with `.vrt`", param_hint='--shard-output')
+
+    if shared_memory:
+        if engine != 'vectorized':
+            raise click.BadParameter(
+                "requires `--engine vectorized`", param_hint='--shared-memory')
+        elif transport_format != 'geojson':
+            raise click.BadParameter(
+                "cannot be combined with `--transport`", param_hint='--shared-memory')
+        elif not sharedmem.HAS_SHARED_MEMORY:
+            raise click.BadParameter("requires Python >= 3.8", param_hint='--shared-memory')
+
+    with stream.open_input(infile) as src:
 
         meta = copy.deepcopy(src.meta)
         meta.update(
             driver=driver or src.driver,
         )
+        meta['schema'].update(geometry='Point')
+        if src_crs:
+            meta['crs'] = src_crs
+            # Fiona prefers `crs_wkt` over `crs` so the input CRS would win
+            meta.pop('crs_wkt', None)
 
         log.debug("Creating output file %s" % outfile)
         log.debug("Meta=%s" % meta)
 
-        with fio.open(outfile, 'w', **meta) as dst:
+        run_stats = None
+        if show_stats or stats_interval:
+            run_stats = stats.Stats(jobs, interval=stats_interval)
+
+        try:
+            shards = shard.Shards(meta, outfile) if shard_output else None
+            execute_inflight, write_inflight = executor.split_inflight(max_inflight)
+            with (shards or stream.open_output(outfile, **meta)) as dst, \
+                    writer.Writer(dst, batch_size=write_batch_size,
+                                  max_inflight=write_inflight, stats=run_stats) as sink:
+
+                job = {
+                    'skip_failures': skip_failures
+                }
+
+                if engine == 'vectorized':
+                    processor = _vectorized_processor
+                else:
+                    processor = _processor
+                log.debug("Using %s engine" % engine)
+
+                wire = None
+                if shared_memory:
+                    wire = sharedmem.SharedMemoryTransport()
+                elif transport_format == 'wkb':
+                    wire = transport.WKBTransport(src.schema, meta['schema'])
+
+                features = helpers.as_dicts(src)
+                if partitioned_read:
+                    features = partition.partitions(src, infile) or features
 
-            task_generator = ({
-                'feat': feat,
-                'skip_failures': skip_failures
-            } for feat in src)
+                for o_feat in executor.execute(
+                        processor, features, job, jobs=jobs,
+                        batch_size=batch_size, preserve_order=preserve_order,
+                        reorder_buffer=reorder_buffer,
+                        max_inflight=execute_inflight, start_method=start_method,
+                        maxtasksperchild=maxtasksperchild,
+                        shards=shards,
+                        stats=run_stats, profile=profile,
+                        batch_cost=batch_cost,
+                        transport=wire):
+                    sink.write(o_feat)
 
-            for o_feat in Pool(jobs).imap_unordered(_processor, task_generator):
-                if o_feat is not None:
-                    dst.write(o_feat)
+            if run_stats is not None:
+                run_stats.report(final=True)
+        finally:
+            # Stop periodic reports even if processing failed
+            if run_stats is not None:
+                run_stats.close()
 
 
 if __name__ == '__main__':
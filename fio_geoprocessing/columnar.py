@@ -0,0 +1,342 @@
+"""
+Evaluate filter expressions against columns of properties rather than one
+feature at a time.
+
+Only a restricted subset of Python is supported: property names, constants,
+comparisons, membership tests against literal containers, arithmetic, and
+boolean operators.  The expression's AST is rewritten so these operate on
+NumPy arrays and produce a boolean mask.
+"""
+
+
+import ast
+import copy
+import operator
+from operator import itemgetter
+
+import numpy as np
+
+
+# Cached output from `translate()`.  Each worker has its own cache.
+_TRANSLATED = {}
+
+
+_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+
+# Operators that can overflow fixed width integers, by `operator` name.  See
+# `_arith()`.
+_INT_BINOPS = {
+    ast.Add: 'add',
+    ast.Sub: 'sub',
+    ast.Mult: 'mul',
+    ast.Pow: 'pow'
+}
+
+# Types of the values in a membership test's container that `numpy.isin()`
+# compares like Python does, by the kind of the array being tested.
+_ISIN_TYPES = {
+    'b': (bool, ),
+    'i': (bool, int),
+    'u': (bool, int),
+    'f': (bool, int, float)
+}
+_COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+class NotTranslatable(Exception):
+
+    """
+    Raised when an expression cannot be evaluated as array operations.
+    """
+
+
+def _bool(value):
+
+    """
+    Elementwise truthiness, with Python semantics for strings and objects.
+    """
+
+    value = np.asarray(value)
+    if value.dtype.kind in 'OSU':
+        return np.fromiter(map(bool, value.ravel()), dtype=bool, count=value.size).reshape(
+            value.shape)
+    return value.astype(bool)
+
+
+def _isin(value, container):
+
+    """
+    Elementwise `value in container`.
+    """
+
+    value = np.asarray(value)
+    types = _ISIN_TYPES.get(value.dtype.kind)
+    if types is not None and all(isinstance(v, types) for v in container):
+        return np.isin(value, list(container))
+
+    # `numpy.isin()` would convert a mixed container like `(1, 'a')` to
+    # strings and match nothing
+    try:
+        contains = frozenset(container).__contains__
+    except TypeError:
+        contains = container.__contains__
+    return np.fromiter(map(contains, value.tolist()), dtype=bool, count=value.size)
+
+
+def _arith(name, left, right):
+
+    """
+    Elementwise `left <op> right` for one of the `operator` functions in
+    `_INT_BINOPS`.  NumPy's fixed width integers silently wrap around on
+    overflow, so when both operands are integers they are operated on as
+    Python objects instead.
+    """
+
+    left_kind = np.asarray(left).dtype.kind
+    right_kind = np.asarray(right).dtype.kind
+    if left_kind in 'biu' and right_kind in 'biuO':
+        left = np.asarray(left).astype(object)
+    if right_kind in 'biu' and left_kind in 'biuO':
+        right = np.asarray(right).astype(object)
+    return getattr(operator, name)(left, right)
+
+
+def _is(value, other):
+
+    """
+    Elementwise `value is other`.
+    """
+
+    value = np.asarray(value)
+    if value.dtype.kind != 'O':
+        return np.zeros(value.shape, dtype=bool)
+    return np.array([v is other for v in value], dtype=bool)
+
+
+def _column(properties, name):
+
+    """
+    Extract a single property from every feature into an array.  Strings are
+    kept as Python objects, which is much faster than converting to a fixed
+    width unicode array.
+    """
+
+    values = list(map(itemgetter(name), properties))
+    if values and isinstance(values[0], str):
+        return np.array(values, dtype=object)
+    return np.array(values)
+
+
+def _call(name, *args):
+
+    """
+    Build an AST node calling one of the helpers above.
+    """
+
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=list(args), keywords=[])
+
+
+def _constant(node):
+
+    """
+    Get the value of a literal node or raise `NotTranslatable`.
+    """
+
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise NotTranslatable("not a literal: {}".format(ast.dump(node)))
+
+
+class _Translator(ast.NodeTransformer):
+
+    """
+    Rewrite an expression's AST to operate on columns.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = fields
+        self.names = set()
+
+    def generic_visit(self, node):
+        raise NotTranslatable("unsupported syntax: {}".format(type(node).__name__))
+
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+
+    def _column(self, name):
+        if self.fields is not None and name not in self.fields:
+            raise NotTranslatable("not a property: {}".format(name))
+        self.names.add(name)
+        return ast.Subscript(
+            value=ast.Name(id='_columns', ctx=ast.Load()),
+            slice=ast.Constant(value=name),
+            ctx=ast.Load())
+
+    def visit_Name(self, node):
+        if node.id in ('feat', 'props'):
+            raise NotTranslatable("references the entire {}".format(node.id))
+        return self._column(node.id)
+
+    def visit_Subscript(self, node):
+        # props['field']
+        if isinstance(node.value, ast.Name) and node.value.id == 'props':
+            key = node.slice
+            if isinstance(key, getattr(ast, 'Index', ())):
+                key = key.value
+            if isinstance(key, ast.Constant) and isinstance(key.value, str):
+                return self._column(key.value)
+        raise NotTranslatable("unsupported subscript")
+
+    def visit_Constant(self, node):
+        return node
+
+    def visit_BoolOp(self, node):
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        values = [_call('_bool', self.visit(v)) for v in node.values]
+        result = values[0]
+        for value in values[1:]:
+            result = ast.BinOp(left=result, op=op, right=value)
+        return result
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=_call('_bool', self.visit(node.operand)))
+        elif isinstance(node.op, (ast.USub, ast.UAdd)):
+            node.operand = self.visit(node.operand)
+            return node
+        raise NotTranslatable("unsupported operator: {}".format(type(node.op).__name__))
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, _BINOPS):
+            raise NotTranslatable("unsupported operator: {}".format(type(node.op).__name__))
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        name = _INT_BINOPS.get(type(node.op))
+        if name is not None:
+            return _call('_arith', ast.Constant(value=name), node.left, node.right)
+        return node
+
+    def _compare(self, left, op, right):
+        # Operands in the middle of a chained comparison appear twice
+        left = copy.deepcopy(left)
+        right = copy.deepcopy(right)
+        if isinstance(op, _COMPARISONS):
+            return ast.Compare(left=self.visit(left), ops=[op], comparators=[self.visit(right)])
+        elif isinstance(op, (ast.In, ast.NotIn)):
+            container = _constant(right)
+            if not isinstance(container, (list, tuple, set, frozenset)):
+                raise NotTranslatable("membership tests require a literal list, tuple, or set")
+            result = _call('_isin', self.visit(left), ast.Constant(value=tuple(container)))
+            if isinstance(op, ast.NotIn):
+                result = ast.UnaryOp(op=ast.Invert(), operand=result)
+            return result
+        elif isinstance(op, (ast.Is, ast.IsNot)):
+            if _constant(right) is not None:
+                raise NotTranslatable("identity tests are only supported against None")
+            result = _call('_is', self.visit(left), ast.Constant(value=None))
+            if isinstance(op, ast.IsNot):
+                result = ast.UnaryOp(op=ast.Invert(), operand=result)
+            return result
+        raise NotTranslatable("unsupported comparison: {}".format(type(op).__name__))
+
+    def visit_Compare(self, node):
+        # a < b < c -> (a < b) & (b < c)
+        operands = [node.left] + node.comparators
+        result = None
+        for left, op, right in zip(operands, node.ops, operands[1:]):
+            comparison = self._compare(left, op, right)
+            if result is None:
+                result = comparison
+            else:
+                result = ast.BinOp(left=result, op=ast.BitAnd(), right=comparison)
+        return result
+
+
+def translate(expressions, fields=None):
+
+    """
+    Translate filter expressions into a function that operates on columns.
+
+    Parameters
+    ----------
+    expressions : tuple
+        Pythonic expressions that evaluate as `True` or `False`.  Combined
+        with `and`.
+    fields : list, optional
+        Property names available to the expressions.  Any other name causes
+        `NotTranslatable` to be raised.
+
+    Raises
+    ------
+    NotTranslatable
+        If any part of an expression cannot be evaluated as array operations.
+
+    Returns
+    -------
+    tuple
+        `(code, names)` where `code` is a code object to evaluate with a
+        `_columns` dictionary in scope and `names` are the property names it
+        reads.
+    """
+
+    if not expressions:
+        raise NotTranslatable("no expressions")
+
+    source = ' and '.join('(\n{expr}\n)'.format(expr=expr) for expr in expressions)
+    translator = _Translator(fields=fields)
+    tree = translator.visit(ast.parse(source, mode='eval'))
+    tree = ast.fix_missing_locations(tree)
+
+    return compile(tree, '<expr>', 'eval'), sorted(translator.names)
+
+
+def evaluate(expressions, properties):
+
+    """
+    Evaluate filter expressions against many features' properties at once.
+
+    Parameters
+    ----------
+    expressions : tuple
+        Passed to `translate()`.
+    properties : list
+        One properties dictionary per feature.
+
+    Raises
+    ------
+    NotTranslatable
+        See `translate()`.
+    Exception
+        Anything raised while evaluating the expressions, including
+        `FloatingPointError` for operations that would have raised in Python,
+        like division by zero.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask with one element per feature.
+    """
+
+    key = tuple(expressions)
+    try:
+        code, names = _TRANSLATED[key]
+    except KeyError:
+        code, names = _TRANSLATED[key] = translate(key)
+
+    scope = {
+        '_columns': {name: _column(properties, name) for name in names},
+        '_bool': _bool,
+        '_isin': _isin,
+        '_is': _is,
+        '_arith': _arith,
+        '__builtins__': {}
+    }
+    with np.errstate(all='raise'):
+        result = _bool(eval(code, scope))
+
+    if result.shape != (len(properties), ):
+        result = np.full(len(properties), bool(result))
+
+    return result
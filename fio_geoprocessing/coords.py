@@ -0,0 +1,297 @@
+"""
+Flatten the coordinates of many GeoJSON geometries into contiguous arrays and
+rebuild the geometries from those arrays.  Used to apply a single vectorized
+operation to every vertex in a batch.
+"""
+
+
+import numpy as np
+
+
+# How deeply each geometry type's coordinates are nested, where 0 is a single
+# position and 1 is a list of positions.
+_DEPTH = {
+    'Point': 0,
+    'MultiPoint': 1,
+    'LineString': 1,
+    'MultiLineString': 2,
+    'Polygon': 2,
+    'MultiPolygon': 3,
+}
+
+
+def _flatten(coordinates, depth, xs, ys, zs):
+
+    """
+    Append coordinates to `xs`, `ys`, and `zs` and return the number of
+    positions at each level of nesting.
+    """
+
+    if depth == 0:
+        coordinates = [coordinates]
+    if depth <= 1:
+        for c in coordinates:
+            xs.append(c[0])
+            ys.append(c[1])
+            zs.append(c[2] if len(c) > 2 else 0.0)
+        return len(coordinates)
+    else:
+        return [_flatten(part, depth - 1, xs, ys, zs) for part in coordinates]
+
+
+def _layout(geom, xs, ys, zs):
+
+    """
+    Flatten a single geometry and describe its structure.
+    """
+
+    if geom is None:
+        return None
+
+    gtype = geom['type']
+    if gtype == 'GeometryCollection':
+        return gtype, [_layout(g, xs, ys, zs) for g in geom['geometries']], False
+
+    coordinates = geom['coordinates']
+    has_z = _has_z(coordinates, _DEPTH[gtype])
+    return gtype, _flatten(coordinates, _DEPTH[gtype], xs, ys, zs), has_z
+
+
+def _has_z(coordinates, depth):
+
+    """
+    Determine if a geometry's coordinates are 3D by looking at the first
+    position.
+    """
+
+    while depth > 0:
+        if not coordinates:
+            return False
+        coordinates = coordinates[0]
+        depth -= 1
+
+    return len(coordinates) > 2
+
+
+def flatten(geometries):
+
+    """
+    Pack the coordinates of many GeoJSON geometries into flat arrays.
+
+    Parameters
+    ----------
+    geometries : iter
+        GeoJSON-like geometry objects.  `None` is allowed.
+
+    Returns
+    -------
+    tuple
+        `(x, y, z, layouts)` where `x`, `y`, and `z` are `float64` arrays
+        containing every position in every geometry, and `layouts` is a list
+        describing each geometry's structure that can be passed to
+        `rebuild()`.  Positions without a Z value are given `0`.
+    """
+
+    xs = []
+    ys = []
+    zs = []
+    layouts = [_layout(geom, xs, ys, zs) for geom in geometries]
+
+    return (
+        np.array(xs, dtype=np.float64),
+        np.array(ys, dtype=np.float64),
+        np.array(zs, dtype=np.float64),
+        layouts
+    )
+
+
+def bounds(geom):
+
+    """
+    Compute a GeoJSON geometry's bounding box without constructing a GEOS
+    geometry.  If the geometry has a `bbox` member it is used instead.
+
+    Parameters
+    ----------
+    geom : dict
+        GeoJSON-like geometry.
+
+    Returns
+    -------
+    tuple or None
+        `(x_min, y_min, x_max, y_max)` or `None` if the geometry is empty.
+    """
+
+    if geom is None:
+        return None
+    elif geom.get('bbox'):
+        bbox = geom['bbox']
+        if len(bbox) == 6:
+            return bbox[0], bbox[1], bbox[3], bbox[4]
+        return tuple(bbox)
+
+    xs = []
+    ys = []
+    _layout(geom, xs, ys, [])
+    if not xs:
+        return None
+
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _count(coordinates, depth):
+
+    """
+    Count the positions and the lists of positions, like rings, in nested
+    coordinates.
+    """
+
+    if depth == 0:
+        return 1, 0
+    elif depth == 1:
+        return len(coordinates), 1
+
+    vertices = parts = 0
+    for part in coordinates:
+        v, p = _count(part, depth - 1)
+        vertices += v
+        parts += p
+    return vertices, parts
+
+
+def cost(geom, feature_cost=16, part_cost=4):
+
+    """
+    Estimate the relative cost of processing a GeoJSON geometry from its
+    number of vertices and parts without constructing a GEOS geometry.
+
+    Parameters
+    ----------
+    geom : dict
+        GeoJSON-like geometry.
+    feature_cost : int, optional
+        Fixed cost of any feature, which dominates for points.
+    part_cost : int, optional
+        Cost of each ring or line.
+
+    Returns
+    -------
+    int
+    """
+
+    if geom is None:
+        return feature_cost
+
+    gtype = geom['type']
+    if gtype == 'GeometryCollection':
+        return feature_cost + sum(
+            cost(g, feature_cost=0, part_cost=part_cost) for g in geom['geometries'])
+
+    vertices, parts = _count(geom['coordinates'], _DEPTH[gtype])
+    return feature_cost + vertices + part_cost * parts
+
+
+def _rebuild(counts, depth, positions, offset):
+
+    """
+    Rebuild nested coordinates from a flat list of positions and return the
+    offset of the next unused position.
+    """
+
+    if depth == 0:
+        return positions[offset], offset + 1
+    elif depth == 1:
+        return positions[offset:offset + counts], offset + counts
+    else:
+        parts = []
+        for count in counts:
+            part, offset = _rebuild(count, depth - 1, positions, offset)
+            parts.append(part)
+        return parts, offset
+
+
+def _geometry(layout, positions_2d, positions_3d, offset):
+
+    """
+    Rebuild a single geometry from its layout.
+    """
+
+    if layout is None:
+        return None, offset
+
+    gtype, counts, has_z = layout
+    if gtype == 'GeometryCollection':
+        geometries = []
+        for sub_layout in counts:
+            geom, offset = _geometry(sub_layout, positions_2d, positions_3d, offset)
+            geometries.append(geom)
+        return {'type': gtype, 'geometries': geometries}, offset
+
+    positions = positions_3d if has_z else positions_2d
+    coordinates, offset = _rebuild(counts, _DEPTH[gtype], positions, offset)
+    return {'type': gtype, 'coordinates': coordinates}, offset
+
+
+def has_z(layouts):
+
+    """
+    Determine if any of the geometries described by `layouts` are 3D.
+
+    Parameters
+    ----------
+    layouts : list
+        From `flatten()`.
+
+    Returns
+    -------
+    bool
+    """
+
+    for layout in layouts:
+        if layout is None:
+            continue
+        gtype, counts, geom_has_z = layout
+        if geom_has_z or (gtype == 'GeometryCollection' and has_z(counts)):
+            return True
+
+    return False
+
+
+def rebuild(layouts, x, y, z=None):
+
+    """
+    Rebuild GeoJSON geometries from flat coordinate arrays.  The inverse of
+    `flatten()`.
+
+    Parameters
+    ----------
+    layouts : list
+        From `flatten()`.
+    x : numpy.ndarray
+        X coordinates.
+    y : numpy.ndarray
+        Y coordinates.
+    z : numpy.ndarray, optional
+        Z coordinates.  Only used for geometries that were originally 3D.
+
+    Returns
+    -------
+    list
+        GeoJSON-like geometries in the same order as `layouts`.
+    """
+
+    x = x.tolist()
+    y = y.tolist()
+    positions_2d = list(zip(x, y))
+    if z is not None and has_z(layouts):
+        positions_3d = list(zip(x, y, z.tolist()))
+    else:
+        positions_3d = positions_2d
+
+    geometries = []
+    offset = 0
+    for layout in layouts:
+        geom, offset = _geometry(layout, positions_2d, positions_3d, offset)
+        geometries.append(geom)
+
+    return geometries
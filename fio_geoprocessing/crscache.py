@@ -0,0 +1,296 @@
+"""
+Resolve CRS definitions and cache the results.
+
+CRSes reach the commands as authority codes, PROJ strings, WKT, PROJ-style
+dictionaries, or CRS objects.  Each one is normalized to a canonical
+definition, an authority code like `EPSG:4326` if PROJ can find an exact
+match and WKT otherwise, so equivalent definitions share the same parsed
+`pyproj.CRS()` and `pyproj.Transformer()` objects.  Both are kept in bounded
+per-process LRU caches.
+
+Searching PROJ's database for a matching authority code is the most
+expensive part of normalizing a definition and the answer only depends on
+the PROJ version, so the lookup table can be persisted to the JSON file
+named by the `FIO_GEOPROC_CRS_CACHE` environment variable and reused by
+later runs.
+"""
+
+
+import atexit
+from collections import OrderedDict
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+
+import pyproj
+from pyproj import CRS
+from pyproj import Transformer
+
+
+log = logging.getLogger('fio-geoproc-crscache')
+
+
+# Environment variable naming the file the lookup table is persisted to.
+CACHE_ENV = 'FIO_GEOPROC_CRS_CACHE'
+
+
+class LRUCache(object):
+
+    """
+    A dictionary holding at most `maxsize` items that discards the least
+    recently used item when full.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __getitem__(self, key):
+        value = self._items.pop(key)
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+
+
+# Normalized definitions keyed by `key()`.  Loaded from and saved to the
+# file named by `CACHE_ENV`.
+_TABLE = {}
+_STATE = {
+    'loaded': False,
+    'dirty': False
+}
+
+_CRS = LRUCache(maxsize=64)
+_TRANSFORMERS = LRUCache(maxsize=128)
+
+
+def key(crs):
+
+    """
+    Produce a string cache key for a CRS, which could be a string, a
+    PROJ-style dictionary, or a CRS object.
+
+    Parameters
+    ----------
+    crs : str or dict or CRS
+        A CRS.
+
+    Returns
+    -------
+    str
+    """
+
+    if isinstance(crs, dict):
+        return json.dumps(crs, sort_keys=True)
+    elif hasattr(crs, 'to_wkt'):
+        return crs.to_wkt()
+    else:
+        return str(crs).strip()
+
+
+def _path():
+    return os.environ.get(CACHE_ENV) or None
+
+
+def load(path):
+
+    """
+    Add a lookup table written by `save()` to this process's table.  Tables
+    written by a different PROJ version are ignored.
+
+    Parameters
+    ----------
+    path : str
+        JSON file.
+    """
+
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        log.debug("Could not load CRS cache %s: %s" % (path, e))
+        return
+
+    if data.get('proj') != pyproj.proj_version_str:
+        log.debug("Ignoring CRS cache %s written by PROJ %s" % (path, data.get('proj')))
+        return
+
+    for k, v in data.get('crs', {}).items():
+        _TABLE.setdefault(k, v)
+
+
+def save(path):
+
+    """
+    Write this process's lookup table, merged with whatever is already in
+    the file.  The file is replaced atomically so concurrent jobs sharing a
+    cache never see a partial file.
+
+    Parameters
+    ----------
+    path : str
+        JSON file.
+    """
+
+    load(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another job got there first
+            pass
+
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'proj': pyproj.proj_version_str, 'crs': _TABLE}, f)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+    _STATE['dirty'] = False
+    log.debug("Saved %s CRS definitions to %s" % (len(_TABLE), path))
+
+
+def _save_at_exit(path, pid):
+    # Forked children inherit the handler
+    if _STATE['dirty'] and os.getpid() == pid:
+        try:
+            save(path)
+        except Exception as e:
+            log.debug("Could not save CRS cache %s: %s" % (path, e))
+
+
+def _load_once():
+
+    """
+    Load the lookup table named by `CACHE_ENV` the first time it is needed,
+    and save any additions when the process exits.  Only the main process
+    writes the file.  Workers started with `spawn` or `forkserver` load the
+    table themselves and run `atexit` handlers when they exit, and forked
+    workers inherit the parent's handler, so both are skipped.
+    """
+
+    if _STATE['loaded']:
+        return
+    _STATE['loaded'] = True
+
+    path = _path()
+    if path:
+        load(path)
+        if multiprocessing.current_process().name == 'MainProcess':
+            atexit.register(_save_at_exit, path, os.getpid())
+
+
+def normalize(crs):
+
+    """
+    Get a CRS's canonical definition.
+
+    Parameters
+    ----------
+    crs : str or dict or CRS
+        Anything understood by `pyproj.CRS.from_user_input()`.
+
+    Returns
+    -------
+    str
+        An authority code like `EPSG:4326` if one exactly matches the CRS,
+        otherwise WKT.  If the CRS cannot be parsed it is returned unchanged
+        so the error is reported wherever it is used.
+    """
+
+    _load_once()
+
+    k = key(crs)
+    try:
+        return _TABLE[k]
+    except KeyError:
+        pass
+
+    try:
+        parsed = CRS.from_user_input(crs)
+    except Exception:
+        log.debug("Could not normalize CRS %s" % k)
+        return crs
+
+    authority = parsed.to_authority(min_confidence=100)
+    value = ':'.join(authority) if authority else parsed.to_wkt()
+
+    _TABLE[k] = value
+    _TABLE.setdefault(value, value)
+    _STATE['dirty'] = True
+    _CRS[key(value)] = parsed
+
+    return value
+
+
+def get_crs(crs):
+
+    """
+    Get a cached `pyproj.CRS()`.
+
+    Parameters
+    ----------
+    crs : str or dict or CRS
+        Anything understood by `pyproj.CRS.from_user_input()`.
+
+    Returns
+    -------
+    pyproj.CRS
+    """
+
+    value = normalize(crs)
+    k = key(value)
+    try:
+        return _CRS[k]
+    except KeyError:
+        _CRS[k] = CRS.from_user_input(value)
+        return _CRS[k]
+
+
+def get_transformer(src_crs, dst_crs):
+
+    """
+    Get a cached transformer between two CRSes.
+
+    Parameters
+    ----------
+    src_crs : str or dict or CRS
+        Source CRS.
+    dst_crs : str or dict or CRS
+        Destination CRS.
+
+    Returns
+    -------
+    pyproj.Transformer
+        Expects and produces coordinates in X, Y order regardless of the axis
+        order defined by the CRS.  Produces `inf` for coordinates it cannot
+        reproject unless `transform()` is called with `errcheck=True`, so
+        use the functions in `transform` rather than calling it directly.
+    """
+
+    k = (key(normalize(src_crs)), key(normalize(dst_crs)))
+    try:
+        return _TRANSFORMERS[k]
+    except KeyError:
+        _TRANSFORMERS[k] = Transformer.from_crs(
+            get_crs(src_crs), get_crs(dst_crs), always_xy=True)
+        return _TRANSFORMERS[k]
@@ -0,0 +1,563 @@
+"""
+Shared machinery for sending batches of features through a processor.
+
+Every command has a module level `_processor(feats, **job)` function that
+receives a list of GeoJSON features plus a set of keyword arguments that are
+constant for the entire job, and returns a list of output features.  The
+constant arguments are sent to each worker once via the pool's initializer
+rather than being pickled alongside every feature.
+"""
+
+
+import itertools
+import logging
+from operator import itemgetter
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import coords
+from . import partition
+from . import pool
+from . import sharedmem
+from . import stats
+from . import transport as transport_
+
+
+log = logging.getLogger('fio-geoproc-executor')
+
+
+# Per-worker state.  Set by `_initializer()` when a worker starts.
+_PROCESSOR = None
+_JOB = None
+_PARTITIONS = None
+_SHARDS = None
+_TRANSPORT = None
+
+# Tells the consumer of `_read_ahead()` that the reader thread is finished.
+_DONE = object()
+
+
+def _initializer(processor, job, partitions=None, shards=None, profile=None,
+                 transport=None):
+
+    """
+    Pool initializer.  Stores the processor and the job's constant arguments
+    in the worker's global scope so they only cross the process boundary once.
+
+    Parameters
+    ----------
+    processor : callable
+        A module level function that can be pickled by reference.
+    job : dict
+        Keyword arguments for `processor`.
+    partitions : partition.Partitions, optional
+        When set, tasks are ranges of features the worker reads itself rather
+        than batches of features.
+    shards : shard.Shards, optional
+        When set, output features are written to the worker's own shard
+        rather than being returned.
+    profile : str, optional
+        Directory for cProfile output.  See `stats.profile()`.
+    transport : transport.WKBTransport or sharedmem.SharedMemoryTransport, optional
+        When set, batches of features arrive and are returned encoded.
+    """
+
+    global _PROCESSOR
+    global _JOB
+    global _PARTITIONS
+    global _SHARDS
+    global _TRANSPORT
+    _PROCESSOR = processor
+    _JOB = job
+    _PARTITIONS = partitions
+    _SHARDS = shards
+    _TRANSPORT = transport
+
+    if profile:
+        stats.profile(profile)
+    pool.warm_up(job)
+
+
+class _Budget(object):
+
+    """
+    Like a semaphore, but acquired and released in amounts, so the number of
+    features in flight can be limited even when batches vary in size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._available = size
+        self._condition = threading.Condition()
+
+    def acquire(self, amount):
+        # A batch larger than the entire budget waits until nothing else is
+        # in flight rather than forever
+        amount = min(amount, self.size)
+        with self._condition:
+            while self._available < amount:
+                self._condition.wait()
+            self._available -= amount
+
+    def release(self, amount):
+        amount = min(amount, self.size)
+        with self._condition:
+            self._available += amount
+            self._condition.notify_all()
+
+
+def _size(batch):
+
+    """
+    Get the number of input features in a batch as it is sent to a worker.
+    """
+
+    if isinstance(batch, sharedmem.Block):
+        return len(batch.feats)
+    elif isinstance(batch, tuple):
+        # A range from `partition.Partitions.ranges()`
+        start, stop = batch
+        return stop - start
+    return len(batch)
+
+
+def _run_batch(batch):
+
+    """
+    Process a single batch inside of a worker.
+
+    Parameters
+    ----------
+    batch : list or tuple
+        GeoJSON features, WKB records from `_TRANSPORT`, or a range to read
+        from `_PARTITIONS`.
+
+    Returns
+    -------
+    tuple
+        `(output features, info)` where `info` contains the size of the batch
+        as it was sent, the number of features read, processed, and produced
+        plus everything recorded by `stats.collect()`.  See
+        `stats.Stats.update()`.
+    """
+
+    size = _size(batch)
+    read = 0
+    if _PARTITIONS is not None:
+        start = time.time()
+        batch = _PARTITIONS.read(batch)
+        stats.timing('read', time.time() - start)
+        read = len(batch)
+    elif _TRANSPORT is not None:
+        start = time.time()
+        batch = _TRANSPORT.decode(batch)
+        stats.timing('decode', time.time() - start)
+
+    result = []
+    if batch:
+        start = time.time()
+        result = _PROCESSOR(batch, **_JOB)
+        stats.timing('process', time.time() - start)
+    produced = len(result)
+
+    if _SHARDS is not None and result:
+        start = time.time()
+        if isinstance(result, sharedmem.Batch):
+            result.fill()
+        _SHARDS.write(transport_.as_geojson(result))
+        stats.timing('write', time.time() - start)
+        result = []
+    if _TRANSPORT is not None:
+        start = time.time()
+        result = _TRANSPORT.encode(result, output=True)
+        stats.timing('encode', time.time() - start)
+
+    info = stats.collect()
+    info.update(size=size, read=read, processed=len(batch), produced=produced)
+    return result, info
+
+
+def _run_sequenced(task):
+
+    """
+    Like `_run_batch()` but for a batch tagged with a sequence number.
+
+    Parameters
+    ----------
+    task : tuple
+        `(sequence number, batch)`
+
+    Returns
+    -------
+    tuple
+        `(sequence number, (output features, info))`
+    """
+
+    seq, batch = task
+    return seq, _run_batch(batch)
+
+
+def _ordered(workers, batches):
+
+    """
+    Process batches in parallel but produce results in the order the batches
+    were read.
+
+    Batches are tagged with a sequence number and results that complete out
+    of order are held in a reorder buffer until all of the preceding batches
+    are available.  The size of the buffer is bounded by the number of
+    features `_read_ahead()` allows to be in flight.
+
+    Parameters
+    ----------
+    workers : multiprocessing.pool.Pool
+        Pool initialized with `_initializer()`.
+    batches : iter
+        Lists of features.
+
+    Yields
+    ------
+    tuple
+        `(output features, info)` for each batch.
+    """
+
+    buffered = {}
+    next_seq = 0
+    for seq, result in workers.imap_unordered(_run_sequenced, enumerate(batches)):
+        buffered[seq] = result
+        while next_seq in buffered:
+            yield buffered.pop(next_seq)
+            next_seq += 1
+
+
+def _read_ahead(batches, budget, stats=None):
+
+    """
+    Read batches on a background thread so decoding features overlaps with
+    processing and writing.
+
+    The reader acquires each batch's size from `budget` before handing it
+    off and the caller is responsible for releasing it once the batch's
+    output has been handed off, so no more than the budget's worth of
+    features, plus the batch waiting for room, can be in flight between the
+    reader and the writer.  Without this the pool's task handler thread
+    would drain the input as fast as it can be read.
+
+    Parameters
+    ----------
+    batches : iter
+        Lists of features.
+    budget : _Budget
+        Limits the number of features in flight.  See `_size()`.
+    stats : stats.Stats, optional
+        Records time spent reading and the queue's depth.
+
+    Yields
+    ------
+    list
+        Batches in the order they were read.
+    """
+
+    # Bounded by `budget`
+    pending = queue.Queue()
+    errors = []
+    if stats is not None:
+        stats.queue('read', pending.qsize)
+
+    def reader():
+        try:
+            while True:
+                start = time.time()
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                if stats is not None:
+                    # Ranges of features from `partition` are read by workers
+                    stats.add('read', time.time() - start,
+                              read=len(batch) if isinstance(batch, list) else 0)
+                budget.acquire(_size(batch))
+                pending.put(batch)
+        except Exception as e:
+            errors.append(e)
+        pending.put(_DONE)
+
+    thread = threading.Thread(target=reader, name='fio-geoproc-reader')
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        batch = pending.get()
+        if batch is _DONE:
+            break
+        yield batch
+
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def batched(iterable, size):
+
+    """
+    Group an iterable into lists containing at most `size` elements.
+
+    Parameters
+    ----------
+    iterable : iter
+        Items to group.
+    size : int
+        Maximum number of items per batch.
+
+    Yields
+    ------
+    list
+    """
+
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            break
+        yield batch
+
+
+def batched_by_cost(features, batch_cost, lookahead=None):
+
+    """
+    Group features into batches with roughly the same estimated processing
+    cost rather than the same number of features.  See `coords.cost()`.
+
+    With `lookahead`, that many features are read at a time and the most
+    expensive are sent first, so a few enormous geometries start early
+    instead of holding up the end of the job.  Features are released as
+    they are batched, so no more than `lookahead` features are held.
+
+    Parameters
+    ----------
+    features : iter
+        GeoJSON features.
+    batch_cost : int
+        Target cost per batch.  A feature that costs more than this is sent
+        in a batch by itself.
+    lookahead : int, optional
+        Number of features to sort by cost.  Features are not reordered if
+        not given.
+
+    Yields
+    ------
+    list
+    """
+
+    iterator = ((coords.cost(feat['geometry']), feat) for feat in features)
+    batch = []
+    total = 0
+    while True:
+        if lookahead:
+            window = list(itertools.islice(iterator, lookahead))
+            if not window:
+                break
+            # Most expensive last so they can be popped
+            window.sort(key=itemgetter(0))
+            pairs = (window.pop() for _ in range(len(window)))
+        else:
+            pairs = iterator
+
+        # A partial batch carries over into the next window
+        for feat_cost, feat in pairs:
+            batch.append(feat)
+            total += feat_cost
+            if total >= batch_cost:
+                yield batch
+                batch = []
+                total = 0
+
+        if not lookahead:
+            break
+
+    if batch:
+        yield batch
+
+
+def split_inflight(max_inflight):
+
+    """
+    Divide `--max-inflight` between `execute()` and `writer.Writer()` so
+    together they hold no more than `max_inflight` features.
+
+    Parameters
+    ----------
+    max_inflight : int
+        Features that can be held between reading and writing.
+
+    Returns
+    -------
+    tuple
+        `(for execute(), for writer.Writer())`
+    """
+
+    write = max(1, max_inflight // 2)
+    return max(1, max_inflight - write), write
+
+
+def execute(processor, features, job, jobs=1, batch_size=100, preserve_order=False,
+            reorder_buffer=10000, max_inflight=10000, start_method=None,
+            maxtasksperchild=None, shards=None, stats=None, profile=None, batch_cost=None,
+            transport=None):
+
+    """
+    Send features through a processor in batches, optionally in parallel.
+
+    When `jobs` is `1` batches are processed in the current process,
+    otherwise they are distributed across a pool of `jobs` workers and
+    results are produced in the order they complete, unless `preserve_order`
+    is set.
+
+    Parameters
+    ----------
+    processor : callable
+        Function like `processor(feats, **job)` that returns a list of output
+        features.  Must be defined at the module level so it can be pickled.
+    features : iter or partition.Partitions
+        GeoJSON features to process.  Given partitions, workers read ranges
+        of `batch_size` features directly from the input instead.
+    job : dict
+        Keyword arguments that are constant for the entire job.
+    jobs : int, optional
+        Number of worker processes.
+    batch_size : int, optional
+        Number of features sent to a worker per task.
+    preserve_order : bool, optional
+        Produce output features in the same order as the input features.
+    reorder_buffer : int, optional
+        When preserving order, the maximum number of features held in memory
+        while waiting on earlier batches.  Raised to `jobs * batch_size` if
+        lower so every worker has something to do.
+    max_inflight : int, optional
+        Maximum number of features that have been read but whose output has
+        not yet been produced, including features waiting to be sorted by
+        `batch_cost`.  Features are read ahead on a separate thread up to
+        this limit.  Raised to `jobs * batch_size` if lower, unless batching
+        by cost.  See `split_inflight()`.
+    start_method : str, optional
+        Multiprocessing start method for workers.  See
+        `pool.managed_pool()`.
+    maxtasksperchild : int, optional
+        Number of batches processed by a worker before it is replaced.
+    shards : shard.Shards, optional
+        With `jobs > 1`, each worker writes its output to its own shard and
+        nothing is produced.  The caller writes the VRT once this returns.
+        See `shard.Shards.write_vrt()`.  Order is not preserved.
+    stats : stats.Stats, optional
+        Record counts and time spent reading, waiting on results, and
+        processing.  With `jobs == 1` waiting includes processing.
+    profile : str, optional
+        Profile each worker, or the current process when `jobs == 1`, and
+        write the results to this directory.
+    batch_cost : int, optional
+        Form batches by estimated cost instead of `batch_size`, and unless
+        preserving order, send the most expensive features in each half of
+        `max_inflight` features first.  See `batched_by_cost()`.
+    transport : transport.WKBTransport or sharedmem.SharedMemoryTransport, optional
+        With `jobs > 1`, send features to and from workers as WKB records or
+        through shared memory rather than as GeoJSON.  Features are encoded
+        on the reader thread and decoded just before they are produced.
+
+    Yields
+    ------
+    dict
+        Output GeoJSON features.
+    """
+
+    if shards is not None and jobs == 1:
+        log.debug("Only one job, producing features instead of writing shards")
+        shards = None
+    elif shards is not None and preserve_order:
+        log.warning("Cannot preserve order when writing shards")
+        preserve_order = False
+
+    if transport is not None and jobs == 1:
+        log.debug("Only one job, not encoding features")
+        transport = None
+
+    limit = max_inflight
+    if preserve_order and jobs > 1:
+        limit = min(limit, reorder_buffer)
+
+    if isinstance(features, partition.Partitions):
+        partitions = features
+        batches = partitions.ranges(batch_size)
+        if batch_cost:
+            log.warning("Cannot batch by cost when workers read their own partitions")
+            batch_cost = None
+    elif batch_cost:
+        partitions = None
+        lookahead = None
+        if not preserve_order:
+            # Features waiting to be sorted count against the limit
+            lookahead = max(1, limit // 2)
+            limit = max(1, limit - lookahead)
+            log.debug("Sorting %s features at a time by cost" % lookahead)
+        batches = batched_by_cost(features, batch_cost, lookahead=lookahead)
+    else:
+        partitions = None
+        batches = batched(features, batch_size)
+
+    # Batches by cost vary in size, so there is no minimum that guarantees
+    # every worker has something to do
+    if not batch_cost:
+        limit = max(limit, jobs * batch_size)
+    log.debug("Allowing %s features in flight" % limit)
+
+    # Workers read their own partitions as GeoJSON, but still send WKB back
+    if transport is not None and partitions is None:
+        batches = (transport.encode(batch) for batch in batches)
+
+    budget = _Budget(limit)
+    batches = _read_ahead(batches, budget, stats=stats)
+
+    def produce(results):
+        results = iter(results)
+        while True:
+            start = time.time()
+            try:
+                result, info = next(results)
+            except StopIteration:
+                break
+            if stats is not None:
+                stats.add('wait', time.time() - start)
+                stats.update(info)
+            if transport is not None:
+                result = transport.decode(result, output=True)
+            for o_feat in result:
+                yield o_feat
+            budget.release(info['size'])
+
+    initargs = (processor, job, partitions, shards, profile, transport)
+
+    if jobs == 1:
+        _initializer(*initargs)
+        try:
+            for o_feat in produce(_run_batch(batch) for batch in batches):
+                yield o_feat
+        finally:
+            if partitions is not None:
+                partitions.close()
+        return
+
+    try:
+        with pool.managed_pool(jobs, _initializer, initargs, start_method=start_method,
+                               maxtasksperchild=maxtasksperchild) as workers:
+            if preserve_order:
+                results = _ordered(workers, batches)
+            else:
+                results = workers.imap_unordered(_run_batch, batches)
+            for o_feat in produce(results):
+                yield o_feat
+    finally:
+        if transport is not None:
+            transport.close()
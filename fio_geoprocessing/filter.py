@@ -6,21 +6,65 @@ Core components for `fio filter`.
 """
 
 
+import ast
 import copy
+import itertools
+import json
 import logging
-from multiprocessing import Pool
+from operator import itemgetter
 
 import click
 import fiona as fio
-
-from . import options
+import numpy as np
+import shapely
+from shapely.geometry import box
+from shapely.geometry import shape
+from shapely.prepared import prep
+import shapely.wkt
+
+from . import columnar
+from . import coords
+from . import executor
 from . import helpers
+from . import options
+from . import partition
+from . import shard
+from . import stats
+from . import stream
+from . import transform
+from . import transport
+from . import writer
 
 
-logging.basicConfig()
 log = logging.getLogger('fio-geoproc-filter')
 
 
+# Compiled expressions are cached so each worker only compiles them once.
+_PREDICATES = {}
+
+# Global scope for evaluating expressions.  Contains modules, which cannot be
+# pickled, so each worker builds its own.  See `_get_global_scope()`.
+_GLOBAL_SCOPE = {}
+
+# Spatial indexes built from `--mask`.  Also cached per worker.
+_MASKS = {}
+
+# Spatial predicates supported by `--predicate`.  Maps each predicate to its
+# inverse so the test can be performed with the prepared mask geometry as the
+# first argument, or `None` if there is no inverse.
+_SPATIAL_PREDICATES = {
+    'intersects': 'intersects',
+    'within': 'contains',
+    'contains': 'within',
+    'covers': 'covered_by',
+    'covered_by': 'covers',
+    'crosses': 'crosses',
+    'overlaps': 'overlaps',
+    'touches': 'touches',
+    'contains_properly': None,
+}
+
+
 def _cb_bbox(ctx, param, value):
 
     """
@@ -36,118 +80,605 @@ def _cb_bbox(ctx, param, value):
     return value
 
 
-def _processor(args):
+def _cb_within_geom(ctx, param, value):
+
+    """
+    Click callback to parse `--within-geom` into a Shapely geometry.
+    """
+
+    if value is None:
+        return value
+
+    try:
+        if value.lstrip().startswith('{'):
+            geom = json.loads(value)
+            if geom.get('type') == 'Feature':
+                geom = geom['geometry']
+            return shape(geom)
+        else:
+            return shapely.wkt.loads(value)
+    except Exception as e:
+        raise click.BadParameter("could not parse WKT or GeoJSON: {e}".format(e=e))
+
+
+def _cb_expressions(ctx, param, value):
+
+    """
+    Click callback to ensure `--expr` values are valid Python expressions.
+    """
+
+    for expr in value:
+        try:
+            compile(expr, '<expr>', 'eval')
+        except SyntaxError as e:
+            raise click.BadParameter("invalid expression: {expr}: {e}".format(expr=expr, e=e))
+
+    return value
+
+
+def _global_scope():
+
+    """
+    Build the global scope for evaluating expressions.
+
+    Returns
+    -------
+    dict
+        A dictionary like `globals()` but without access to objects like
+        `exec()`, `execfile()`, `eval()`, `globals()`, etc.
+    """
+
+    scope_blacklist = ('eval', 'compile', 'exec', 'execfile', 'builtin', 'builtins',
+                       '__builtin__', '__builtins__', '__import__', 'globals', 'locals')
+
+    global_scope = {
+        k: v for k, v in globals().items() if k not in ('builtins', '__builtins__')}
+    global_scope['__builtins__'] = {
+        k: v for k, v in globals()['__builtins__'].items() if k not in scope_blacklist}
+    global_scope['builtins'] = global_scope['__builtins__']
+
+    return global_scope
+
+
+def _get_global_scope():
 
     """
-    Apply filter expressions to a filter to determine if it should be written.
+    Get the cached output from `_global_scope()`.
+    """
+
+    if not _GLOBAL_SCOPE:
+        _GLOBAL_SCOPE.update(_global_scope())
+    return _GLOBAL_SCOPE
+
+
+def _compile(expressions):
+
+    """
+    Fuse filter expressions into a single code object like
+    `(expr1) and (expr2) and ...`, which evaluates them in order and stops at
+    the first one that does not pass.
+
+    Parameters
+    ----------
+    expressions : tuple
+        Pythonic expressions that evaluate as `True` or `False`.
+
+    Returns
+    -------
+    tuple
+        `(code, needs_scope)` where `needs_scope` indicates that the
+        expressions reference `feat` or `props`, or could assign to a name, so
+        they must be evaluated against a copy of the feature's properties
+        rather than the properties themselves.
+    """
+
+    if expressions:
+        # Newlines guard against expressions ending with a comment
+        source = ' and '.join('(\n{expr}\n)'.format(expr=expr) for expr in expressions)
+    else:
+        source = 'True'
+
+    tree = ast.parse(source, mode='eval')
+    names = set(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+    assigns = any(
+        isinstance(node, getattr(ast, 'NamedExpr', ())) for node in ast.walk(tree))
+    needs_scope = assigns or 'feat' in names or 'props' in names
+
+    return compile(tree, '<expr>', 'eval'), needs_scope
+
+
+def _get_predicate(expressions):
+
+    """
+    Get the cached output from `_compile()`.
+    """
+
+    key = tuple(expressions)
+    try:
+        return _PREDICATES[key]
+    except KeyError:
+        _PREDICATES[key] = _compile(key)
+        return _PREDICATES[key]
+
+
+def _prefilter(features, geom, predicate, skip_failures):
+
+    """
+    Test features against a geometry while they are being read so rejected
+    features never reach a worker.
+
+    Each feature's bounding box is checked against the geometry's bounding
+    box first, which settles most features without touching GEOS.  The rest
+    are tested against a prepared geometry.
+
+    Parameters
+    ----------
+    features : iter
+        GeoJSON features.
+    geom : shapely.geometry.base.BaseGeometry
+        Geometry to test against.
+    predicate : str
+        Either `intersects` or `within`.  Read as 'feature <predicate> geom'.
+    skip_failures : bool
+        Specifies whether failures should crash or just be logged.
+
+    Yields
+    ------
+    dict
+        Features that satisfied the predicate.
+    """
+
+    prepared = prep(geom)
+    test = prepared.intersects if predicate == 'intersects' else prepared.contains
+    g_x_min, g_y_min, g_x_max, g_y_max = geom.bounds
+
+    # A feature whose bounding box is inside a rectangle also intersects it
+    is_rectangle = geom.equals(box(*geom.bounds))
+
+    for feat in features:
+        try:
+            bounds = coords.bounds(feat['geometry'])
+            if bounds is None:
+                continue
+            x_min, y_min, x_max, y_max = bounds
+
+            if x_max < g_x_min or x_min > g_x_max or y_max < g_y_min or y_min > g_y_max:
+                continue
+
+            inside = (x_min >= g_x_min and x_max <= g_x_max
+                      and y_min >= g_y_min and y_max <= g_y_max)
+            if predicate == 'within' and not inside:
+                continue
+            elif predicate == 'intersects' and inside and is_rectangle:
+                yield feat
+            elif test(shape(feat['geometry'])):
+                yield feat
+
+        except Exception:
+            log.exception("Feature with ID %s failed" % feat.get('id'))
+            if not skip_failures:
+                raise
+            stats.failure()
+
+
+def _get_mask(mask):
+
+    """
+    Get a cached spatial index and prepared geometries for `--mask`.
+
+    Parameters
+    ----------
+    mask : tuple
+        Mask geometries as WKB.
+
+    Returns
+    -------
+    tuple
+        `(shapely.STRtree, numpy.ndarray)`
+    """
+
+    try:
+        return _MASKS[mask]
+    except KeyError:
+        geoms = shapely.from_wkb(list(mask))
+        shapely.prepare(geoms)
+        _MASKS[mask] = shapely.STRtree(geoms), geoms
+        return _MASKS[mask]
+
+
+def _spatial_filter(feats, skip_failures, mask, predicate):
+
+    """
+    Find the features satisfying a spatial predicate against at least one of
+    the mask geometries.
+
+    The spatial index is queried for candidates for the entire batch at once,
+    and candidates are then tested with the prepared mask geometries.
+
+    Parameters
+    ----------
+    feats : list
+        GeoJSON features to test against.
+    skip_failures : bool
+        Specifies whether failures should crash or just be logged.
+    mask : tuple
+        Mask geometries as WKB.
+    predicate : str
+        A key from `_SPATIAL_PREDICATES`.  Evaluated like
+        `predicate(feature, mask geometry)`.
+
+    Returns
+    -------
+    list
+        GeoJSON features that satisfied the predicate.
+    """
+
+    tree, mask_geoms = _get_mask(mask)
+
+    candidates = []
+    geoms = []
+    for feat in feats:
+        try:
+            geoms.append(helpers.to_shape(feat['geometry']))
+            candidates.append(feat)
+        except Exception:
+            log.exception("Feature with ID %s failed" % feat.get('id'))
+            if not skip_failures:
+                raise
+            stats.failure()
+
+    geoms = np.array(geoms, dtype=object)
+    geom_idx, mask_idx = tree.query(geoms)
+
+    inverse = _SPATIAL_PREDICATES[predicate]
+    if inverse is None:
+        hits = getattr(shapely, predicate)(geoms[geom_idx], mask_geoms[mask_idx])
+    else:
+        hits = getattr(shapely, inverse)(mask_geoms[mask_idx], geoms[geom_idx])
+
+    keep = np.zeros(len(candidates), dtype=bool)
+    keep[geom_idx[hits]] = True
+
+    return list(itertools.compress(candidates, keep.tolist()))
+
+
+def _processor(feats, skip_failures, expressions, mask=None, predicate='intersects'):
+
+    """
+    Apply filter expressions to a batch of features to determine which should
+    be written.
 
     Expressions are evaluated with `eval()`, a limited global scope, and the
     feature's properties as the local scope with an additional `feat` key that
     contains the entire feature and a `props` key that contains the properties
-    dictionary.
+    dictionary.  All expressions are compiled once per process into a single
+    predicate, and each process builds its own global scope.
 
     Parameters
     ----------
-    args : dict
-        feat : dict
-            GeoJSON feature to test against.
-        skip_failures : bool
-            Specifies whether failures should crash or just be logged.
-        expressions : str
-            Pythonic expressions that evaluate as `True` or `False`.  Expressions
-            are evaluated in order and the feature will only be returned if all
-            evaluate as `True`.
-        global_scope : dict
-            A dictionary like `globals()` but without access to objects like
-            `exec()`, `execfile()`, `eval()`, `globals()`, etc.
+    feats : list
+        GeoJSON features to test against.
+    skip_failures : bool
+        Specifies whether failures should crash or just be logged.
+    expressions : str
+        Pythonic expressions that evaluate as `True` or `False`.  Expressions
+        are evaluated in order and the feature will only be returned if all
+        evaluate as `True`.
+    mask : tuple, optional
+        Geometries as WKB.  Only features satisfying `predicate` against at
+        least one of these geometries are tested against the expressions.
+    predicate : str, optional
+        Spatial predicate for `mask`.  See `_spatial_filter()`.
 
     Returns
     -------
-    dict or None
-        A GeoJSON feature if the expressions passed or `None` if something failed.
+    list
+        GeoJSON features that passed all expressions.
     """
 
-    feat = args['feat']
-    skip_failures = args['skip_failures']
-    expressions = args['expressions']
-    global_scope = args['global_scope']
+    if mask is not None:
+        feats = _spatial_filter(feats, skip_failures, mask, predicate)
+
+    code, needs_scope = _get_predicate(expressions)
+    global_scope = _get_global_scope()
+
+    output = []
+    for feat in feats:
+
+        local_scope = feat.get('properties') or {}
+        if needs_scope:
+            local_scope = dict(local_scope)
+            if 'feat' not in local_scope:
+                local_scope['feat'] = feat
+            if 'props' not in local_scope:
+                local_scope['props'] = local_scope
 
-    props = feat.get('properties', {}).copy()
-    local_scope = props
-    if 'feat' not in local_scope:
-        local_scope['feat'] = feat
-    if 'props' not in local_scope:
-        local_scope['props'] = props
+        try:
+            if eval(code, global_scope, local_scope):
+                output.append(feat)
+        except Exception:
+            log.exception("Feature with ID %s failed" % feat.get('id'))
+            if not skip_failures:
+                raise
+            stats.failure()
+
+    return output
+
+
+def _vectorized_processor(feats, skip_failures, expressions, mask=None,
+                          predicate='intersects'):
+
+    """
+    Like `_processor()` but evaluates the expressions against columns of
+    properties for the entire batch at once.  See `columnar.evaluate()`.
+
+    If anything in the batch fails the entire batch is handed to
+    `_processor()`, which handles failures on a per-feature basis.
+
+    Parameters
+    ----------
+    feats : list
+        GeoJSON features to test against.
+    skip_failures : bool
+        Specifies whether failures should crash or just be logged.
+    expressions : str
+        Expressions that can be translated by `columnar.translate()`.
+    mask : tuple, optional
+        See `_processor()`.
+    predicate : str, optional
+        See `_processor()`.
+
+    Returns
+    -------
+    list
+        GeoJSON features that passed all expressions.
+    """
+
+    if mask is not None:
+        feats = _spatial_filter(feats, skip_failures, mask, predicate)
 
     try:
-        for expr in expressions:
-            result = eval(expr, global_scope, local_scope)
-            if not result:
-                break
-        else:
-            return feat
+        keep = columnar.evaluate(expressions, list(map(itemgetter('properties'), feats)))
     except Exception:
-        log.exception("Feature with ID %s failed" % feat.get('id'))
-        if not skip_failures:
-            raise
+        keep = None
+
+    if keep is None:
+        log.debug("Vectorized filter failed - falling back to evaluating features "
+                  "one at a time")
+        return _processor(feats, skip_failures, expressions)
+
+    return list(itertools.compress(feats, keep.tolist()))
+
+
+def _load_mask(path, crs):
+
+    """
+    Read geometries for `--mask`.
+
+    Parameters
+    ----------
+    path : str
+        Datasource containing mask geometries.
+    crs : str or dict or CRS
+        Reproject mask geometries to this CRS if necessary.
+
+    Returns
+    -------
+    tuple
+        Geometries as WKB, which is compact and fast to send to workers.
+    """
+
+    if not hasattr(shapely, 'STRtree') or not hasattr(shapely, 'from_wkb'):
+        raise click.BadParameter("requires Shapely >= 2", param_hint='--mask')
+
+    with fio.open(path) as src:
+        log.debug("Loading mask geometries from %s" % path)
+        to_crs = transform.get_shape_transformer(src.crs, crs)
+        geoms = []
+        for feat in src:
+            if feat['geometry'] is None:
+                continue
+            geom = shape(feat['geometry'])
+            if to_crs is not None:
+                geom = to_crs(geom)
+            geoms.append(geom)
+
+    log.debug("Loaded %s mask geometries" % len(geoms))
+    return tuple(shapely.to_wkb(geoms).tolist())
 
 
 @click.command()
 @options.infile
 @options.outfile
 @click.option(
-    '--expr', 'expressions', multiple=True,
+    '--expr', 'expressions', multiple=True, callback=_cb_expressions,
     help="Python expression that evaluates as boolean.  Multiple expressions can be specified "
          "and are evaluated in order.  Only features that pass all expressoins are written."
 )
 @click.option(
     '--bbox', nargs=4, type=click.FLOAT, metavar="X_MIN Y_MIN X_MAX Y_MAX", callback=_cb_bbox,
-    help="Only process features intersecting the specified bounding box."
+    help="Only process features intersecting the specified bounding box.  With "
+         "`--partitioned-read` each feature's geometry is tested against the box, as with "
+         "`--bbox-exact`."
+)
+@click.option(
+    '--bbox-exact', is_flag=True,
+    help="Test each feature's geometry against `--bbox` rather than its bounding box.  "
+         "Requires `--bbox`."
+)
+@click.option(
+    '--within-geom', metavar='WKT|GEOJSON', callback=_cb_within_geom,
+    help="Only process features within this geometry, given as WKT or GeoJSON in the input "
+         "CRS."
+)
+@click.option(
+    '--vectorized', is_flag=True,
+    help="Evaluate expressions against columns of properties for an entire batch at once.  "
+         "Only property names, literals, comparisons, `in` tests against literal "
+         "containers, arithmetic, and boolean operators are supported.  Other expressions "
+         "are evaluated one feature at a time.  Benefits from a larger `--batch-size`."
+)
+@click.option(
+    '--mask', 'mask_path', metavar='FILE',
+    help="Only process features satisfying `--predicate` against at least one geometry in "
+         "this datasource.  Reprojected to the input CRS if necessary.  Requires "
+         "Shapely >= 2."
+)
+@click.option(
+    '--predicate', type=click.Choice(sorted(_SPATIAL_PREDICATES)), default='intersects',
+    help="Spatial relationship between each feature and the `--mask` geometries.  Read as "
+         "'feature <predicate> mask'. (default: intersects)"
 )
 @options.driver
+@options.src_crs
 @options.skip_failures
 @options.jobs
+@options.batch_size
+@options.batch_cost
+@options.transport
+@options.preserve_order
+@options.reorder_buffer
+@options.write_batch_size
+@options.max_inflight
+@options.start_method
+@options.maxtasksperchild
+@options.partitioned_read
+@options.shard_output
+@options.stats
+@options.stats_interval
+@options.profile
 @click.pass_context
-def filter(ctx, infile, outfile, driver, expressions, skip_failures, jobs, bbox):
+def filter(ctx, infile, outfile, driver, src_crs, expressions, vectorized, mask_path, predicate,
+           skip_failures, jobs, batch_size, batch_cost, transport_format, preserve_order,
+           reorder_buffer, write_batch_size, max_inflight, start_method, maxtasksperchild,
+           partitioned_read, shard_output, show_stats, stats_interval, profile, bbox, bbox_exact,
+           within_geom):
 
     """
     Filter features by expression.
+
+    Evaluate attribute-only expressions as array operations:
+    \b
+        $ fio filter ${INFILE} ${OUTFILE} \\
+            --expr "pop > 1000 and state == 'CO'" \\
+            --vectorized \\
+            --batch-size 10000
+
+    Only keep features within a county polygon:
+    \b
+        $ fio filter ${INFILE} ${OUTFILE} \\
+            --mask counties.shp \\
+            --predicate within
     """
 
     helpers.set_verbosity(ctx, log)
 
-    scope_blacklist = ('eval', 'compile', 'exec', 'execfile', 'builtin', 'builtins',
-                       '__builtin__', '__builtins__', '__import__', 'globals', 'locals')
-
-    global_scope = {
-        k: v for k, v in globals().items() if k not in ('builtins', '__builtins__')}
-    global_scope['__builtins__'] = {
-        k: v for k, v in globals()['__builtins__'].items() if k not in scope_blacklist}
-    global_scope['builtins'] = global_scope['__builtins__']
+    if shard_output and not outfile.lower().endswith('.vrt'):
+        raise click.BadParameter("OUTFILE must end with `.vrt`", param_hint='--shard-output')
+    if bbox_exact and bbox is None:
+        raise click.BadParameter("requires `--bbox`", param_hint='--bbox-exact')
 
-    with fio.open(infile, 'r') as src:
+    with stream.open_input(infile) as src:
 
         meta = copy.deepcopy(src.meta)
         meta.update(
             driver=driver or src.driver,
         )
+        if src_crs:
+            meta['crs'] = src_crs
+            # Fiona prefers `crs_wkt` over `crs` so the input CRS would win
+            meta.pop('crs_wkt', None)
 
         log.debug("Creating output file %s" % outfile)
         log.debug("Meta=%s" % meta)
 
-        with fio.open(outfile, 'w', **meta) as dst:
+        run_stats = None
+        if show_stats or stats_interval:
+            run_stats = stats.Stats(jobs, interval=stats_interval)
 
-            task_generator = (
-                {
-                    'feat': feat,
+        try:
+            shards = shard.Shards(meta, outfile) if shard_output else None
+            execute_inflight, write_inflight = executor.split_inflight(max_inflight)
+            with (shards or stream.open_output(outfile, **meta)) as dst, \
+                    writer.Writer(dst, batch_size=write_batch_size,
+                                  max_inflight=write_inflight, stats=run_stats) as sink:
+
+                job = {
                     'skip_failures': skip_failures,
                     'expressions': expressions,
-                    'global_scope': global_scope
-                } for feat in src.filter(bbox))
-
-            for o_feat in Pool(jobs).imap_unordered(_processor, task_generator):
-                if o_feat is not None:
-                    dst.write(o_feat)
+                }
+
+                if mask_path:
+                    job.update(
+                        mask=_load_mask(mask_path, src_crs or src.crs),
+                        predicate=predicate)
+
+                processor = _processor
+                if vectorized:
+                    try:
+                        columnar.translate(expressions, fields=src.schema['properties'])
+                        processor = _vectorized_processor
+                    except columnar.NotTranslatable as e:
+                        log.warning("Cannot vectorize expressions, evaluating features one at "
+                                    "a time instead: %s" % e)
+
+                bbox_prefilter = None
+                if bbox is not None:
+                    bbox_prefilter = (_prefilter, {
+                        'geom': box(*bbox),
+                        'predicate': 'intersects',
+                        'skip_failures': skip_failures})
+                prefilters = []
+                if bbox_exact and bbox_prefilter:
+                    prefilters.append(bbox_prefilter)
+                if within_geom is not None:
+                    prefilters.append((_prefilter, {
+                        'geom': within_geom,
+                        'predicate': 'within',
+                        'skip_failures': skip_failures}))
+
+                features = None
+                if partitioned_read:
+                    # Workers can't use the driver's spatial index so `--bbox` is
+                    # always exact
+                    if bbox_prefilter and not bbox_exact:
+                        features = partition.partitions(
+                            src, infile, prefilters=[bbox_prefilter] + prefilters)
+                        if features is not None:
+                            log.warning("Testing each feature's geometry against `--bbox` "
+                                        "because of `--partitioned-read`, as with `--bbox-exact`")
+                    else:
+                        features = partition.partitions(src, infile, prefilters=prefilters)
+
+                if features is None:
+                    # Let the driver use its spatial index, if it has one
+                    if bbox is None and within_geom is not None:
+                        features = src.filter(bbox=within_geom.bounds)
+                    else:
+                        features = src.filter(bbox=bbox)
+                    features = helpers.as_dicts(features)
+                    for func, kwargs in prefilters:
+                        features = func(features, **kwargs)
+
+                for o_feat in executor.execute(
+                        processor, features, job, jobs=jobs,
+                        batch_size=batch_size, preserve_order=preserve_order,
+                        reorder_buffer=reorder_buffer,
+                        max_inflight=execute_inflight, start_method=start_method,
+                        maxtasksperchild=maxtasksperchild,
+                        shards=shards,
+                        stats=run_stats, profile=profile,
+                        batch_cost=batch_cost,
+                        transport=(transport.WKBTransport(src.schema, meta['schema'])
+                                   if transport_format == 'wkb' else None)):
+                    sink.write(o_feat)
+
+            if run_stats is not None:
+                run_stats.report(final=True)
+        finally:
+            # Stop periodic reports even if processing failed
+            if run_stats is not None:
+                run_stats.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+
+
+"""
+Core components for `fio geoproc`.
+"""
+
+
+import copy
+import logging
+import re
+import time
+
+import click
+from shapely.geometry import CAP_STYLE
+from shapely.geometry import JOIN_STYLE
+
+from . import buffer as _buffer
+from . import centroid as _centroid
+from . import crscache
+from . import executor
+from . import filter as _filter
+from . import helpers
+from . import options
+from . import partition
+from . import shard
+from . import stats
+from . import reproject as _reproject
+from . import stream
+from . import transform
+from . import transport
+from . import writer
+
+
+log = logging.getLogger('fio-geoproc-geoproc')
+
+
+# Parameters accepted by each operation and the types used to convert them.
+# Parameters in `_MULTIPLE` can be given more than once.
+_PARAMS = {
+    'filter': {
+        'expr': click.STRING,
+        'engine': click.Choice(['rowwise', 'vectorized']),
+        'mask': click.STRING,
+        'predicate': click.Choice(sorted(_filter._SPATIAL_PREDICATES)),
+    },
+    'reproject': {
+        'dst': click.STRING,
+        'engine': click.Choice(['rowwise', 'vectorized']),
+    },
+    'buffer': {
+        'dist': click.FLOAT,
+        'res': click.IntRange(0, None),
+        'cap_style': click.Choice(['flat', 'round', 'square']),
+        'join_style': click.Choice(['round', 'mitre', 'bevel']),
+        'mitre_limit': click.FLOAT,
+        'adaptive_res': click.BOOL,
+        'simplify_input': click.FloatRange(0, None),
+        'simplify_output': click.FloatRange(0, None),
+        'buf': click.STRING,
+        'dst': click.STRING,
+        'otype': click.STRING,
+    },
+    'centroid': {
+        'engine': click.Choice(['rowwise', 'vectorized']),
+    },
+}
+_MULTIPLE = ('expr', )
+
+# Split on commas that are followed by another `key=`
+_SPLIT_PARAMS = re.compile(r',(?=\s*\w+=)')
+
+
+def _parse_operation(value):
+
+    """
+    Parse an operation like `buffer:dist=10,res=4` into its name and
+    parameters.
+
+    Parameters
+    ----------
+    value : str
+        Operation.
+
+    Returns
+    -------
+    tuple
+        `(name, params)`
+    """
+
+    name, _, text = value.partition(':')
+    name = name.strip()
+    if name not in _PARAMS:
+        raise click.BadParameter(
+            "unknown operation '{name}' in '{value}' - must be one of: {ops}".format(
+                name=name, value=value, ops=', '.join(sorted(_PARAMS))))
+
+    params = {}
+    for item in _SPLIT_PARAMS.split(text) if text.strip() else []:
+        key, sep, val = item.partition('=')
+        key = key.strip().replace('-', '_')
+        if not sep or key not in _PARAMS[name]:
+            raise click.BadParameter(
+                "invalid parameter '{item}' for '{name}' - must be one of: {keys}".format(
+                    item=item, name=name, keys=', '.join(sorted(_PARAMS[name]))))
+        val = _PARAMS[name][key].convert(val.strip(), None, None)
+        if key in _MULTIPLE:
+            params.setdefault(key, []).append(val)
+        else:
+            params[key] = val
+
+    return name, params
+
+
+def _cb_operations(ctx, param, value):
+
+    """
+    Click callback to parse `OPERATIONS`.
+    """
+
+    return [_parse_operation(v) for v in value]
+
+
+def _filter_stage(params, state, skip_failures):
+
+    """
+    Build a stage for `filter:expr=...,engine=...,mask=...,predicate=...`.
+    """
+
+    expressions = tuple(params.get('expr', ()))
+    _filter._cb_expressions(None, None, expressions)
+
+    processor = _filter._processor
+    if params.get('engine') == 'vectorized':
+        try:
+            _filter.columnar.translate(expressions, fields=state['schema']['properties'])
+            processor = _filter._vectorized_processor
+        except _filter.columnar.NotTranslatable as e:
+            log.warning("Cannot vectorize expressions, evaluating features one at a time "
+                        "instead: %s" % e)
+
+    job = {
+        'skip_failures': skip_failures,
+        'expressions': expressions,
+    }
+    if params.get('mask'):
+        job.update(
+            mask=_filter._load_mask(params['mask'], state['crs']),
+            predicate=params.get('predicate', 'intersects'))
+
+    return processor, job
+
+
+def _reproject_stage(params, state, skip_failures):
+
+    """
+    Build a stage for `reproject:dst=...,engine=...`.
+    """
+
+    if 'dst' not in params:
+        raise click.BadParameter("reproject requires 'dst'")
+
+    if params.get('engine') == 'vectorized':
+        processor = _reproject._vectorized_processor
+    else:
+        processor = _reproject._processor
+
+    job = {
+        'src_crs': crscache.normalize(state['crs']),
+        'dst_crs': crscache.normalize(params['dst']),
+        'skip_failures': skip_failures
+    }
+    state['crs'] = params['dst']
+
+    return processor, job
+
+
+def _buffer_stage(params, state, skip_failures):
+
+    """
+    Build a stage for `buffer:dist=...` with the same defaults as `fio buffer`.
+    """
+
+    if 'dist' not in params:
+        raise click.BadParameter("buffer requires 'dist'")
+
+    src_crs = state['crs']
+    buf_crs = params.get('buf') or src_crs
+    dst_crs = params.get('dst') or buf_crs
+    if buf_crs is not src_crs and transform.crs_equal(src_crs, buf_crs):
+        buf_crs = src_crs
+    if dst_crs is not buf_crs and transform.crs_equal(buf_crs, dst_crs):
+        dst_crs = buf_crs
+
+    output_geom_type = params.get('otype', 'MultiPolygon')
+    job = {
+        'src_crs': crscache.normalize(src_crs),
+        'buf_crs': crscache.normalize(buf_crs),
+        'dst_crs': crscache.normalize(dst_crs),
+        'skip_failures': skip_failures,
+        'buf_args': {
+            'distance': params['dist'],
+            'quad_segs': params.get('res', 16),
+            'cap_style': getattr(CAP_STYLE, params.get('cap_style', 'round')),
+            'join_style': getattr(JOIN_STYLE, params.get('join_style', 'round')),
+            'mitre_limit': params.get('mitre_limit', 5.0)
+        },
+        'output_geom_type': output_geom_type,
+        'simplify_input': params.get('simplify_input'),
+        'simplify_output': params.get('simplify_output'),
+        'adaptive_res': params.get('adaptive_res', False)
+    }
+    state['crs'] = dst_crs
+    state['schema']['geometry'] = output_geom_type
+
+    return _buffer._processor, job
+
+
+def _centroid_stage(params, state, skip_failures):
+
+    """
+    Build a stage for `centroid:engine=...`.
+    """
+
+    if params.get('engine') == 'vectorized':
+        _centroid._cb_engine(None, None, 'vectorized')
+        processor = _centroid._vectorized_processor
+    else:
+        processor = _centroid._processor
+    state['schema']['geometry'] = 'Point'
+
+    return processor, {'skip_failures': skip_failures}
+
+
+_STAGES = {
+    'filter': _filter_stage,
+    'reproject': _reproject_stage,
+    'buffer': _buffer_stage,
+    'centroid': _centroid_stage,
+}
+
+
+def _processor(feats, stages):
+
+    """
+    Send a batch of features through several processors in order.
+
+    Parameters
+    ----------
+    feats : list
+        GeoJSON features to process.
+    stages : list
+        `(processor, job)` pairs where `processor` is one of the `_processor()`
+        functions from the other commands and `job` are its keyword arguments.
+
+    Returns
+    -------
+    list
+        Features produced by the final stage.
+    """
+
+    for processor, job in stages:
+        if not feats:
+            break
+        start = time.time()
+        feats = processor(feats, **job)
+        stats.timing('process.' + processor.__module__.rsplit('.', 1)[-1], time.time() - start)
+
+    return feats
+
+
+@click.group()
+def geoproc():
+
+    """
+    Geoprocessing workflows.
+    """
+
+
+@geoproc.command()
+@options.infile
+@options.outfile
+@click.argument('operations', nargs=-1, required=True, callback=_cb_operations)
+@options.driver
+@options.src_crs
+@options.skip_failures
+@options.jobs
+@options.batch_size
+@options.batch_cost
+@options.transport
+@options.preserve_order
+@options.reorder_buffer
+@options.write_batch_size
+@options.max_inflight
+@options.start_method
+@options.maxtasksperchild
+@options.partitioned_read
+@options.shard_output
+@options.stats
+@options.stats_interval
+@options.profile
+@click.pass_context
+def chain(ctx, infile, outfile, operations, driver, src_crs, skip_failures, jobs, batch_size,
+          batch_cost, transport_format, preserve_order, reorder_buffer, write_batch_size,
+          max_inflight, start_method, maxtasksperchild, partitioned_read, shard_output,
+          show_stats, stats_interval, profile):
+
+    """
+    Apply several operations in a single pass.
+
+    Operations are applied in order to each feature with a single pool of
+    workers, and the data is only read and written once.  Each operation is
+    an `fio` command from this plugin followed by its parameters:
+    \b
+        filter:expr=EXPR[,expr=EXPR,engine=vectorized,mask=FILE,predicate=NAME]
+        reproject:dst=CRS[,engine=vectorized]
+        buffer:dist=DIST[,res=N,cap_style=STYLE,join_style=STYLE,mitre_limit=N,
+                         adaptive_res=BOOL,simplify_input=TOL,simplify_output=TOL,
+                         buf=CRS,dst=CRS,otype=TYPE]
+        centroid[:engine=vectorized]
+
+    Filter, reproject, buffer, and compute centroids:
+    \b
+        $ fio geoproc chain ${INFILE} ${OUTFILE} \\
+            "filter:expr=pop > 1000" \\
+            reproject:dst=EPSG:3857 \\
+            buffer:dist=10 \\
+            centroid
+    """
+
+    helpers.set_verbosity(ctx, log)
+
+    if shard_output and not outfile.lower().endswith('.vrt'):
+        raise click.BadParameter("OUTFILE must end with `.vrt`", param_hint='--shard-output')
+
+    with stream.open_input(infile) as src:
+
+        state = {
+            'crs': src_crs or src.crs,
+            'schema': copy.deepcopy(src.schema)
+        }
+
+        stages = []
+        for name, params in operations:
+            log.debug("Adding stage %s with %s" % (name, params))
+            stages.append(_STAGES[name](params, state, skip_failures))
+
+        meta = copy.deepcopy(src.meta)
+        meta.update(
+            driver=driver or src.driver,
+            schema=state['schema']
+        )
+        if state['crs'] is not src.crs:
+            meta['crs'] = state['crs']
+            # Fiona prefers `crs_wkt` over `crs` so the input CRS would win
+            meta.pop('crs_wkt', None)
+
+        log.debug("Creating output file %s" % outfile)
+        log.debug("Meta=%s" % meta)
+
+        run_stats = None
+        if show_stats or stats_interval:
+            run_stats = stats.Stats(jobs, interval=stats_interval)
+
+        try:
+            shards = shard.Shards(meta, outfile) if shard_output else None
+            execute_inflight, write_inflight = executor.split_inflight(max_inflight)
+            with (shards or stream.open_output(outfile, **meta)) as dst, \
+                    writer.Writer(dst, batch_size=write_batch_size,
+                                  max_inflight=write_inflight, stats=run_stats) as sink:
+
+                job = {
+                    'stages': stages
+                }
+
+                features = helpers.as_dicts(src)
+                if partitioned_read:
+                    features = partition.partitions(src, infile) or features
+
+                for o_feat in executor.execute(
+                        _processor, features, job, jobs=jobs,
+                        batch_size=batch_size, preserve_order=preserve_order,
+                        reorder_buffer=reorder_buffer,
+                        max_inflight=execute_inflight, start_method=start_method,
+                        maxtasksperchild=maxtasksperchild,
+                        shards=shards,
+                        stats=run_stats, profile=profile,
+                        batch_cost=batch_cost,
+                        transport=(transport.WKBTransport(src.schema, meta['schema'])
+                                   if transport_format == 'wkb' else None)):
+                    sink.write(o_feat)
+
+            if run_stats is not None:
+                run_stats.report(final=True)
+        finally:
+            # Stop periodic reports even if processing failed
+            if run_stats is not None:
+                run_stats.close()
+
+
+def _same_crs(crs1, crs2):
+
+    """
+    Like `transform.crs_equal()` but also handles datasources without a CRS.
+    """
+
+    if not crs1 or not crs2:
+        return not crs1 and not crs2
+    return transform.crs_equal(crs1, crs2)
+
+
+@geoproc.command()
+@click.argument('outfile', required=True)
+@click.argument('infiles', nargs=-1, required=True)
+@options.driver
+@click.option(
+    '--vrt', is_flag=True,
+    help="Write an OGR VRT file referencing INFILES instead of copying features."
+)
+@options.write_batch_size
+@click.pass_context
+def merge(ctx, outfile, infiles, driver, vrt, write_batch_size):
+
+    """
+    Combine datasources with the same schema and CRS into one.
+
+    Features are copied in the order the datasources are given.  Useful for
+    combining the output of several jobs run in parallel.
+
+    \b
+        $ fio geoproc merge ${OUTFILE} part-1.gpkg part-2.gpkg part-3.gpkg
+
+    With `--vrt` no features are copied and OUTFILE is a `.vrt` file that
+    GDAL reads as a single layer:
+
+    \b
+        $ fio geoproc merge --vrt ${OUTFILE}.vrt part-*.gpkg
+    """
+
+    helpers.set_verbosity(ctx, log)
+
+    with stream.open_input(infiles[0]) as src:
+        meta = copy.deepcopy(src.meta)
+    for path in infiles[1:]:
+        with stream.open_input(path) as src:
+            if src.schema != meta['schema']:
+                raise click.ClickException(
+                    "Schema of {path} does not match {first}".format(
+                        path=path, first=infiles[0]))
+            if not _same_crs(src.crs, meta['crs']):
+                raise click.ClickException(
+                    "CRS of {path} does not match {first}".format(
+                        path=path, first=infiles[0]))
+
+    if vrt:
+        log.debug("Writing VRT %s" % outfile)
+        shard.write_vrt(outfile, infiles)
+        return
+
+    meta.update(driver=driver or meta['driver'])
+    log.debug("Creating output file %s" % outfile)
+    log.debug("Meta=%s" % meta)
+
+    with stream.open_output(outfile, **meta) as dst, \
+            writer.Writer(dst, batch_size=write_batch_size) as sink:
+        for feat in shard.concat(infiles):
+            sink.write(feat)
+
+
+if __name__ == '__main__':
+    geoproc()
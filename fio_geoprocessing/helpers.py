@@ -3,9 +3,87 @@ Helper objects used by multiple commands
 """
 
 
+import logging
+
+from shapely.geometry import mapping
+from shapely.geometry import shape
+from shapely.geometry.base import BaseGeometry
+
+
 def set_verbosity(ctx, log):
+    # Configured when a command runs rather than when its module is imported
+    # so loading the plugin has no side effects.  A no-op if fio already
+    # configured logging.
+    logging.basicConfig()
     # fio has a -v flag so just use that to set the logging level
     # Extra checks are so this plugin doesn't just completely crash due
     # to upstream changes.
     if isinstance(getattr(ctx, 'obj'), dict) and isinstance(ctx.obj.get('verbosity'), int):
         log.setLevel(ctx.obj['verbosity'])
+
+
+def as_dicts(features):
+
+    """
+    Normalize features produced by Fiona to plain GeoJSON-like dictionaries.
+    Fiona >= 1.9 produces `fiona.model.Feature()` objects, which are slower to
+    pickle and do not accept a plain `dict` as a replacement geometry.
+
+    Parameters
+    ----------
+    features : iter
+        GeoJSON-like features.
+
+    Yields
+    ------
+    dict
+    """
+
+    for feat in features:
+        yield getattr(feat, '__geo_interface__', feat)
+
+
+def to_shape(geom):
+
+    """
+    Get a Shapely geometry from a GeoJSON geometry.  Features sent with
+    `--transport wkb` already have Shapely geometries, which are returned
+    as-is.
+
+    Parameters
+    ----------
+    geom : dict or shapely.geometry.base.BaseGeometry
+        A geometry.
+
+    Returns
+    -------
+    shapely.geometry.base.BaseGeometry
+    """
+
+    if isinstance(geom, BaseGeometry):
+        return geom
+    return shape(geom)
+
+
+def from_shape(geom, like):
+
+    """
+    Convert a Shapely geometry produced by a processor to the same form as
+    the input geometry, so features received with Shapely geometries are
+    not converted to GeoJSON only to be serialized again.
+
+    Parameters
+    ----------
+    geom : shapely.geometry.base.BaseGeometry
+        Output geometry.
+    like : dict or shapely.geometry.base.BaseGeometry
+        Input geometry.
+
+    Returns
+    -------
+    dict or shapely.geometry.base.BaseGeometry
+    """
+
+    if isinstance(like, BaseGeometry):
+        return geom
+    return mapping(geom)
@@ -8,18 +8,127 @@ from multiprocessing import cpu_count
 import click
 
 
+def _cb_jobs(ctx, param, value):
+
+    """
+    Click callback to limit `--jobs` to the number of cores.  Checked when
+    the option is parsed rather than when this module is imported.
+    """
+
+    cores = cpu_count()
+    if value > cores:
+        raise click.BadParameter(
+            "{value} is more than the {cores} available cores".format(value=value, cores=cores))
+    return value
+
+
 infile = click.argument('infile', required=True)
 outfile = click.argument('outfile', required=True)
 driver = click.option(
-    '-f', '--format', '--driver', metavar='NAME',
+    '-f', '--format', '--driver', 'driver', metavar='NAME',
     help="Output driver name. (default: infile's driver)"
 )
+src_crs = click.option(
+    '--src-crs',
+    help="Specify CRS for input data.  Not needed if specified in infile.  Features read "
+         "from stdin are assumed to be EPSG:4326."
+)
 skip_failures = click.option(
     '--skip-failures', is_flag=True,
     help="Skip geometries that fail somewhere in the processing pipeline."
 )
 jobs = click.option(
-    '--jobs', type=click.IntRange(1, cpu_count()), default=1,
+    '--jobs', type=click.IntRange(1, None), default=1, callback=_cb_jobs, metavar='N',
     help="Process geometries in parallel across N cores.  The goal of this flag is speed so "
-         "feature order is not preserved. (default: 1)"
+         "feature order is not preserved unless `--preserve-order` is also set.  At most the "
+         "number of cores. (default: 1)"
+)
+batch_size = click.option(
+    '--batch-size', type=click.IntRange(1, None), default=100,
+    help="Number of features sent to a worker at a time.  Larger batches reduce "
+         "inter-process communication overhead.  (default: 100)"
+)
+batch_cost = click.option(
+    '--batch-cost', type=click.IntRange(1, None), metavar='N',
+    help="Form batches with an estimated cost of N, roughly the number of vertices, "
+         "instead of `--batch-size` features, and start the most expensive geometries "
+         "first.  Helps when a few geometries are much larger than the rest."
+)
+transport = click.option(
+    '--transport', 'transport_format', type=click.Choice(['geojson', 'wkb']),
+    default='geojson',
+    help="How features are sent to and from workers with `--jobs`.  `wkb` sends "
+         "geometries as WKB and properties as a tuple, which is smaller and faster to "
+         "pickle, and workers operate on Shapely geometries directly.  Expressions "
+         "referencing `feat['geometry']` see a Shapely geometry. (default: geojson)"
+)
+shared_memory = click.option(
+    '--shared-memory', is_flag=True,
+    help="With `--jobs` and `--engine vectorized`, hand each batch's coordinates to "
+         "workers through shared memory instead of pickling them.  `fio reproject` "
+         "modifies them in place, other commands copy them out of shared memory in the "
+         "worker.  Requires Python >= 3.8."
+)
+preserve_order = click.option(
+    '--preserve-order', is_flag=True,
+    help="Write features in the order they were read, even when using `--jobs`."
+)
+reorder_buffer = click.option(
+    '--reorder-buffer', type=click.IntRange(1, None), default=10000, metavar='N',
+    help="With `--preserve-order`, hold at most N features in memory while waiting for "
+         "earlier batches to finish.  Raised to `--jobs` * `--batch-size` if lower. "
+         "(default: 10000)"
+)
+write_batch_size = click.option(
+    '--write-batch-size', type=click.IntRange(1, None), metavar='N',
+    help="Write N features at a time on a dedicated thread.  For drivers like GeoPackage "
+         "each batch is a single transaction.  Lowered to a third of the writer's share of "
+         "`--max-inflight` if higher. (default: 10000 for GeoPackage and SQLite, 1000 "
+         "otherwise)"
+)
+max_inflight = click.option(
+    '--max-inflight', type=click.IntRange(1, None), default=10000, metavar='N',
+    help="Hold at most N features in memory between reading and writing.  Half are "
+         "for features read ahead on a separate thread and being processed, the other "
+         "half for features waiting to be written.  With `--batch-cost`, half of the "
+         "first half are for features waiting to be sorted by cost.  Features read ahead "
+         "are raised to `--jobs` * `--batch-size` if lower, unless using `--batch-cost`. "
+         "(default: 10000)"
+)
+start_method = click.option(
+    '--start-method', type=click.Choice(['fork', 'forkserver', 'spawn']),
+    help="How worker processes are started with `--jobs`.  `forkserver` imports GDAL "
+         "once and forks cheap workers from that process.  (default: platform default)"
+)
+maxtasksperchild = click.option(
+    '--max-tasks-per-child', 'maxtasksperchild', type=click.IntRange(1, None), metavar='N',
+    help="Replace each worker after it has processed N batches to release memory leaked "
+         "by GDAL or GEOS."
+)
+partitioned_read = click.option(
+    '--partitioned-read', is_flag=True,
+    help="Have each worker read its own ranges of features from INFILE instead of "
+         "reading everything in the parent process.  Only for drivers with random "
+         "access: ESRI Shapefile, FlatGeobuf, GeoPackage, and SQLite."
+)
+shard_output = click.option(
+    '--shard-output', is_flag=True,
+    help="With `--jobs`, each worker writes its output to its own GeoPackage instead of "
+         "sending it back to the parent, and OUTFILE is an OGR VRT presenting them as a "
+         "single layer.  OUTFILE must end with `.vrt` and `--driver` is ignored.  The "
+         "GeoPackages are written to a new directory next to OUTFILE and can be combined "
+         "with `fio geoproc merge`.  Output order is not preserved."
+)
+stats = click.option(
+    '--stats', 'show_stats', is_flag=True,
+    help="Write counts, per-stage timings, throughput, queue depths, and worker "
+         "utilization to stderr as JSON when finished."
+)
+stats_interval = click.option(
+    '--stats-interval', type=click.FloatRange(0, None, min_open=True), metavar='SECONDS',
+    help="Also write stats every SECONDS while running.  Implies `--stats`."
+)
+profile = click.option(
+    '--profile', type=click.Path(file_okay=False), metavar='DIR',
+    help="Profile each worker with cProfile and write the results to DIR/<pid>.prof."
 )
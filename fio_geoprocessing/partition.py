@@ -0,0 +1,175 @@
+"""
+Let workers read their own slice of the input instead of receiving features
+read by the parent process.
+
+The parent only describes disjoint ranges of features.  Each worker opens
+the input once and reads whichever ranges it is given, so decoding features
+is spread across all workers rather than being limited by a single reader.
+"""
+
+
+import logging
+
+import fiona as fio
+
+from . import helpers
+
+
+log = logging.getLogger('fio-geoproc-partition')
+
+
+# How each driver can jump to a range of features without reading everything
+# before it:
+#   slice - by position with `filter(start, stop)`
+#   fid   - one feature at a time with `get(fid)`
+#   where - an attribute filter on the FID, which is the table's primary key
+_RANDOM_ACCESS = {
+    'ESRI Shapefile': 'slice',
+    'FlatGeobuf': 'fid',
+    'GPKG': 'where',
+    'SQLite': 'where',
+}
+
+# Inputs opened by this process.  See `Partitions._open()`.
+_OPEN = {}
+
+
+class Partitions(object):
+
+    """
+    Describes an input file as ranges of feature IDs that can be read
+    independently.  Pickled and sent to each worker once.
+    """
+
+    def __init__(self, path, method, start, stop, prefilters=()):
+
+        """
+        Parameters
+        ----------
+        path : str
+            Input datasource.
+        method : str
+            A value from `_RANDOM_ACCESS`.
+        start : int
+            First feature ID.
+        stop : int
+            One past the last feature ID.
+        prefilters : list, optional
+            `(func, kwargs)` pairs applied to each partition as it is read,
+            like `func(features, **kwargs)`.  Must be module level functions.
+        """
+
+        self.path = path
+        self.method = method
+        self.start = start
+        self.stop = stop
+        self.prefilters = prefilters
+
+    def ranges(self, size):
+
+        """
+        Split the input into ranges.
+
+        Parameters
+        ----------
+        size : int
+            Number of feature IDs per range.
+
+        Yields
+        ------
+        tuple
+            `(start, stop)`
+        """
+
+        for start in range(self.start, self.stop, size):
+            yield start, min(start + size, self.stop)
+
+    def _open(self):
+        src = _OPEN.get(self.path)
+        if src is None or src.closed:
+            log.debug("Opening %s" % self.path)
+            src = _OPEN[self.path] = fio.open(self.path)
+        return src
+
+    def close(self):
+
+        """
+        Close the input if it was opened by this process.
+        """
+
+        src = _OPEN.pop(self.path, None)
+        if src is not None:
+            src.close()
+
+    def read(self, task):
+
+        """
+        Read a single range.
+
+        Parameters
+        ----------
+        task : tuple
+            `(start, stop)` from `ranges()`.
+
+        Returns
+        -------
+        list
+            GeoJSON features.
+        """
+
+        start, stop = task
+        src = self._open()
+
+        if self.method == 'slice':
+            features = src.filter(start, stop)
+        elif self.method == 'fid':
+            features = (src.get(fid) for fid in range(start, stop))
+        else:
+            features = src.filter(where="FID >= %d AND FID < %d" % (start, stop))
+        features = helpers.as_dicts(features)
+
+        for func, kwargs in self.prefilters:
+            features = func(features, **kwargs)
+
+        return list(features)
+
+
+def partitions(src, path, prefilters=()):
+
+    """
+    Describe an open input as partitions, if its driver supports random
+    access.
+
+    Parameters
+    ----------
+    src : fiona.Collection
+        Input datasource opened by the parent process.
+    path : str
+        Path used to open `src`.
+    prefilters : list, optional
+        See `Partitions()`.
+
+    Returns
+    -------
+    Partitions or None
+        `None` if the input must be read sequentially.
+    """
+
+    method = _RANDOM_ACCESS.get(getattr(src, 'driver', None))
+    if path == '-' or method is None:
+        log.warning("Driver %s does not support partitioned reads, reading sequentially "
+                    "instead" % getattr(src, 'driver', None))
+        return None
+
+    count = len(src)
+    if not count:
+        start = stop = 0
+    elif method == 'where':
+        # FIDs are not necessarily contiguous or zero based
+        start = next(src.keys(0, 1))
+        stop = next(src.keys(count - 1, count)) + 1
+    else:
+        start, stop = 0, count
+
+    log.debug("Partitioning %s by %s over feature IDs %s to %s" % (path, method, start, stop))
+    return Partitions(path, method, start, stop, prefilters=prefilters)
@@ -0,0 +1,92 @@
+"""
+Entry points for `fiona.fio_plugins`, which is what `fio` loads plugins
+from, and `fiona.fio_commands`, which older versions of Fiona used.
+
+`fio` loads every registered plugin command each time it runs, including for
+`fio --help` and commands from other plugins.  The commands registered here
+are placeholders that only know their name and short help, so loading them
+does not import Fiona, Shapely, NumPy, pyproj, or `multiprocessing`.  The
+module defining the real command is imported the first time the command is
+actually parsed or invoked.
+"""
+
+
+import importlib
+
+import click
+
+
+class LazyCommand(click.Command):
+
+    """
+    Stands in for a command defined in another module and hands everything
+    beyond listing the command in `fio --help` to the real command.
+    """
+
+    def __init__(self, name, import_path, short_help):
+
+        """
+        Parameters
+        ----------
+        name : str
+            Command name.
+        import_path : str
+            Location of the real command like `package.module:attribute`.
+        short_help : str
+            Shown by `fio --help`.
+        """
+
+        super(LazyCommand, self).__init__(name, short_help=short_help)
+        self.import_path = import_path
+        self._command = None
+
+    def load(self):
+
+        """
+        Import the real command.
+
+        Returns
+        -------
+        click.Command
+        """
+
+        if self._command is None:
+            module, attribute = self.import_path.split(':')
+            self._command = getattr(importlib.import_module(module), attribute)
+        return self._command
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        # The context belongs to the real command, so it is invoked directly
+        return self.load().make_context(info_name, args, parent=parent, **extra)
+
+    def invoke(self, ctx):
+        return self.load().invoke(ctx)
+
+    def get_params(self, ctx):
+        return self.load().get_params(ctx)
+
+    def get_usage(self, ctx):
+        return self.load().get_usage(ctx)
+
+    def get_help(self, ctx):
+        return self.load().get_help(ctx)
+
+    def main(self, *args, **kwargs):
+        return self.load().main(*args, **kwargs)
+
+
+buffer = LazyCommand(
+    'buffer', 'fio_geoprocessing.buffer:buffer',
+    "Buffer geometries with shapely.")
+centroid = LazyCommand(
+    'centroid', 'fio_geoprocessing.centroid:centroid',
+    "Compute geometric centroids.")
+filter = LazyCommand(
+    'filter', 'fio_geoprocessing.filter:filter',
+    "Filter features by expression.")
+geoproc = LazyCommand(
+    'geoproc', 'fio_geoprocessing.geoproc:geoproc',
+    "Geoprocessing workflows.")
+reproject = LazyCommand(
+    'reproject', 'fio_geoprocessing.reproject:reproject',
+    "Reproject geometries in one CRS to another.")
@@ -0,0 +1,98 @@
+"""
+Worker pool lifecycle shared by all commands.
+
+Workers are started with `executor._initializer()`, warmed up before they
+receive any features, and are always shut down when the command finishes,
+even if it fails part way through.
+"""
+
+
+import contextlib
+import logging
+import multiprocessing
+
+from . import transform
+
+
+log = logging.getLogger('fio-geoproc-pool')
+
+
+# Modules imported once by the forkserver process so forked workers don't
+# each pay for importing GDAL and GEOS.
+_PRELOAD = ['fiona', 'shapely.geometry', 'pyproj', 'fio_geoprocessing.executor']
+
+
+def warm_up(job):
+
+    """
+    Build the CRS objects and transformers a job will need so the cost is
+    paid when the worker starts rather than in the middle of the first batch.
+
+    Parameters
+    ----------
+    job : dict
+        Keyword arguments for a processor.  Any `src_crs`, `buf_crs`, and
+        `dst_crs` are used, and `stages` from `fio geoproc chain` are
+        warmed up recursively.
+    """
+
+    for _, stage_job in job.get('stages', ()):
+        warm_up(stage_job)
+
+    crs = [job[k] for k in ('src_crs', 'buf_crs', 'dst_crs') if job.get(k)]
+    for src_crs, dst_crs in zip(crs, crs[1:]):
+        if src_crs is not dst_crs:
+            try:
+                transform.get_transformer(src_crs, dst_crs)
+            except Exception:
+                # Let the processor report the error for the first feature.
+                log.debug("Could not warm up transformer %s -> %s" % (src_crs, dst_crs))
+
+
+@contextlib.contextmanager
+def managed_pool(jobs, initializer, initargs, start_method=None, maxtasksperchild=None):
+
+    """
+    Start a worker pool and make sure it is shut down.
+
+    On success the pool is closed and joined so workers exit cleanly.  On
+    failure or if the caller stops early the pool is terminated so no
+    workers are left behind.
+
+    Parameters
+    ----------
+    jobs : int
+        Number of workers.
+    initializer : callable
+        Called in each worker when it starts.
+    initargs : tuple
+        Arguments for `initializer`.
+    start_method : str, optional
+        One of `fork`, `forkserver`, or `spawn`.  Defaults to the platform's
+        default.
+    maxtasksperchild : int, optional
+        Replace workers after this many batches to release memory leaked by
+        GDAL or GEOS.
+
+    Yields
+    ------
+    multiprocessing.pool.Pool
+    """
+
+    context = multiprocessing.get_context(start_method)
+    if start_method == 'forkserver':
+        context.set_forkserver_preload(_PRELOAD)
+
+    log.debug("Starting %s workers with start method %s" % (jobs, context.get_start_method()))
+    pool = context.Pool(
+        jobs, initializer=initializer, initargs=initargs, maxtasksperchild=maxtasksperchild)
+    try:
+        yield pool
+    except BaseException:
+        log.debug("Terminating workers")
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
@@ -2,78 +2,209 @@
 
 
 """
-Core components for `fio buffer`.
+Core components for `fio reproject`.
 """
 
 
 import copy
 import logging
-from multiprocessing import Pool
 
 import click
-import fiona as fio
 from fiona.transform import transform_geom
+from shapely.geometry import mapping
+from shapely.geometry import shape
+from shapely.geometry.base import BaseGeometry
 
+from . import coords
+from . import crscache
+from . import executor
 from . import helpers
 from . import options
+from . import partition
+from . import shard
+from . import sharedmem
+from . import stats
+from . import stream
+from . import transform
+from . import transport
+from . import writer
 
 
-logging.basicConfig()
 log = logging.getLogger('fio-geoproc-reproject')
 
 
-def _processor(args):
+def _processor(feats, src_crs, dst_crs, skip_failures):
 
     """
-    Reproject a single feature's geometry.
+    Reproject a batch of features one at a time with
+    `fiona.transform.transform_geom()`.
 
     Parameters
     ----------
-    args : dict
-        feat : dict
-            A GeoJSON feature to process.
-        src_crs : str
-            The geometry's CRS.
-        dst_crs : str
-            Reproject buffered geometry to this CRS before returning.
-        skip_failures : bool
-            If True then Exceptions don't stop processing.
+    feats : list
+        GeoJSON features to process.
+    src_crs : str or dict
+        The geometry's CRS.
+    dst_crs : str or dict
+        Reproject geometries to this CRS before returning.
+    skip_failures : bool
+        If True then Exceptions don't stop processing.
 
     Returns
     -------
-    dict
-        GeoJSON feature with updated geometry.
+    list
+        GeoJSON features with updated geometry.  Features that failed and were
+        skipped are not included.
     """
 
-    feat = args['feat']
-    src_crs = args['src_crs']
-    dst_crs = args['dst_crs']
-    skip_failures = args['skip_failures']
+    output = []
+    for feat in feats:
+        try:
+            if isinstance(feat['geometry'], BaseGeometry):
+                # Received as WKB.  See `transport`.
+                feat['geometry'] = shape(transform_geom(
+                    src_crs, dst_crs, mapping(feat['geometry'])))
+            else:
+                feat['geometry'] = transform_geom(src_crs, dst_crs, feat['geometry'])
+            output.append(feat)
+
+        except Exception:
+            log.exception("Feature with ID %s failed" % feat.get('id'))
+            if not skip_failures:
+                raise
+            stats.failure()
+
+    return output
+
+
+def _vectorized_processor(feats, src_crs, dst_crs, skip_failures):
+
+    """
+    Like `_processor()` but reprojects every vertex in the batch with a single
+    call to a cached `pyproj.Transformer()`.
+
+    If anything in the batch fails the entire batch is handed to
+    `_processor()`, which handles failures on a per-feature basis.
+
+    Parameters
+    ----------
+    feats : list
+        GeoJSON features to process.
+    src_crs : str or dict
+        The geometry's CRS.
+    dst_crs : str or dict
+        Reproject geometries to this CRS before returning.
+    skip_failures : bool
+        If True then Exceptions don't stop processing.
+
+    Returns
+    -------
+    list
+    """
+
+    if isinstance(feats, sharedmem.Batch):
+        return _shared_processor(feats, src_crs, dst_crs, skip_failures)
 
     try:
-        feat['geometry'] = transform_geom(src_crs, dst_crs, feat['geometry'])
-        return feat
+        geometries = [feat['geometry'] for feat in feats]
+        if geometries and isinstance(geometries[0], BaseGeometry):
+            geometries = transform.transform_shapes(src_crs, dst_crs, geometries)
+        else:
+            geometries = transform.transform_geoms(src_crs, dst_crs, geometries)
+    except Exception:
+        geometries = None
+
+    if geometries is None:
+        log.debug("Vectorized reprojection failed - falling back to processing "
+                  "features one at a time")
+        return _processor(feats, src_crs, dst_crs, skip_failures)
+
+    for feat, geom in zip(feats, geometries):
+        feat['geometry'] = geom
+
+    return feats
+
+
+def _shared_processor(feats, src_crs, dst_crs, skip_failures):
 
+    """
+    Like `_vectorized_processor()` but for a batch whose coordinates are in
+    shared memory.  Coordinates are reprojected in place so the parent can
+    rebuild the output geometries from the same block.
+
+    Parameters
+    ----------
+    feats : sharedmem.Batch
+        Features with coordinates in shared memory.
+    src_crs : str or dict
+        The geometry's CRS.
+    dst_crs : str or dict
+        Reproject geometries to this CRS before returning.
+    skip_failures : bool
+        If True then Exceptions don't stop processing.
+
+    Returns
+    -------
+    list
+    """
+
+    x, y, z = feats.coordinates
+    try:
+        if coords.has_z(feats.layouts):
+            transform.transform_inplace(src_crs, dst_crs, x, y, z)
+        else:
+            transform.transform_inplace(src_crs, dst_crs, x, y)
+        failed = False
     except Exception:
-        log.exception("Feature with ID %s failed" % feat.get('id'))
-        if not skip_failures:
-            raise
+        failed = True
+    del x, y, z
+
+    if failed:
+        log.debug("Reprojecting shared memory failed - falling back to processing "
+                  "features one at a time")
+        feats.fill()
+        return _processor(feats, src_crs, dst_crs, skip_failures)
+
+    return feats
 
 
 @click.command()
 @click.argument('infile')
 @click.argument('outfile')
 @options.driver
+@options.src_crs
 @click.option(
-    '--src-crs', help="Specify CRS for input data.  Not needed if specified in infile."
+    '--dst-crs', help="CRS for output file and geometries.", required=True
 )
 @click.option(
-    '--dst-crs', help="CRS for output file and geometries.", required=True
+    '--engine', type=click.Choice(['rowwise', 'vectorized']), default='rowwise',
+    help="Reproject one feature at a time with Fiona or every vertex in a batch at "
+         "once with pyproj.  The vectorized engine benefits from a larger "
+         "`--batch-size` and falls back to rowwise for batches it cannot reproject. "
+         "(default: rowwise)"
 )
 @options.skip_failures
 @options.jobs
+@options.batch_size
+@options.batch_cost
+@options.transport
+@options.shared_memory
+@options.preserve_order
+@options.reorder_buffer
+@options.write_batch_size
+@options.max_inflight
+@options.start_method
+@options.maxtasksperchild
+@options.partitioned_read
+@options.shard_output
+@options.stats
+@options.stats_interval
+@options.profile
 @click.pass_context
-def reproject(ctx, infile, outfile, driver, src_crs, dst_crs, skip_failures, jobs):
+def reproject(ctx, infile, outfile, driver, src_crs, dst_crs, engine, skip_failures, jobs,
+              batch_size, batch_cost, transport_format, shared_memory, preserve_order,
+              reorder_buffer, write_batch_size, max_inflight, start_method, maxtasksperchild,
+              partitioned_read, shard_output, show_stats, stats_interval, profile):
 
     """
     Reproject geometries in one CRS to another.
@@ -81,7 +212,20 @@ def reproject(ctx, infile, outfile, driver, src_crs, dst_crs, skip_failures, job
 
     helpers.set_verbosity(ctx, log)
 
-    with fio.open(infile, 'r') as src:
+    if shard_output and not outfile.lower().endswith('.vrt'):
+        raise click.BadParameter("OUTFILE must end with `.vrt`", param_hint='--shard-output')
+
+    if shared_memory:
+        if engine != 'vectorized':
+            raise click.BadParameter(
+                "requires `--engine vectorized`", param_hint='--shared-memory')
+        elif transport_format != 'geojson':
+            raise click.BadParameter(
+                "cannot be combined with `--transport`", param_hint='--shared-memory')
+        elif not sharedmem.HAS_SHARED_MEMORY:
+            raise click.BadParameter("requires Python >= 3.8", param_hint='--shared-memory')
+
+    with stream.open_input(infile) as src:
 
         src_crs = src_crs or src.crs
 
@@ -93,24 +237,65 @@ def reproject(ctx, infile, outfile, driver, src_crs, dst_crs, skip_failures, job
             driver=driver or src.driver,
             crs=dst_crs
         )
+        # Fiona prefers `crs_wkt` over `crs` so the input CRS would win
+        meta.pop('crs_wkt', None)
 
         log.debug("Creating output file %s" % outfile)
         log.debug("Meta=%s" % meta)
 
-        with fio.open(outfile, 'w', **meta) as dst:
+        run_stats = None
+        if show_stats or stats_interval:
+            run_stats = stats.Stats(jobs, interval=stats_interval)
 
-            # A generator that produces the arguments required for `_processor()`
-            task_generator = (
-                {
-                    'feat': feat,
-                    'src_crs': src_crs,
-                    'dst_crs': dst_crs,
+        try:
+            shards = shard.Shards(meta, outfile) if shard_output else None
+            execute_inflight, write_inflight = executor.split_inflight(max_inflight)
+            with (shards or stream.open_output(outfile, **meta)) as dst, \
+                    writer.Writer(dst, batch_size=write_batch_size,
+                                  max_inflight=write_inflight, stats=run_stats) as sink:
+
+                # Constant arguments for `_processor()`.  Normalized CRS
+                # definitions are cheap to send to workers and to parse.
+                job = {
+                    'src_crs': crscache.normalize(src_crs),
+                    'dst_crs': crscache.normalize(dst_crs),
                     'skip_failures': skip_failures,
-                } for feat in src)
+                }
+
+                if engine == 'vectorized':
+                    processor = _vectorized_processor
+                else:
+                    processor = _processor
+                log.debug("Using %s engine" % engine)
+
+                wire = None
+                if shared_memory:
+                    wire = sharedmem.SharedMemoryTransport()
+                elif transport_format == 'wkb':
+                    wire = transport.WKBTransport(src.schema, meta['schema'])
+
+                features = helpers.as_dicts(src)
+                if partitioned_read:
+                    features = partition.partitions(src, infile) or features
+
+                for o_feat in executor.execute(
+                        processor, features, job, jobs=jobs,
+                        batch_size=batch_size, preserve_order=preserve_order,
+                        reorder_buffer=reorder_buffer,
+                        max_inflight=execute_inflight, start_method=start_method,
+                        maxtasksperchild=maxtasksperchild,
+                        shards=shards,
+                        stats=run_stats, profile=profile,
+                        batch_cost=batch_cost,
+                        transport=wire):
+                    sink.write(o_feat)
 
-            for o_feat in Pool(jobs).imap_unordered(_processor, task_generator):
-                if o_feat is not None:
-                    dst.write(o_feat)
+            if run_stats is not None:
+                run_stats.report(final=True)
+        finally:
+            # Stop periodic reports even if processing failed
+            if run_stats is not None:
+                run_stats.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,215 @@
+"""
+Let workers write their own output instead of sending every feature back to
+the parent process.
+
+Each worker writes a GeoPackage and the output is an OGR VRT presenting all
+of them as a single layer, so features are written once and never pass
+through the parent.  The shards can be combined into a single file later
+with `fio geoproc merge`.
+"""
+
+
+import copy
+import logging
+from multiprocessing.util import Finalize
+import os
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+import fiona as fio
+
+from . import helpers
+
+
+log = logging.getLogger('fio-geoproc-shard')
+
+
+# Written and read back quickly, and every batch is a single transaction.
+_DRIVER = 'GPKG'
+
+# Shard opened by this process.  See `Shards.write()`.
+_OPEN = {}
+
+
+class Shards(object):
+
+    """
+    A directory of output files, one per process, that all share the same
+    schema.  Pickled and sent to each worker once.
+
+    Also stands in for the output datasource in the parent process.  Features
+    written by the parent, like those produced when there is only one job, go
+    to the parent's own shard.  When used as a context manager the VRT is
+    written on success and the shards are removed on failure.
+    """
+
+    def __init__(self, meta, outfile):
+
+        """
+        Parameters
+        ----------
+        meta : dict
+            Output datasource's `meta`.  Everything except the driver is used
+            for each shard.
+        outfile : str
+            OGR VRT file to write.  Shards are written to a new directory next
+            to it named after it.
+        """
+
+        self.meta = copy.deepcopy(meta)
+        self.meta['driver'] = _DRIVER
+        self.outfile = outfile
+        stem = os.path.splitext(os.path.basename(outfile))[0]
+        self.directory = tempfile.mkdtemp(
+            prefix='%s-shards-' % stem, dir=os.path.dirname(os.path.abspath(outfile)))
+
+    @property
+    def driver(self):
+        return _DRIVER
+
+    def _open(self):
+        dst = _OPEN.get(self.directory)
+        if dst is None:
+            path = os.path.join(self.directory, 'shard-%s.gpkg' % os.getpid())
+            log.debug("Opening shard %s" % path)
+            dst = _OPEN[self.directory] = fio.open(path, 'w', **self.meta)
+            # Workers don't get a chance to clean up after themselves, but
+            # multiprocessing calls finalizers when a worker exits, including
+            # when it is replaced due to `maxtasksperchild`.
+            Finalize(None, dst.close, exitpriority=10)
+        return dst
+
+    def write(self, features):
+
+        """
+        Write features to this process's shard.
+
+        Parameters
+        ----------
+        features : list
+            GeoJSON features.
+        """
+
+        if features:
+            self._open().writerecords(features)
+
+    writerecords = write
+
+    def close(self):
+
+        """
+        Close this process's shard, if it has one.
+        """
+
+        dst = _OPEN.pop(self.directory, None)
+        if dst is not None:
+            dst.close()
+
+    def paths(self):
+
+        """
+        Paths to all of the shards that have been written.
+
+        Returns
+        -------
+        list
+        """
+
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory))
+
+    def remove(self):
+
+        """
+        Delete the shards.
+        """
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_vrt(self):
+
+        """
+        Close this process's shard and write `outfile` as an OGR VRT that
+        presents every shard as a single layer.  Workers must have exited.
+        """
+
+        self.close()
+        if not self.paths():
+            # Nothing was produced, but the VRT needs a layer with the schema
+            self._open()
+            self.close()
+        log.debug("Writing VRT %s" % self.outfile)
+        write_vrt(self.outfile, self.paths())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.write_vrt()
+        else:
+            self.close()
+            self.remove()
+
+
+def concat(paths):
+
+    """
+    Read features from several datasources in order.
+
+    Parameters
+    ----------
+    paths : list
+        Datasources to read.
+
+    Yields
+    ------
+    dict
+        GeoJSON features.
+    """
+
+    for path in paths:
+        log.debug("Reading shard %s" % path)
+        with fio.open(path) as src:
+            for feat in helpers.as_dicts(src):
+                yield feat
+
+
+def write_vrt(outfile, paths, layer=None):
+
+    """
+    Write an OGR VRT file presenting several datasources as a single layer.
+
+    Parameters
+    ----------
+    outfile : str
+        Path to the VRT file.
+    paths : list
+        Datasources to include.  Each datasource's first layer is used.
+    layer : str, optional
+        Name of the combined layer.  Defaults to the name of `outfile`.
+    """
+
+    layer = layer or os.path.splitext(os.path.basename(outfile))[0]
+
+    sources = []
+    for idx, path in enumerate(paths):
+        with fio.open(path) as src:
+            name = src.name
+        sources.append(
+            '    <OGRVRTLayer name={alias}>\n'
+            '      <SrcDataSource>{path}</SrcDataSource>\n'
+            '      <SrcLayer>{name}</SrcLayer>\n'
+            '    </OGRVRTLayer>\n'.format(
+                alias=quoteattr('%s_%s' % (name, idx)), name=escape(name),
+                path=escape(os.path.abspath(path))))
+
+    with open(outfile, 'w') as f:
+        f.write(
+            '<OGRVRTDataSource>\n'
+            '  <OGRVRTUnionLayer name={layer}>\n'
+            '{sources}'
+            '  </OGRVRTUnionLayer>\n'
+            '</OGRVRTDataSource>\n'.format(layer=quoteattr(layer), sources=''.join(sources)))
@@ -0,0 +1,250 @@
+"""
+Hand a batch's coordinates to a worker through shared memory instead of
+pickling them.
+
+The reader flattens every geometry in a batch with `coords.flatten()` and
+copies the positions into a `multiprocessing.shared_memory` block as a
+`(3, N)` `float64` array.  Only the block's name, the layouts describing how
+to rebuild each geometry, and the features' properties cross the process
+boundary.  Processors that only move vertices, like `fio reproject`,
+modify the coordinates in place through a NumPy view of the block so the
+parent can rebuild the output geometries from the same block without another
+copy.  Anything else, like `fio centroid`, rebuilds the geometries from the
+view in the worker, which copies the coordinates but still avoids pickling
+them.
+"""
+
+
+import logging
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+from . import coords
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+    HAS_SHARED_MEMORY = True
+except ImportError:
+    HAS_SHARED_MEMORY = False
+
+
+log = logging.getLogger('fio-geoproc-sharedmem')
+
+
+def _attach(name):
+
+    """
+    Attach to an existing block without registering it with the resource
+    tracker.  Only possible with Python >= 3.13.  Older versions register the
+    block again, which is harmless as long as workers share the parent's
+    resource tracker.  See `SharedMemoryTransport()`.
+    """
+
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        return SharedMemory(name=name)
+
+
+def _view(shm, size):
+
+    """
+    View a block as a `(3, size)` array of X, Y, and Z coordinates.
+    """
+
+    return np.ndarray((3, size), dtype=np.float64, buffer=shm.buf)
+
+
+class Block(object):
+
+    """
+    A batch of features whose coordinates are in shared memory.  Sent to
+    workers in place of a list of features, and back to the parent in place
+    of a list of output features.
+    """
+
+    def __init__(self, name, size, layouts, feats):
+
+        """
+        Parameters
+        ----------
+        name : str
+            Shared memory block name.
+        size : int
+            Number of positions in the block.
+        layouts : list or None
+            From `coords.flatten()`.  `None` if the features already have
+            their geometries.
+        feats : list
+            Features.  Geometries are `None` unless `layouts` is `None`.
+        """
+
+        self.name = name
+        self.size = size
+        self.layouts = layouts
+        self.feats = feats
+
+
+class Batch(list):
+
+    """
+    Features received by a worker whose geometries are still in shared
+    memory.  Processors that understand it can operate on `coordinates`
+    directly, and anything else can call `fill()` first.
+    """
+
+    def __init__(self, feats, coordinates, layouts):
+        super(Batch, self).__init__(feats)
+        self.coordinates = coordinates
+        self.layouts = layouts
+        self.filled = False
+
+    def fill(self):
+
+        """
+        Rebuild each feature's GeoJSON geometry from `coordinates`.
+        """
+
+        if self.filled:
+            return
+        x, y, z = self.coordinates
+        for feat, geom in zip(self, coords.rebuild(self.layouts, x, y, z)):
+            feat['geometry'] = geom
+        self.filled = True
+
+
+class SharedMemoryTransport(object):
+
+    """
+    Sends coordinates to and from workers through shared memory.  Used like
+    `transport.WKBTransport()`.  Blocks are created by the parent's reader
+    thread and unlinked by the parent once the batch's output has been
+    rebuilt.
+    """
+
+    def __init__(self):
+        # Workers inherit the parent's resource tracker if it is already
+        # running when they start.  Otherwise each worker starts its own,
+        # which unlinks every block the worker attached to when it exits,
+        # even if the parent has not rebuilt the batch's output yet, and
+        # warns about the rest since the parent already unlinked them.
+        resource_tracker.ensure_running()
+        # Blocks created by the parent that have not been unlinked
+        self._blocks = {}
+        # Block and batch being processed by the worker
+        self._current = None
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def encode(self, feats, output=False):
+
+        """
+        In the parent, copy a batch's coordinates to a new block.  In a
+        worker, describe the processor's output.
+
+        Parameters
+        ----------
+        feats : list
+            Features.  With `output=True`, the processor's output, which can
+            be the `Batch` from `decode()` with its coordinates modified in
+            place.
+        output : bool, optional
+            Called in a worker after processing.
+
+        Returns
+        -------
+        Block or list
+            A plain list if the worker did not receive a block, like when
+            workers read their own partitions.
+        """
+
+        if output:
+            if self._current is None:
+                return feats
+            shm, batch = self._current
+            self._current = None
+            if feats is batch and not batch.filled:
+                block = Block(shm.name, batch.coordinates.shape[1], batch.layouts, list(feats))
+            else:
+                block = Block(shm.name, 0, None, list(feats))
+            # Views must be released before the block can be closed
+            batch.coordinates = None
+            shm.close()
+            return block
+
+        x, y, z, layouts = coords.flatten(feat['geometry'] for feat in feats)
+        size = len(x)
+        shm = SharedMemory(create=True, size=max(1, 3 * size * 8))
+        self._blocks[shm.name] = shm
+        view = _view(shm, size)
+        view[0] = x
+        view[1] = y
+        view[2] = z
+        del view
+
+        stripped = []
+        for feat in feats:
+            feat = dict(feat)
+            feat['geometry'] = None
+            stripped.append(feat)
+
+        return Block(shm.name, size, layouts, stripped)
+
+    def decode(self, block, output=False):
+
+        """
+        In a worker, attach to a batch's block.  In the parent, rebuild the
+        output features and unlink the block.
+
+        Parameters
+        ----------
+        block : Block or list
+            From `encode()`.
+        output : bool, optional
+            Called in the parent with the worker's output.
+
+        Returns
+        -------
+        list
+            A `Batch` in a worker, or GeoJSON features in the parent.
+        """
+
+        if not output:
+            shm = _attach(block.name)
+            batch = Batch(block.feats, _view(shm, block.size), block.layouts)
+            self._current = shm, batch
+            return batch
+
+        if not isinstance(block, Block):
+            return block
+
+        shm = self._blocks.pop(block.name)
+        try:
+            if block.layouts is not None:
+                x, y, z = _view(shm, block.size)
+                geometries = coords.rebuild(block.layouts, x, y, z)
+                del x, y, z
+                for feat, geom in zip(block.feats, geometries):
+                    feat['geometry'] = geom
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return block.feats
+
+    def close(self):
+
+        """
+        Unlink any blocks left behind by batches that never finished.
+        """
+
+        while self._blocks:
+            _, shm = self._blocks.popitem()
+            log.debug("Removing shared memory block %s" % shm.name)
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,299 @@
+"""
+Instrumentation for `--stats` and `--profile`.
+
+Workers record how long each stage took and how many features failed while
+processing a batch, and hand the totals back to the parent alongside the
+batch's output.  The parent combines them with its own measurements of
+reading, waiting on workers, and writing, and with anything it recorded
+itself, like failures while filtering features as they are read.
+"""
+
+
+from __future__ import division
+
+import cProfile
+import json
+import logging
+from multiprocessing.util import Finalize
+import os
+import sys
+import threading
+import time
+
+
+log = logging.getLogger('fio-geoproc-stats')
+
+
+# Recorded by the current process since the last call to `collect()`.
+# Updated by both the reader and main threads in the parent.
+_LOCAL = {
+    'failed': 0,
+    'seconds': {}
+}
+_LOCAL_LOCK = threading.Lock()
+
+
+def failure():
+
+    """
+    Record a feature that failed to process and was skipped.
+    """
+
+    with _LOCAL_LOCK:
+        _LOCAL['failed'] += 1
+
+
+def timing(stage, seconds):
+
+    """
+    Add time spent in a stage.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage.
+    seconds : float
+        Time to add.
+    """
+
+    with _LOCAL_LOCK:
+        totals = _LOCAL['seconds']
+        totals[stage] = totals.get(stage, 0) + seconds
+
+
+def collect():
+
+    """
+    Get and reset everything recorded by the current process.
+
+    Returns
+    -------
+    dict
+        `{'failed': int, 'seconds': {stage: float}}`
+    """
+
+    with _LOCAL_LOCK:
+        local = {
+            'failed': _LOCAL['failed'],
+            'seconds': _LOCAL['seconds']
+        }
+        _LOCAL['failed'] = 0
+        _LOCAL['seconds'] = {}
+    return local
+
+
+def profile(directory):
+
+    """
+    Profile the current process with cProfile until it exits, then write the
+    results to `<directory>/<pid>.prof`.  Only the calling thread is
+    profiled.
+
+    Parameters
+    ----------
+    directory : str
+        Directory for profiler output.  Created if it does not exist.
+    """
+
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another worker got there first
+            pass
+
+    path = os.path.join(directory, '%s.prof' % os.getpid())
+    profiler = cProfile.Profile()
+
+    def dump():
+        profiler.disable()
+        profiler.dump_stats(path)
+
+    log.debug("Writing profile to %s" % path)
+    # Called when the process exits, including workers
+    Finalize(None, dump, exitpriority=20)
+    profiler.enable()
+
+
+class Stats(object):
+
+    """
+    Counts and timings for a single command.  Updated by the reader, main,
+    and writer threads.
+    """
+
+    def __init__(self, jobs, interval=None, stream=None, aggregate=False):
+
+        """
+        Parameters
+        ----------
+        jobs : int
+            Number of workers.  Used to compute utilization.
+        interval : float, optional
+            Report every `interval` seconds in addition to the final report.
+        stream : file, optional
+            Where reports are written.  Defaults to `stderr`.
+        aggregate : bool, optional
+            Output features are not produced one per input feature, like
+            when dissolving, so features that were skipped without failing
+            cannot be counted.
+        """
+
+        self.jobs = jobs
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.start = time.time()
+        self.counts = {
+            'read': 0,
+            'processed': 0,
+            'failed': 0,
+            'skipped': 0,
+            'written': 0
+        }
+        if aggregate:
+            del self.counts['skipped']
+        self.aggregate = aggregate
+        self.seconds = {}
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._reporter = None
+
+        if interval:
+            self._reporter = threading.Thread(target=self._report_periodically,
+                                              name='fio-geoproc-stats')
+            self._reporter.daemon = True
+            self._reporter.start()
+
+    def add(self, stage=None, seconds=0, **counts):
+
+        """
+        Record time spent in a stage and increment counts.
+
+        Parameters
+        ----------
+        stage : str, optional
+            Name of the stage.
+        seconds : float, optional
+            Time to add to `stage`.
+        counts : **counts
+            Amounts to add to each count.
+        """
+
+        with self._lock:
+            if stage is not None:
+                self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+            for key, value in counts.items():
+                self.counts[key] += value
+
+    def update(self, info):
+
+        """
+        Merge the `info` returned by a worker with a batch.
+
+        Parameters
+        ----------
+        info : dict
+            See `executor._run_batch()`.
+        """
+
+        with self._lock:
+            for stage, seconds in info['seconds'].items():
+                self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+            self.counts['read'] += info['read']
+            self.counts['processed'] += info['processed']
+            self.counts['failed'] += info['failed']
+            if not self.aggregate:
+                self.counts['skipped'] += max(
+                    0, info['processed'] - info['failed'] - info['produced'])
+
+    def update_local(self):
+
+        """
+        Merge everything recorded by the current process since the last call
+        to `collect()`.  With `jobs > 1` this is what ran in the parent
+        rather than a worker, like filtering features as they are read.
+        """
+
+        local = collect()
+        with self._lock:
+            for stage, seconds in local['seconds'].items():
+                self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+            self.counts['failed'] += local['failed']
+
+    def queue(self, name, size):
+
+        """
+        Include the depth of a queue in reports.
+
+        Parameters
+        ----------
+        name : str
+            Name of the queue.
+        size : callable
+            Returns the number of items in the queue.
+        """
+
+        self._queues[name] = size
+
+    def snapshot(self):
+
+        """
+        Current counts, timings, and rates.
+
+        Returns
+        -------
+        dict
+        """
+
+        with self._lock:
+            elapsed = time.time() - self.start
+            counts = dict(self.counts)
+            seconds = dict(self.seconds)
+
+        return {
+            'elapsed': elapsed,
+            'counts': counts,
+            'features_per_second': counts['written'] / elapsed if elapsed else 0,
+            'seconds': seconds,
+            'queues': dict((name, size()) for name, size in self._queues.items()),
+            'in_flight': counts['read'] - counts['processed'],
+            'worker_utilization':
+                seconds.get('process', 0) / (elapsed * self.jobs) if elapsed else 0,
+        }
+
+    def report(self, final=False):
+
+        """
+        Write a snapshot as a line of JSON.
+
+        Parameters
+        ----------
+        final : bool, optional
+            Marks the last report and stops periodic reporting.  Includes
+            everything recorded by the current process.  See
+            `update_local()`.
+        """
+
+        if final:
+            self._done.set()
+            self.update_local()
+        snapshot = self.snapshot()
+        snapshot['final'] = final
+        self.stream.write(json.dumps(snapshot, sort_keys=True) + os.linesep)
+        self.stream.flush()
+
+    def close(self):
+
+        """
+        Stop periodic reporting without writing a final report.  Safe to call
+        more than once and after `report(final=True)`.
+        """
+
+        self._done.set()
+        if self._reporter is not None and self._reporter is not threading.current_thread():
+            self._reporter.join()
+
+    def _report_periodically(self):
+        while not self._done.wait(self.interval):
+            self.report()
@@ -0,0 +1,299 @@
+"""
+Read and write newline delimited GeoJSON text sequences on stdin and stdout,
+so commands can be chained with pipes:
+
+    $ fio filter in.shp - --expr "pop > 1000" | fio buffer - out.shp --dist 10
+
+An `infile` or `outfile` of `-` selects this mode.  Anything else is opened
+with Fiona.
+"""
+
+
+import itertools
+import json
+import sys
+
+import fiona as fio
+
+from . import coords
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# RFC 8142 GeoJSON text sequences prefix each record with an ASCII record
+# separator.  Newline delimited sequences do not.
+_RS = b'\x1e'
+
+# RFC 7946 GeoJSON is always WGS84
+DEFAULT_CRS = 'EPSG:4326'
+
+# Number of features read from stdin to infer a schema.  Held in memory
+# until processing starts.
+SCHEMA_SAMPLE = 1000
+
+# Python type -> Fiona field type for schema inference
+_FIELD_TYPES = (
+    (bool, 'bool'),
+    (int, 'int'),
+    (float, 'float'),
+)
+
+# Field types that can hold every value of the types before them.  Fields
+# with values of more than one type get the widest.
+_WIDENING = ('bool', 'int', 'float', 'str')
+
+
+def _default(obj):
+
+    """
+    Serialize objects the JSON encoder does not understand, like
+    `fiona.model.Geometry()`.
+    """
+
+    if hasattr(obj, '__geo_interface__'):
+        return obj.__geo_interface__
+    elif hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+if orjson is not None:
+
+    loads = orjson.loads
+
+    def dumps(obj):
+        """
+        Encode an object as a line of JSON.
+        """
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_APPEND_NEWLINE)
+
+else:
+
+    loads = json.loads
+
+    def dumps(obj):
+        """
+        Encode an object as a line of JSON.
+        """
+        return (json.dumps(obj, default=_default, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _field_type(value):
+
+    """
+    Guess a Fiona field type from a property value.
+    """
+
+    for pytype, ftype in _FIELD_TYPES:
+        if isinstance(value, pytype):
+            return ftype
+    return 'str'
+
+
+def infer_schema(features):
+
+    """
+    Guess a Fiona schema from a sample of features.
+
+    Each field gets the narrowest type that holds all of its non-null values,
+    so a field with both `int` and `float` values is a `float` field, and a
+    field that is always null is a `str` field.  The geometry type is
+    `Unknown` unless every geometry has the same type.
+
+    Parameters
+    ----------
+    features : iter
+        GeoJSON features.
+
+    Returns
+    -------
+    dict
+    """
+
+    geom_types = set()
+    fields = {}
+    order = []
+    for feat in features:
+        geom = feat.get('geometry')
+        geom_types.add(geom['type'] if geom else None)
+        for k, v in (feat.get('properties') or {}).items():
+            if k not in fields:
+                fields[k] = None
+                order.append(k)
+            if v is None:
+                continue
+            ftype = _field_type(v)
+            if fields[k] is None or _WIDENING.index(ftype) > _WIDENING.index(fields[k]):
+                fields[k] = ftype
+
+    geom_types.discard(None)
+    return {
+        'geometry': geom_types.pop() if len(geom_types) == 1 else 'Unknown',
+        'properties': dict((k, fields[k] or 'str') for k in order)
+    }
+
+
+class SequenceReader(object):
+
+    """
+    Reads a GeoJSON text sequence from a binary stream.  Behaves enough like a
+    `fiona.Collection()` opened in read mode for the commands in this package.
+    """
+
+    driver = 'GeoJSONSeq'
+
+    def __init__(self, stream, crs=DEFAULT_CRS, sample=SCHEMA_SAMPLE):
+
+        """
+        Parameters
+        ----------
+        stream : file
+            Binary stream containing one GeoJSON feature per line.
+        crs : str, optional
+            CRS of the features.
+        sample : int, optional
+            Infer a schema from this many features.  Values in later
+            features that do not fit the schema are converted or truncated
+            by the output driver.
+        """
+
+        self._stream = stream
+        self.crs = crs
+
+        # Peek at the first few features to infer a schema
+        self._sample = list(itertools.islice(self._features(), sample))
+        self.schema = infer_schema(self._sample)
+
+    @property
+    def meta(self):
+        return {
+            'driver': self.driver,
+            'schema': self.schema,
+            'crs': self.crs
+        }
+
+    def _features(self):
+        for line in self._stream:
+            line = line.strip().lstrip(_RS)
+            if line:
+                feat = loads(line)
+                # Would be stale as soon as the geometry is modified
+                feat.pop('bbox', None)
+                yield feat
+
+    def __iter__(self):
+        sample, self._sample = self._sample, []
+        for feat in sample:
+            yield feat
+        for feat in self._features():
+            yield feat
+
+    def filter(self, bbox=None):
+
+        """
+        Iterate over features, optionally only those whose bounding box
+        intersects `bbox`.
+        """
+
+        if bbox is None:
+            for feat in self:
+                yield feat
+        else:
+            x_min, y_min, x_max, y_max = bbox
+            for feat in self:
+                bounds = coords.bounds(feat['geometry'])
+                if bounds is not None and not (
+                        bounds[2] < x_min or bounds[0] > x_max
+                        or bounds[3] < y_min or bounds[1] > y_max):
+                    yield feat
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SequenceWriter(object):
+
+    """
+    Writes features to a binary stream as a newline delimited GeoJSON text
+    sequence.  Behaves enough like a `fiona.Collection()` opened in write mode
+    for the commands in this package.
+    """
+
+    def __init__(self, stream):
+
+        """
+        Parameters
+        ----------
+        stream : file
+            Binary stream.
+        """
+
+        self._stream = stream
+
+    def write(self, feat):
+        self._stream.write(dumps(feat))
+
+    def writerecords(self, feats):
+        self._stream.write(b''.join(map(dumps, feats)))
+
+    def close(self):
+        self._stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_input(path):
+
+    """
+    Open a datasource for reading.
+
+    Parameters
+    ----------
+    path : str
+        Path to a datasource or `-` for a GeoJSON text sequence on stdin.
+
+    Returns
+    -------
+    fiona.Collection or SequenceReader
+    """
+
+    if path == '-':
+        return SequenceReader(getattr(sys.stdin, 'buffer', sys.stdin))
+    else:
+        return fio.open(path, 'r')
+
+
+def open_output(path, **meta):
+
+    """
+    Open a datasource for writing.
+
+    Parameters
+    ----------
+    path : str
+        Path to a datasource or `-` for a GeoJSON text sequence on stdout.
+    meta : **meta
+        Passed to `fiona.open()`.  Ignored for stdout.
+
+    Returns
+    -------
+    fiona.Collection or SequenceWriter
+    """
+
+    if path == '-':
+        return SequenceWriter(getattr(sys.stdout, 'buffer', sys.stdout))
+    else:
+        return fio.open(path, 'w', **meta)
@@ -0,0 +1,242 @@
+"""
+Coordinate transformations backed by cached pyproj transformers.
+"""
+
+
+import functools
+
+from fiona.transform import transform_geom
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+from shapely.geometry import shape
+from pyproj.exceptions import ProjError
+
+from . import coords
+from . import crscache
+from .crscache import get_crs
+from .crscache import get_transformer
+
+
+# Shapely geometry transformers, keyed by normalized CRS definitions.
+_SHAPE_TRANSFORMERS = crscache.LRUCache(maxsize=128)
+
+
+def crs_equal(crs1, crs2):
+
+    """
+    Determine if two CRSes are equivalent, even if they are expressed
+    differently.  Axis order is ignored since all transformations are
+    performed in X, Y order.
+
+    Parameters
+    ----------
+    crs1 : str or dict or CRS
+        A CRS.
+    crs2 : str or dict or CRS
+        Another CRS.
+
+    Returns
+    -------
+    bool
+    """
+
+    if crscache.normalize(crs1) == crscache.normalize(crs2):
+        return True
+
+    return get_crs(crs1).equals(get_crs(crs2), ignore_axis_order=True)
+
+
+def _transform(transformer, *coordinates):
+
+    """
+    Reproject arrays of coordinates with a pyproj transformer.  pyproj
+    produces `inf` for coordinates it cannot reproject unless asked to check
+    for errors, and some failures are not reported as errors at all, so
+    anything that is not finite is treated as a failure.
+
+    Raises
+    ------
+    pyproj.exceptions.ProjError
+    """
+
+    output = transformer.transform(*coordinates, errcheck=True)
+    if not all(np.isfinite(c).all() for c in output):
+        raise ProjError("transform produced non-finite coordinates")
+    return output
+
+
+def transform_geoms(src_crs, dst_crs, geometries):
+
+    """
+    Reproject many GeoJSON geometries with a single call to the transformer.
+
+    Parameters
+    ----------
+    src_crs : str or dict or CRS
+        Source CRS.
+    dst_crs : str or dict or CRS
+        Destination CRS.
+    geometries : iter
+        GeoJSON-like geometries.
+
+    Returns
+    -------
+    list
+        Reprojected GeoJSON-like geometries.
+
+    Raises
+    ------
+    pyproj.exceptions.ProjError
+        If any coordinate cannot be reprojected.
+    """
+
+    x, y, z, layouts = coords.flatten(geometries)
+    transformer = get_transformer(src_crs, dst_crs)
+    if coords.has_z(layouts):
+        x, y, z = _transform(transformer, x, y, z)
+    else:
+        x, y = _transform(transformer, x, y)
+
+    return coords.rebuild(layouts, x, y, z)
+
+
+def transform_inplace(src_crs, dst_crs, x, y, z=None):
+
+    """
+    Reproject arrays of coordinates and write the output back to the same
+    arrays, like the views of shared memory used by `sharedmem`.  The arrays
+    are only modified if every coordinate can be reprojected, so a caller
+    can fall back to reprojecting the original coordinates another way.
+
+    Parameters
+    ----------
+    src_crs : str or dict or CRS
+        Source CRS.
+    dst_crs : str or dict or CRS
+        Destination CRS.
+    x : numpy.ndarray
+        Writable `float64` X coordinates.
+    y : numpy.ndarray
+        Writable `float64` Y coordinates.
+    z : numpy.ndarray, optional
+        Writable `float64` Z coordinates.
+
+    Raises
+    ------
+    pyproj.exceptions.ProjError
+        If any coordinate cannot be reprojected.
+    """
+
+    coordinates = (x, y) if z is None else (x, y, z)
+    output = _transform(get_transformer(src_crs, dst_crs), *coordinates)
+    for array, values in zip(coordinates, output):
+        array[:] = values
+
+
+def transform_shapes(src_crs, dst_crs, geometries):
+
+    """
+    Like `transform_geoms()` but for Shapely geometries.
+
+    Parameters
+    ----------
+    src_crs : str or dict or CRS
+        Source CRS.
+    dst_crs : str or dict or CRS
+        Destination CRS.
+    geometries : list
+        Shapely geometries.
+
+    Returns
+    -------
+    list
+        Reprojected Shapely geometries.
+    """
+
+    geoms = np.empty(len(geometries), dtype=object)
+    geoms[:] = geometries
+    func = functools.partial(_transform_array, get_transformer(src_crs, dst_crs))
+
+    # 2D and 3D geometries cannot be transformed together without adding a
+    # Z coordinate to the 2D geometries
+    has_z = shapely.has_z(geoms)
+    for include_z in (False, True):
+        subset = has_z == include_z
+        if subset.any():
+            geoms[subset] = shapely.transform(geoms[subset], func, include_z=include_z)
+
+    return geoms.tolist()
+
+
+def _transform_array(transformer, coordinates):
+
+    """
+    Reproject an `(N, 2)` or `(N, 3)` array of coordinates.
+    """
+
+    return np.column_stack(_transform(transformer, *coordinates.T))
+
+
+def _pyproj_transform(transformer, geom):
+
+    """
+    Reproject a Shapely geometry with a pyproj transformer.
+    """
+
+    return shapely.transform(
+        geom, functools.partial(_transform_array, transformer), include_z=geom.has_z)
+
+
+def _cut_antimeridian(src_crs, dst_crs, geom):
+
+    """
+    Reproject a Shapely geometry with `fiona.transform.transform_geom()`,
+    which can cut geometries that cross the antimeridian.
+    """
+
+    return shape(transform_geom(
+        src_crs, dst_crs, mapping(geom), antimeridian_cutting=True))
+
+
+def get_shape_transformer(src_crs, dst_crs, antimeridian_cutting=False):
+
+    """
+    Get a cached function that reprojects a Shapely geometry.
+
+    Parameters
+    ----------
+    src_crs : str or dict or CRS
+        Source CRS.
+    dst_crs : str or dict or CRS
+        Destination CRS.
+    antimeridian_cutting : bool, optional
+        Cut geometries that cross the antimeridian when `dst_crs` is a
+        geographic CRS.  pyproj cannot do this so these transformations are
+        handed to GDAL.
+
+    Returns
+    -------
+    callable or None
+        A function like `func(geom)` that returns a new geometry, or `None`
+        if the two CRSes are equivalent and no transformation is necessary.
+    """
+
+    key = (crscache.key(crscache.normalize(src_crs)),
+           crscache.key(crscache.normalize(dst_crs)),
+           antimeridian_cutting)
+    try:
+        return _SHAPE_TRANSFORMERS[key]
+    except KeyError:
+        pass
+
+    if crs_equal(src_crs, dst_crs):
+        func = None
+    elif antimeridian_cutting and get_crs(dst_crs).is_geographic:
+        func = functools.partial(_cut_antimeridian, src_crs, dst_crs)
+    else:
+        func = functools.partial(
+            _pyproj_transform, get_transformer(src_crs, dst_crs))
+
+    _SHAPE_TRANSFORMERS[key] = func
+    return func
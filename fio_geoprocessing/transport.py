@@ -0,0 +1,177 @@
+"""
+Send features between processes as WKB instead of GeoJSON.
+
+Pickling a GeoJSON geometry means pickling a tuple for every vertex, which
+is slow and produces large payloads.  Instead each feature is packed into a
+compact `(id, wkb, properties)` record where the properties are a tuple in
+schema order.  Workers decode geometries directly to Shapely geometries,
+which every processor accepts in place of GeoJSON geometries, and the parent
+only converts back to GeoJSON once, right before writing.
+"""
+
+
+from collections import OrderedDict
+import logging
+
+from shapely.geometry import mapping
+from shapely.geometry import shape
+from shapely.geometry.base import BaseGeometry
+import shapely.wkb
+
+try:
+    import numpy as np
+    import shapely
+    HAS_ARRAYS = hasattr(shapely, 'from_wkb')
+except ImportError:
+    HAS_ARRAYS = False
+
+
+log = logging.getLogger('fio-geoproc-transport')
+
+
+def _to_wkb(geoms):
+
+    """
+    Serialize a list of Shapely geometries, which may contain `None`.
+    """
+
+    if HAS_ARRAYS:
+        array = np.empty(len(geoms), dtype=object)
+        array[:] = geoms
+        return shapely.to_wkb(array).tolist()
+    else:
+        return [None if g is None else g.wkb for g in geoms]
+
+
+def _from_wkb(values):
+
+    """
+    Deserialize a list of WKB values, which may contain `None`.
+    """
+
+    if HAS_ARRAYS:
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return shapely.from_wkb(array).tolist()
+    else:
+        return [None if v is None else shapely.wkb.loads(v) for v in values]
+
+
+class WKBTransport(object):
+
+    """
+    Packs features into `(id, wkb, properties)` records and back.  Pickled
+    and sent to each worker once.
+    """
+
+    def __init__(self, schema, out_schema=None):
+
+        """
+        Parameters
+        ----------
+        schema : dict
+            Input schema.  Determines the order of properties in records
+            sent to workers.
+        out_schema : dict, optional
+            Output schema, for records sent back by workers.  Defaults to
+            `schema`.
+        """
+
+        self.fields = tuple(schema['properties'])
+        self.out_fields = tuple((out_schema or schema)['properties'])
+
+    def encode(self, feats, output=False):
+
+        """
+        Pack features into records.
+
+        Parameters
+        ----------
+        feats : list
+            Features with either GeoJSON or Shapely geometries.
+        output : bool, optional
+            Pack properties following the output schema.
+
+        Returns
+        -------
+        list
+        """
+
+        fields = self.out_fields if output else self.fields
+        geoms = []
+        for feat in feats:
+            geom = feat['geometry']
+            if geom is not None and not isinstance(geom, BaseGeometry):
+                geom = shape(geom)
+            geoms.append(geom)
+
+        records = []
+        for feat, wkb in zip(feats, _to_wkb(geoms)):
+            props = feat.get('properties') or {}
+            records.append((feat.get('id'), wkb, tuple(props.get(f) for f in fields)))
+
+        return records
+
+    def decode(self, records, output=False):
+
+        """
+        Unpack records into features.
+
+        Parameters
+        ----------
+        records : list
+            Produced by `encode()`.
+        output : bool, optional
+            Records were packed with `output=True`, and the features are
+            about to be written so geometries are converted to GeoJSON.
+
+        Returns
+        -------
+        list
+            Features with Shapely geometries, or GeoJSON geometries if
+            `output=True`.
+        """
+
+        fields = self.out_fields if output else self.fields
+        geoms = _from_wkb([wkb for _, wkb, _ in records])
+
+        feats = []
+        for (fid, _, props), geom in zip(records, geoms):
+            if output and geom is not None:
+                geom = mapping(geom)
+            feats.append({
+                'type': 'Feature',
+                'id': fid,
+                'properties': OrderedDict(zip(fields, props)),
+                'geometry': geom
+            })
+
+        return feats
+
+    def close(self):
+
+        """
+        Nothing to release.  See `sharedmem.SharedMemoryTransport.close()`.
+        """
+
+
+def as_geojson(feats):
+
+    """
+    Convert any Shapely geometries in a list of features to GeoJSON in place.
+
+    Parameters
+    ----------
+    feats : list
+        Features.
+
+    Returns
+    -------
+    list
+    """
+
+    for feat in feats:
+        if isinstance(feat['geometry'], BaseGeometry):
+            feat['geometry'] = mapping(feat['geometry'])
+
+    return feats
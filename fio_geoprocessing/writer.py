@@ -0,0 +1,173 @@
+"""
+Write features on a dedicated thread so a slow output driver does not stall
+the collection of results from workers.
+"""
+
+
+import logging
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+log = logging.getLogger('fio-geoproc-writer')
+
+
+# Drivers that wrap each `writerecords()` call in a transaction, and benefit
+# from writing more features per call.
+_TRANSACTIONAL_DRIVERS = ('GPKG', 'SQLite', 'PostgreSQL')
+
+# Tells the writer thread to exit.
+_STOP = object()
+
+
+def default_batch_size(driver):
+
+    """
+    Pick a number of features to write per `writerecords()` call.
+
+    Parameters
+    ----------
+    driver : str
+        Output driver name.
+
+    Returns
+    -------
+    int
+    """
+
+    return 10000 if driver in _TRANSACTIONAL_DRIVERS else 1000
+
+
+class Writer(object):
+
+    """
+    Buffers features and hands them to a background thread, which writes them
+    with `writerecords()`.  Batches are passed through a bounded queue so a
+    writer that cannot keep up eventually blocks the caller rather than
+    accumulating the entire dataset in memory.
+
+    Fiona wraps each `writerecords()` call in a transaction for drivers like
+    GeoPackage, so each batch is also a single transaction.
+
+    Use as a context manager.  Exceptions raised by the writer thread are
+    re-raised in the calling thread.
+    """
+
+    def __init__(self, dst, batch_size=None, max_inflight=10000, stats=None):
+
+        """
+        Parameters
+        ----------
+        dst : fiona.Collection or stream.SequenceWriter
+            Open output datasource.  Must not be used by anything else until
+            the writer is closed.
+        batch_size : int, optional
+            Features per `writerecords()` call.  Defaults to a value based on
+            the driver.  See `default_batch_size()`.  Lowered if needed to
+            fit in `max_inflight`.
+        max_inflight : int, optional
+            Maximum number of features held by the writer, including the
+            batch being filled and the batch being written.
+        stats : stats.Stats, optional
+            Records time spent writing, the number of features written, and
+            the queue's depth.
+        """
+
+        self._dst = dst
+        # At least one batch being filled, one queued, and one being written
+        self.batch_size = min(
+            batch_size or default_batch_size(getattr(dst, 'driver', None)),
+            max(1, max_inflight // 3))
+        self._queue = queue.Queue(maxsize=max(1, max_inflight // self.batch_size - 2))
+        self._stats = stats
+        if stats is not None:
+            stats.queue('write', self._queue.qsize)
+        self._pending = []
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='fio-geoproc-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+        log.debug("Writing in batches of %s" % self.batch_size)
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is _STOP:
+                break
+            try:
+                start = time.time()
+                self._dst.writerecords(batch)
+                if self._stats is not None:
+                    self._stats.add('write', time.time() - start, written=len(batch))
+            except Exception as e:
+                log.debug("Writer thread failed")
+                self._error = e
+                break
+
+    def _put(self, item):
+        # Block until there is room, but wake up periodically to check if the
+        # writer thread died, otherwise this would block forever.
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, feat):
+
+        """
+        Queue a single feature for writing.
+
+        Parameters
+        ----------
+        feat : dict
+            GeoJSON feature.
+        """
+
+        self._pending.append(feat)
+        if len(self._pending) >= self.batch_size:
+            self._put(self._pending)
+            self._pending = []
+
+    def close(self):
+
+        """
+        Write any buffered features and wait for the writer thread to finish.
+        """
+
+        if self._pending:
+            self._put(self._pending)
+            self._pending = []
+        self._put(_STOP)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+
+        """
+        Stop the writer thread without writing buffered features.
+        """
+
+        self._pending = []
+        if self._thread.is_alive() and self._error is None:
+            self._put(_STOP)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
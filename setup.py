@@ -53,17 +53,26 @@ setup(
     ],
     description="A Fiona CLI plugin for performing geoprocessing operations.",
     entry_points="""
+        [fiona.fio_plugins]
+        buffer=fio_geoprocessing.plugin:buffer
+        centroid=fio_geoprocessing.plugin:centroid
+        filter=fio_geoprocessing.plugin:filter
+        geoproc=fio_geoprocessing.plugin:geoproc
+        reproject=fio_geoprocessing.plugin:reproject
+
         [fiona.fio_commands]
-        buffer=fio_geoprocessing.buffer:buffer
-        centroid=fio_geoprocessing.centroid:centroid
-        filter=fio_geoprocessing.filter:filter
-        reproject=fio_geoprocessing.reproject:reproject
+        buffer=fio_geoprocessing.plugin:buffer
+        centroid=fio_geoprocessing.plugin:centroid
+        filter=fio_geoprocessing.plugin:filter
+        geoproc=fio_geoprocessing.plugin:geoproc
+        reproject=fio_geoprocessing.plugin:reproject
     """,
     extras_require={
-        'test': ['pytest', 'pytest-cov']
+        'test': ['pytest', 'pytest-cov'],
+        'vectorized': ['shapely>=2']
     },
     include_package_data=True,
-    install_requires=['click>=0.3', 'shapely', 'fiona'],
+    install_requires=['click>=0.3', 'shapely>=2', 'fiona', 'numpy', 'pyproj'],
     keywords='Fiona fio GIS vector geoprocessing plugin',
     license=license,
     long_description=readme,
@@ -0,0 +1,98 @@
+"""
+pytest fixtures
+"""
+
+
+from collections import OrderedDict
+import multiprocessing
+import random
+
+from click.testing import CliRunner
+import fiona as fio
+import pytest
+
+from fio_geoprocessing import options
+
+
+SCHEMA = {
+    'geometry': 'Polygon',
+    'properties': OrderedDict([('id', 'int'), ('value', 'float'), ('name', 'str')])
+}
+
+
+def make_features(count=250, seed=0):
+
+    """
+    Small square polygons scattered across the continental US with an `id`,
+    a `value` between 0 and 1, and a `name`.
+    """
+
+    rand = random.Random(seed)
+    for i in range(count):
+        x = rand.uniform(-120, -70)
+        y = rand.uniform(25, 49)
+        ring = [(x, y), (x + 0.1, y), (x + 0.1, y + 0.1), (x, y + 0.1), (x, y)]
+        yield {
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+            'properties': OrderedDict([
+                ('id', i), ('value', rand.random()), ('name', 'name-%s' % (i % 7))])
+        }
+
+
+def read(path, key='id'):
+
+    """
+    Read a datasource's features as plain dictionaries sorted by a property.
+    OGR VRTs, like those written by `--shard-output`, are allowed.
+    """
+
+    with fio.open(path, allow_unsupported_drivers=True) as src:
+        feats = [getattr(f, '__geo_interface__', f) for f in src]
+    return sorted(feats, key=lambda f: f['properties'][key])
+
+
+@pytest.fixture
+def runner():
+    return CliRunner()
+
+
+@pytest.fixture
+def cores(monkeypatch):
+
+    """
+    Allow `--jobs` up to 4 even on machines with fewer cores.
+    """
+
+    monkeypatch.setattr(options, 'cpu_count', lambda: max(4, multiprocessing.cpu_count()))
+
+
+@pytest.fixture
+def polygons(tmp_path):
+
+    """
+    A GeoPackage containing `make_features()`.
+    """
+
+    path = str(tmp_path / 'polygons.gpkg')
+    with fio.open(path, 'w', driver='GPKG', crs='EPSG:4326', schema=SCHEMA) as dst:
+        dst.writerecords(make_features())
+    return path
+
+
+@pytest.fixture
+def out_of_bounds(tmp_path):
+
+    """
+    Like `polygons` but the feature with `id` 3 is beyond the north pole and
+    cannot be reprojected to Web Mercator.
+    """
+
+    path = str(tmp_path / 'out-of-bounds.gpkg')
+    feats = list(make_features(count=10))
+    feats[3]['geometry'] = {
+        'type': 'Polygon',
+        'coordinates': [[(0, 95), (1, 95), (1, 96), (0, 96), (0, 95)]]}
+    with fio.open(path, 'w', driver='GPKG', crs='EPSG:4326', schema=SCHEMA) as dst:
+        dst.writerecords(feats)
+    return path
@@ -0,0 +1,114 @@
+"""
+Unittests for fio_geoprocessing.buffer
+"""
+
+
+import json
+
+import fiona as fio
+import pytest
+from shapely.geometry import box
+from shapely.geometry import mapping
+from shapely.geometry import shape
+from shapely.ops import unary_union
+
+from fio_geoprocessing import buffer
+
+from .conftest import read
+
+
+def test_out_of_bounds(runner, out_of_bounds, tmp_path):
+    outfile = str(tmp_path / 'out.gpkg')
+    args = [out_of_bounds, outfile, '--dist', '0.01', '--dst-crs', 'EPSG:3857']
+
+    result = runner.invoke(buffer.buffer, args)
+    assert result.exit_code != 0
+
+    result = runner.invoke(buffer.buffer, args + ['--skip-failures'])
+    assert result.exit_code == 0, result.output
+    feats = read(outfile)
+    assert [f['properties']['id'] for f in feats] == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert all(len(f['geometry']['coordinates']) for f in feats)
+
+
+def _vertices(path):
+    return sum(len(ring) for f in read(path)
+               for polygon in f['geometry']['coordinates'] for ring in polygon)
+
+
+def test_res(runner, polygons, tmp_path, recwarn):
+    counts = []
+    for args in (['--res', '16'], ['--res', '4'], ['--res', '16', '--adaptive-res']):
+        outfile = str(tmp_path / 'out.gpkg')
+        result = runner.invoke(buffer.buffer, [polygons, outfile, '--dist', '0.001'] + args)
+        assert result.exit_code == 0, result.output
+        counts.append(_vertices(outfile))
+
+    assert counts[0] > counts[1]
+    assert counts[0] > counts[2]
+    assert not [w for w in recwarn if issubclass(w.category, DeprecationWarning)]
+
+
+def test_stats(runner, out_of_bounds, tmp_path, cores):
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(buffer.buffer, [
+        out_of_bounds, outfile, '--dist', '0.01', '--dst-crs', 'EPSG:3857',
+        '--skip-failures', '--dissolve', '--jobs', '2', '--stats'])
+    assert result.exit_code == 0, result.output
+
+    report = json.loads(result.stderr.splitlines()[-1])
+    assert report['counts']['failed'] == 1
+    # Dissolving produces fewer features than it processes by design
+    assert 'skipped' not in report['counts']
+    assert report['seconds']['transform'] > 0
+    assert report['seconds']['buffer'] > 0
+
+
+def _dissolved(path, key):
+    groups = {}
+    for feat in read(path):
+        groups.setdefault(feat['properties'][key] if key else None, []).append(
+            shape(feat['geometry']).buffer(0.2, quad_segs=16))
+    return {k: unary_union(v) for k, v in groups.items()}
+
+
+@pytest.mark.parametrize('dissolve', [['--dissolve'], ['--dissolve-by', 'name']])
+@pytest.mark.parametrize('extra', [
+    [],
+    # Many batches per group, so partially dissolved features are merged
+    # over several rounds
+    ['--batch-size', '3'],
+    ['--batch-size', '3', '--jobs', '2'],
+])
+def test_dissolve(runner, polygons, tmp_path, dissolve, extra, cores):
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(buffer.buffer, [polygons, outfile, '--dist', '0.2'] + dissolve + extra)
+    assert result.exit_code == 0, result.output
+
+    key = dissolve[1] if len(dissolve) > 1 else None
+    with fio.open(outfile) as src:
+        assert list(src.schema['properties']) == ([key] if key else [])
+        actual = {f['properties'][key] if key else None: shape(f['geometry']) for f in src}
+
+    expected = _dissolved(polygons, key)
+    assert sorted(actual, key=repr) == sorted(expected, key=repr)
+    for k, geom in expected.items():
+        assert geom.symmetric_difference(actual[k]).area < 1e-9 * geom.area
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_merge_dissolved(jobs):
+    # More partial features per group than one task unions at once
+    partial = [
+        {'type': 'Feature', 'properties': {'group': i % 3},
+         'geometry': mapping(box(i, 0, i + 1.5, 1))}
+        for i in range(buffer._DISSOLVE_FAN_IN * 5)]
+
+    merged = buffer._merge_dissolved(partial, 'group', None, jobs=jobs)
+
+    assert sorted(f['properties']['group'] for f in merged) == [0, 1, 2]
+    for feat in merged:
+        group = feat['properties']['group']
+        expected = unary_union([
+            shape(f['geometry']) for f in partial if f['properties']['group'] == group])
+        assert shape(feat['geometry']).symmetric_difference(expected).area < 1e-9
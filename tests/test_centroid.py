@@ -0,0 +1,25 @@
+"""
+Unittests for fio_geoprocessing.centroid
+"""
+
+
+from fio_geoprocessing import centroid
+
+from .conftest import read
+from .test_executor import assert_same_features
+
+
+def test_shared_memory(runner, polygons, tmp_path, cores):
+    expected_path = str(tmp_path / 'expected.gpkg')
+    actual_path = str(tmp_path / 'actual.gpkg')
+
+    result = runner.invoke(centroid.centroid, [polygons, expected_path])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(centroid.centroid, [
+        polygons, actual_path, '--jobs', '2', '--engine', 'vectorized', '--shared-memory',
+        '--max-tasks-per-child', '1', '--batch-size', '10'])
+    assert result.exit_code == 0, result.output
+
+    expected = read(expected_path)
+    assert expected
+    assert_same_features(expected, read(actual_path))
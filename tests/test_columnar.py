@@ -0,0 +1,35 @@
+"""
+Unittests for fio_geoprocessing.columnar
+"""
+
+
+import pytest
+
+from fio_geoprocessing import columnar
+
+
+PROPERTIES = [
+    {'id': i, 'big': 3037000500 + i, 'value': i / 4, 'name': 'name-%s' % i}
+    for i in range(5)]
+
+
+@pytest.mark.parametrize('expr', [
+    'big * big > 0',
+    'id ** 40 > 0',
+    '-big * big < 0',
+    'big + 9223372036854775000 > 0',
+    "id in (1, 'a')",
+    "value in (0.25, 'a')",
+    "name in ('name-1', 1)",
+    'id in (1, 2.0, True)',
+    "name + '!' == 'name-2!'",
+    'id * 0.5 >= 1',
+])
+def test_evaluate_matches_eval(expr):
+    expected = [bool(eval(expr, {}, dict(props))) for props in PROPERTIES]
+    assert columnar.evaluate([expr], PROPERTIES).tolist() == expected
+
+
+def test_not_translatable():
+    with pytest.raises(columnar.NotTranslatable):
+        columnar.translate(['len(name) > 2'])
@@ -0,0 +1,46 @@
+"""
+Unittests for fio_geoprocessing.crscache
+"""
+
+
+import json
+import os
+import subprocess
+import sys
+
+
+_SCRIPT = """
+import multiprocessing
+
+from fio_geoprocessing import crscache
+
+
+def normalize(crs):
+    return crscache.normalize(crs)
+
+
+if __name__ == '__main__':
+    crscache.normalize('+proj=longlat +datum=WGS84 +no_defs')
+    ctx = multiprocessing.get_context('spawn')
+    pool = ctx.Pool(1)
+    pool.map(normalize, ['+proj=merc +datum=WGS84 +units=m +no_defs'])
+    # Let the worker exit normally, which runs `atexit` handlers
+    pool.close()
+    pool.join()
+"""
+
+
+def test_only_main_process_saves(tmp_path):
+    path = str(tmp_path / 'crs.json')
+    script = str(tmp_path / 'script.py')
+    with open(script, 'w') as f:
+        f.write(_SCRIPT)
+
+    env = dict(os.environ, FIO_GEOPROC_CRS_CACHE=path,
+               PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    subprocess.check_call([sys.executable, script], env=env)
+
+    with open(path) as f:
+        table = json.load(f)['crs']
+    assert any('longlat' in k for k in table)
+    assert not any('merc' in k for k in table)
@@ -0,0 +1,112 @@
+"""
+Unittests for fio_geoprocessing.executor
+"""
+
+
+import time
+
+import pytest
+from shapely.geometry import shape
+
+from fio_geoprocessing import buffer
+from fio_geoprocessing import centroid
+from fio_geoprocessing import executor
+from fio_geoprocessing import filter
+from fio_geoprocessing import reproject
+
+from .conftest import make_features
+from .conftest import read
+
+
+COMMANDS = [
+    (buffer.buffer, ['--dist', '0.01']),
+    (centroid.centroid, []),
+    (filter.filter, ['--expr', 'value > 0.5']),
+    (reproject.reproject, ['--dst-crs', 'EPSG:3857']),
+]
+
+
+def _double(feats, factor):
+    for feat in feats:
+        feat['properties']['id'] *= factor
+    return feats
+
+
+def assert_same_features(expected, actual):
+    assert [f['properties'] for f in expected] == [f['properties'] for f in actual]
+    for e, a in zip(expected, actual):
+        assert shape(e['geometry']).equals_exact(shape(a['geometry']), 1e-6)
+
+
+@pytest.mark.parametrize('command,args', COMMANDS)
+@pytest.mark.parametrize('extra', [
+    [],
+    ['--preserve-order'],
+    ['--batch-size', '7', '--transport', 'wkb'],
+    ['--batch-cost', '50'],
+])
+def test_jobs_match_rowwise(runner, polygons, tmp_path, command, args, extra, cores):
+    expected_path = str(tmp_path / 'expected.gpkg')
+    actual_path = str(tmp_path / 'actual.gpkg')
+
+    result = runner.invoke(command, [polygons, expected_path] + args)
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(command, [polygons, actual_path, '--jobs', '2'] + args + extra)
+    assert result.exit_code == 0, result.output
+
+    expected = read(expected_path)
+    assert expected
+    assert_same_features(expected, read(actual_path))
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@pytest.mark.parametrize('preserve_order', [True, False])
+def test_execute(jobs, preserve_order):
+    feats = list(make_features(count=55))
+    output = list(executor.execute(
+        _double, feats, {'factor': 2}, jobs=jobs, batch_size=10,
+        preserve_order=preserve_order))
+    ids = [f['properties']['id'] for f in output]
+    if preserve_order:
+        assert ids == [i * 2 for i in range(55)]
+    else:
+        assert sorted(ids) == [i * 2 for i in range(55)]
+
+
+def test_batched_by_cost():
+    feats = list(make_features(count=20))
+    batches = list(executor.batched_by_cost(feats, batch_cost=60))
+    assert [f for b in batches for f in b] == feats
+    assert all(len(b) > 1 for b in batches[:-1])
+
+
+@pytest.mark.parametrize('extra', [
+    {'batch_size': 5},
+    {'batch_size': 5, 'preserve_order': True, 'reorder_buffer': 10},
+    # Features cost 25 each
+    {'batch_cost': 100},
+])
+def test_max_inflight(extra):
+    read = []
+
+    def features():
+        for feat in make_features(count=200):
+            read.append(feat)
+            yield feat
+
+    limit = 20
+    # Features in a batch read while waiting for room
+    slack = extra.get('batch_size', 4)
+    produced = 0
+    for feat in executor.execute(
+            _double, features(), {'factor': 1}, jobs=2, max_inflight=limit, **extra):
+        produced += 1
+        # Give the reader a chance to get ahead
+        time.sleep(0.001)
+        assert len(read) - produced <= limit + slack
+    assert produced == 200
+
+
+def test_split_inflight():
+    assert executor.split_inflight(10000) == (5000, 5000)
+    assert executor.split_inflight(1) == (1, 1)
@@ -0,0 +1,210 @@
+"""
+Unittests for fio_geoprocessing.filter
+"""
+
+
+import fiona as fio
+import pytest
+from shapely.geometry import box
+from shapely.geometry import LineString
+from shapely.geometry import mapping
+from shapely.geometry import Polygon
+from shapely.geometry import shape
+
+from fio_geoprocessing import filter
+
+from .conftest import make_features
+from .conftest import read
+from .conftest import SCHEMA
+
+
+@pytest.mark.parametrize('expressions', [
+    ['value > 0.5'],
+    ['value > 0.25', 'value <= 0.75'],
+    ["name == 'name-3' or id % 5 == 0"],
+    ["name in ('name-1', 'name-2') and not value < 0.1"],
+    ['(value * 10) // 3 == 1'],
+    # Overflow int64
+    ['id ** 9 > 0'],
+    ['id * id * id * id * id * 100000000 > 0'],
+    # Containers with more than one type
+    ["id in (1, 'a', 3.0)"],
+    ["name not in ('name-1', 2)"],
+])
+def test_vectorized_matches_rowwise(runner, polygons, tmp_path, expressions):
+    args = []
+    for expr in expressions:
+        args += ['--expr', expr]
+
+    expected_path = str(tmp_path / 'expected.gpkg')
+    actual_path = str(tmp_path / 'actual.gpkg')
+
+    result = runner.invoke(filter.filter, [polygons, expected_path] + args)
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        filter.filter, [polygons, actual_path, '--vectorized', '--batch-size', '64'] + args)
+    assert result.exit_code == 0, result.output
+
+    expected = read(expected_path)
+    assert expected
+    assert [f['properties'] for f in expected] == [f['properties'] for f in read(actual_path)]
+
+
+@pytest.mark.parametrize('start_method', ['spawn', 'forkserver'])
+@pytest.mark.parametrize('vectorized', [[], ['--vectorized']])
+def test_start_method(runner, polygons, tmp_path, start_method, vectorized, cores):
+    expected_path = str(tmp_path / 'expected.gpkg')
+    actual_path = str(tmp_path / 'actual.gpkg')
+    args = ['--expr', "value > 0.5 and props['name'] != 'name-1'"] + vectorized
+
+    result = runner.invoke(filter.filter, [polygons, expected_path] + args)
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        filter.filter,
+        [polygons, actual_path, '--jobs', '2', '--start-method', start_method] + args)
+    assert result.exit_code == 0, result.output
+
+    expected = read(expected_path)
+    assert expected
+    assert [f['properties'] for f in expected] == [f['properties'] for f in read(actual_path)]
+
+
+def test_partitioned_read_bbox(runner, polygons, tmp_path, caplog, cores):
+    expected_path = str(tmp_path / 'expected.gpkg')
+    actual_path = str(tmp_path / 'actual.gpkg')
+    args = ['--bbox', '-100', '30', '-80', '40']
+
+    result = runner.invoke(filter.filter, [polygons, expected_path, '--bbox-exact'] + args)
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        filter.filter, [polygons, actual_path, '--jobs', '2', '--partitioned-read'] + args)
+    assert result.exit_code == 0, result.output
+    assert '--bbox-exact' in caplog.text
+
+    expected = read(expected_path)
+    assert expected
+    assert [f['properties'] for f in expected] == [f['properties'] for f in read(actual_path)]
+
+
+@pytest.fixture
+def diamonds(tmp_path):
+
+    """
+    Like `polygons` but diamonds, whose bounding boxes are mostly empty, so
+    testing bounding boxes and geometries give different results.
+    """
+
+    path = str(tmp_path / 'diamonds.gpkg')
+    feats = []
+    for feat in make_features():
+        (x, y), = feat['geometry']['coordinates'][0][:1]
+        feat['geometry']['coordinates'] = [
+            [(x, y - 0.5), (x + 0.5, y), (x, y + 0.5), (x - 0.5, y), (x, y - 0.5)]]
+        feats.append(feat)
+    with fio.open(path, 'w', driver='GPKG', crs='EPSG:4326', schema=SCHEMA) as dst:
+        dst.writerecords(feats)
+    return path
+
+
+def _ids(path):
+    return [f['properties']['id'] for f in read(path)]
+
+
+def _expected_ids(path, predicate, geom):
+    return [f['properties']['id'] for f in read(path)
+            if getattr(shape(f['geometry']), predicate)(geom)]
+
+
+_READ_ARGS = [
+    [],
+    ['--jobs', '2'],
+    ['--jobs', '2', '--partitioned-read'],
+]
+
+
+@pytest.mark.parametrize('extra', _READ_ARGS)
+def test_bbox_exact(runner, diamonds, tmp_path, extra, cores):
+    outfile = str(tmp_path / 'out.gpkg')
+    bbox = (-100, 30, -80, 40)
+    result = runner.invoke(
+        filter.filter,
+        [diamonds, outfile, '--bbox'] + list(map(str, bbox)) + ['--bbox-exact'] + extra)
+    assert result.exit_code == 0, result.output
+
+    expected = _expected_ids(diamonds, 'intersects', box(*bbox))
+    assert expected
+    assert _ids(outfile) == expected
+
+
+def test_bbox_exact_requires_bbox(runner, diamonds, tmp_path):
+    result = runner.invoke(
+        filter.filter, [diamonds, str(tmp_path / 'out.gpkg'), '--bbox-exact'])
+    assert result.exit_code == 2
+    assert '--bbox' in result.output
+
+
+@pytest.mark.parametrize('extra', _READ_ARGS)
+def test_within_geom(runner, diamonds, tmp_path, extra, cores):
+    outfile = str(tmp_path / 'out.gpkg')
+    geom = Polygon([(-110, 30), (-80, 30), (-95, 45), (-110, 30)])
+    result = runner.invoke(
+        filter.filter, [diamonds, outfile, '--within-geom', geom.wkt] + extra)
+    assert result.exit_code == 0, result.output
+
+    expected = _expected_ids(diamonds, 'within', geom)
+    assert expected
+    # Only testing against the triangle's bounding box would keep more
+    assert len(expected) < len(_expected_ids(diamonds, 'within', box(*geom.bounds)))
+    assert _ids(outfile) == expected
+
+
+@pytest.fixture
+def mask(tmp_path):
+
+    """
+    Geometries that satisfy every `--predicate` for at least one of the
+    `diamonds`.
+    """
+
+    feats = {f['properties']['id']: f for f in make_features(count=2)}
+    (x0, y0), = feats[0]['geometry']['coordinates'][0][:1]
+    (x1, y1), = feats[1]['geometry']['coordinates'][0][:1]
+    geoms = [
+        # Contains and overlaps diamonds
+        Polygon([(-110, 30), (-80, 30), (-95, 45), (-110, 30)]),
+        # Crosses diamonds
+        LineString([(-125, 35), (-65, 35)]),
+        # Touches a vertex of diamond 0
+        box(x0 + 0.5, y0, x0 + 1, y0 + 0.5),
+        # Properly contained by diamond 1
+        box(x1 - 0.1, y1 - 0.1, x1 + 0.1, y1 + 0.1),
+    ]
+
+    path = str(tmp_path / 'mask.gpkg')
+    schema = {'geometry': 'Unknown', 'properties': {'id': 'int'}}
+    with fio.open(path, 'w', driver='GPKG', crs='EPSG:4326', schema=schema) as dst:
+        dst.writerecords(
+            {'type': 'Feature', 'geometry': mapping(g), 'properties': {'id': i}}
+            for i, g in enumerate(geoms))
+    return path, geoms
+
+
+@pytest.mark.parametrize('predicate', sorted(filter._SPATIAL_PREDICATES))
+@pytest.mark.parametrize('extra', [
+    [],
+    ['--jobs', '2'],
+    ['--jobs', '2', '--transport', 'wkb', '--vectorized', '--expr', 'id >= 0'],
+])
+def test_mask(runner, diamonds, mask, tmp_path, predicate, extra, cores):
+    mask_path, mask_geoms = mask
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(
+        filter.filter,
+        [diamonds, outfile, '--mask', mask_path, '--predicate', predicate] + extra)
+    assert result.exit_code == 0, result.output
+
+    expected = [
+        f['properties']['id'] for f in read(diamonds)
+        if any(getattr(shape(f['geometry']), predicate)(g) for g in mask_geoms)]
+    assert expected
+    assert _ids(outfile) == expected
@@ -0,0 +1,60 @@
+"""
+Unittests for fio_geoprocessing.geoproc
+"""
+
+
+import pytest
+from shapely.geometry import shape
+
+from fio_geoprocessing import geoproc
+
+from .conftest import read
+
+
+@pytest.mark.parametrize('extra', [
+    [],
+    ['--jobs', '2'],
+    ['--jobs', '2', '--start-method', 'spawn'],
+])
+def test_chain(runner, polygons, tmp_path, extra, cores):
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(geoproc.geoproc, [
+        'chain', polygons, outfile,
+        'filter:expr=value > 0.5', 'reproject:dst=EPSG:3857', 'centroid'] + extra)
+    assert result.exit_code == 0, result.output
+
+    feats = read(outfile)
+    assert feats
+    assert all(f['properties']['value'] > 0.5 for f in feats)
+    assert all(f['geometry']['type'] == 'Point' for f in feats)
+    assert all(abs(shape(f['geometry']).x) > 180 for f in feats)
+
+
+def test_merge(runner, polygons, tmp_path):
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(geoproc.geoproc, ['merge', outfile, polygons, polygons])
+    assert result.exit_code == 0, result.output
+    assert len(read(outfile)) == 2 * len(read(polygons))
+
+
+@pytest.mark.parametrize('operation,message', [
+    ('reproject:dst=EPSG:3857', 'CRS'),
+    ('centroid', 'Schema'),
+])
+def test_merge_mismatch(runner, polygons, tmp_path, operation, message):
+    other = str(tmp_path / 'other.gpkg')
+    result = runner.invoke(geoproc.geoproc, ['chain', polygons, other, operation])
+    assert result.exit_code == 0, result.output
+
+    for extra in ([], ['--vrt']):
+        outfile = str(tmp_path / 'out.vrt')
+        result = runner.invoke(geoproc.geoproc, ['merge', outfile, polygons, other] + extra)
+        assert result.exit_code != 0
+        assert message in result.output
+
+
+def test_merge_vrt(runner, polygons, tmp_path):
+    outfile = str(tmp_path / 'out.vrt')
+    result = runner.invoke(geoproc.geoproc, ['merge', '--vrt', outfile, polygons, polygons])
+    assert result.exit_code == 0, result.output
+    assert len(read(outfile)) == 2 * len(read(polygons))
@@ -0,0 +1,26 @@
+"""
+Unittests for fio_geoprocessing.options
+"""
+
+
+import multiprocessing
+
+from fio_geoprocessing import centroid
+
+
+def test_jobs_limited_to_cores(runner, polygons, tmp_path):
+    outfile = str(tmp_path / 'out.gpkg')
+    cores = multiprocessing.cpu_count()
+
+    result = runner.invoke(centroid.centroid, [polygons, outfile, '--jobs', str(cores + 1)])
+    assert result.exit_code == 2
+    assert 'available cores' in result.output
+
+    result = runner.invoke(centroid.centroid, [polygons, outfile, '--jobs', str(cores)])
+    assert result.exit_code == 0, result.output
+
+
+def test_cores(runner, polygons, tmp_path, cores):
+    result = runner.invoke(
+        centroid.centroid, [polygons, str(tmp_path / 'out.gpkg'), '--jobs', '4'])
+    assert result.exit_code == 0, result.output
@@ -0,0 +1,65 @@
+"""
+Unittests for fio_geoprocessing.plugin
+"""
+
+
+import json
+import os
+import subprocess
+import sys
+
+from .conftest import read
+
+
+# Runs in a fresh interpreter so nothing the other tests imported counts.
+_SCRIPT = """
+import json
+import sys
+
+import click
+from click.testing import CliRunner
+
+from fio_geoprocessing import plugin
+
+
+@click.group()
+def cli():
+    pass
+
+
+for name in ('buffer', 'centroid', 'filter', 'geoproc', 'reproject'):
+    cli.add_command(getattr(plugin, name))
+
+heavy = ('fiona', 'shapely', 'numpy', 'pyproj')
+runner = CliRunner()
+listing = runner.invoke(cli, ['--help'])
+imported_by_listing = [m for m in heavy if m in sys.modules]
+invoked = runner.invoke(cli, ['centroid'] + sys.argv[1:])
+geoproc_help = runner.invoke(cli, ['geoproc', '--help'])
+
+print(json.dumps({
+    'listing': listing.output,
+    'imported_by_listing': imported_by_listing,
+    'invoked': [invoked.exit_code, invoked.output],
+    'geoproc_help': [geoproc_help.exit_code, geoproc_help.output],
+}))
+"""
+
+
+def test_lazy_command(polygons, tmp_path):
+    outfile = str(tmp_path / 'out.gpkg')
+    env = dict(os.environ,
+               PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = subprocess.check_output(
+        [sys.executable, '-c', _SCRIPT, polygons, outfile], env=env)
+    result = json.loads(output.decode('utf-8'))
+
+    for name in ('buffer', 'centroid', 'filter', 'geoproc', 'reproject'):
+        assert name in result['listing']
+    assert result['imported_by_listing'] == []
+
+    assert result['invoked'][0] == 0, result['invoked'][1]
+    assert len(read(outfile)) == len(read(polygons))
+
+    assert result['geoproc_help'][0] == 0
+    assert 'chain' in result['geoproc_help'][1]
@@ -0,0 +1,73 @@
+"""
+Unittests for fio_geoprocessing.reproject
+"""
+
+
+import math
+import threading
+
+import pytest
+
+from fio_geoprocessing import reproject
+
+from .conftest import read
+from .test_executor import assert_same_features
+
+
+def _finite(geom):
+    return all(math.isfinite(c) for ring in geom['coordinates'] for pt in ring for c in pt)
+
+
+@pytest.mark.parametrize('engine', ['rowwise', 'vectorized'])
+@pytest.mark.parametrize('extra', [[], ['--jobs', '2', '--transport', 'wkb']])
+def test_out_of_bounds(runner, out_of_bounds, tmp_path, engine, extra, cores):
+    outfile = str(tmp_path / 'out.gpkg')
+    args = [out_of_bounds, outfile, '--dst-crs', 'EPSG:3857', '--engine', engine] + extra
+
+    result = runner.invoke(reproject.reproject, args)
+    assert result.exit_code != 0
+
+    result = runner.invoke(reproject.reproject, args + ['--skip-failures'])
+    assert result.exit_code == 0, result.output
+    feats = read(outfile)
+    assert [f['properties']['id'] for f in feats] == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert all(_finite(f['geometry']) for f in feats)
+
+
+def test_failure_stops_stats(runner, out_of_bounds, tmp_path):
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(reproject.reproject, [
+        out_of_bounds, outfile, '--dst-crs', 'EPSG:3857', '--stats-interval', '0.01'])
+    assert result.exit_code != 0
+    assert not any(t.name == 'fio-geoproc-stats' for t in threading.enumerate())
+
+
+@pytest.mark.parametrize('start_method', ['fork', 'spawn'])
+def test_shared_memory(runner, polygons, tmp_path, start_method, cores):
+    expected_path = str(tmp_path / 'expected.gpkg')
+    actual_path = str(tmp_path / 'actual.gpkg')
+    args = ['--dst-crs', 'EPSG:3857', '--engine', 'vectorized']
+
+    result = runner.invoke(reproject.reproject, [polygons, expected_path] + args)
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(reproject.reproject, [
+        polygons, actual_path, '--jobs', '2', '--shared-memory',
+        '--start-method', start_method] + args)
+    assert result.exit_code == 0, result.output
+
+    expected = read(expected_path)
+    assert expected
+    assert_same_features(expected, read(actual_path))
+
+
+def test_shared_memory_out_of_bounds(runner, out_of_bounds, tmp_path, cores):
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(reproject.reproject, [
+        out_of_bounds, outfile, '--dst-crs', 'EPSG:3857', '--engine', 'vectorized',
+        '--jobs', '2', '--shared-memory', '--skip-failures'])
+    assert result.exit_code == 0, result.output
+
+    feats = read(outfile)
+    assert [f['properties']['id'] for f in feats] == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert all(_finite(f['geometry']) for f in feats)
+    assert all(abs(f['geometry']['coordinates'][0][0][0]) > 180 for f in feats)
@@ -0,0 +1,83 @@
+"""
+Unittests for fio_geoprocessing.shard
+"""
+
+
+import os
+
+import pytest
+from shapely.geometry import shape
+
+from fio_geoprocessing import buffer
+from fio_geoprocessing import centroid
+from fio_geoprocessing import geoproc
+from fio_geoprocessing import reproject
+
+from .conftest import read
+from .test_executor import assert_same_features
+
+
+@pytest.mark.parametrize('command,args', [
+    (centroid.centroid, []),
+    (reproject.reproject, ['--dst-crs', 'EPSG:3857']),
+    (buffer.buffer, ['--dist', '0.01', '--dissolve-by', 'name']),
+])
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_shard_output(runner, polygons, tmp_path, command, args, jobs, cores):
+    expected_path = str(tmp_path / 'expected.gpkg')
+    actual_path = str(tmp_path / 'actual.vrt')
+
+    result = runner.invoke(command, [polygons, expected_path] + args)
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        command, [polygons, actual_path, '--jobs', jobs, '--shard-output'] + args)
+    assert result.exit_code == 0, result.output
+
+    if '--dissolve-by' in args:
+        # Unions don't always start at the same vertex
+        expected = read(expected_path, key='name')
+        actual = read(actual_path, key='name')
+        assert [f['properties'] for f in expected] == [f['properties'] for f in actual]
+        for e, a in zip(expected, actual):
+            assert shape(e['geometry']).symmetric_difference(shape(a['geometry'])).area < 1e-12
+    else:
+        assert_same_features(read(expected_path), read(actual_path))
+
+    shards = [name for name in os.listdir(str(tmp_path)) if name.startswith('actual-shards-')]
+    assert len(shards) == 1
+    assert os.listdir(str(tmp_path / shards[0]))
+
+
+def test_shard_output_merge(runner, polygons, tmp_path, cores):
+    sharded = str(tmp_path / 'sharded.vrt')
+    merged = str(tmp_path / 'merged.gpkg')
+
+    result = runner.invoke(
+        reproject.reproject,
+        [polygons, sharded, '--dst-crs', 'EPSG:3857', '--jobs', '2', '--shard-output'])
+    assert result.exit_code == 0, result.output
+    directory = [name for name in os.listdir(str(tmp_path)) if '-shards-' in name][0]
+    shards = sorted(str(tmp_path / directory / name)
+                    for name in os.listdir(str(tmp_path / directory)))
+
+    result = runner.invoke(geoproc.geoproc, ['merge', merged] + shards)
+    assert result.exit_code == 0, result.output
+    assert_same_features(read(sharded), read(merged))
+
+
+def test_shard_output_requires_vrt(runner, polygons, tmp_path, cores):
+    result = runner.invoke(
+        centroid.centroid,
+        [polygons, str(tmp_path / 'out.gpkg'), '--jobs', '2', '--shard-output'])
+    assert result.exit_code == 2
+    assert '.vrt' in result.output
+    assert os.listdir(str(tmp_path)) == [os.path.basename(polygons)]
+
+
+def test_shard_output_failure(runner, out_of_bounds, tmp_path, cores):
+    result = runner.invoke(
+        reproject.reproject,
+        [out_of_bounds, str(tmp_path / 'out.vrt'), '--dst-crs', 'EPSG:3857', '--jobs', '2',
+         '--shard-output'])
+    assert result.exit_code != 0
+    assert os.listdir(str(tmp_path)) == [os.path.basename(out_of_bounds)]
@@ -0,0 +1,36 @@
+"""
+Unittests for fio_geoprocessing.stats
+"""
+
+
+import io
+import json
+
+from fio_geoprocessing import stats
+
+
+def test_final_report_includes_local():
+    # Discard anything left over from other tests
+    stats.collect()
+    stream = io.StringIO()
+    run_stats = stats.Stats(2, stream=stream)
+    run_stats.update({'seconds': {'process': 1.0}, 'read': 10, 'processed': 10,
+                      'failed': 1, 'produced': 7})
+
+    # Recorded by the parent, like a prefilter on the reader thread
+    stats.failure()
+    stats.timing('read', 0.5)
+
+    run_stats.report(final=True)
+    report = json.loads(stream.getvalue())
+    assert report['counts']['failed'] == 2
+    assert report['counts']['skipped'] == 2
+    assert report['seconds'] == {'process': 1.0, 'read': 0.5}
+    assert stats.collect() == {'failed': 0, 'seconds': {}}
+
+
+def test_aggregate():
+    run_stats = stats.Stats(1, stream=io.StringIO(), aggregate=True)
+    run_stats.update({'seconds': {}, 'read': 10, 'processed': 10,
+                      'failed': 0, 'produced': 1})
+    assert 'skipped' not in run_stats.snapshot()['counts']
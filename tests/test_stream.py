@@ -0,0 +1,93 @@
+"""
+Unittests for fio_geoprocessing.stream
+"""
+
+
+import json
+
+import fiona as fio
+import pytest
+from shapely.geometry import shape
+
+from fio_geoprocessing import buffer
+from fio_geoprocessing import centroid
+from fio_geoprocessing import filter
+from fio_geoprocessing import reproject
+from fio_geoprocessing import stream
+
+from .conftest import read
+
+
+def test_stdin_stdout_round_trip(runner, polygons, tmp_path):
+    result = runner.invoke(filter.filter, [polygons, '-', '--expr', 'value > 0.5'])
+    assert result.exit_code == 0, result.output
+    lines = result.stdout_bytes.splitlines()
+    feats = [json.loads(line) for line in lines]
+    assert feats
+    assert all(f['properties']['value'] > 0.5 for f in feats)
+
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(
+        buffer.buffer, ['-', outfile, '--dist', '0', '--driver', 'GPKG'],
+        input=result.stdout_bytes)
+    assert result.exit_code == 0, result.output
+
+    actual = read(outfile)
+    expected = sorted(feats, key=lambda f: f['properties']['id'])
+    assert [f['properties'] for f in actual] == [f['properties'] for f in expected]
+    for e, a in zip(expected, actual):
+        assert shape(e['geometry']).equals(shape(a['geometry']))
+
+
+@pytest.mark.parametrize('command,args', [
+    (centroid.centroid, []),
+    (filter.filter, ['--expr', 'value > 0.5']),
+])
+def test_stdin_src_crs(runner, polygons, tmp_path, command, args):
+    result = runner.invoke(reproject.reproject, [polygons, '-', '--dst-crs', 'EPSG:3857'])
+    assert result.exit_code == 0, result.output
+
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(
+        command, ['-', outfile, '--driver', 'GPKG', '--src-crs', 'EPSG:3857'] + args,
+        input=result.stdout_bytes)
+    assert result.exit_code == 0, result.output
+
+    with fio.open(outfile) as src:
+        assert src.crs.to_epsg() == 3857
+        assert len(src)
+
+
+def test_infer_schema():
+    feats = [
+        {'geometry': {'type': 'Point', 'coordinates': (0, 0)},
+         'properties': {'a': None, 'b': 1, 'c': True, 'd': None}},
+        {'geometry': {'type': 'Point', 'coordinates': (0, 0)},
+         'properties': {'a': 1, 'b': 1.5, 'c': 'x', 'd': None}},
+        {'geometry': None,
+         'properties': {'a': 2, 'b': 2, 'c': 1, 'e': 1.5}},
+    ]
+    assert stream.infer_schema(feats) == {
+        'geometry': 'Point',
+        'properties': {'a': 'int', 'b': 'float', 'c': 'str', 'd': 'str', 'e': 'float'}
+    }
+
+    feats.append({'geometry': {'type': 'LineString', 'coordinates': [(0, 0), (1, 1)]}})
+    assert stream.infer_schema(feats)['geometry'] == 'Unknown'
+
+
+def test_stdin_widen_schema(runner, tmp_path):
+    feats = [
+        {'type': 'Feature',
+         'geometry': {'type': 'Point', 'coordinates': [i, i]},
+         'properties': {'id': i, 'value': None if i == 0 else i * 1.5}}
+        for i in range(5)]
+    text = b''.join(stream.dumps(f) for f in feats)
+
+    outfile = str(tmp_path / 'out.gpkg')
+    result = runner.invoke(filter.filter, ['-', outfile, '--driver', 'GPKG'], input=text)
+    assert result.exit_code == 0, result.output
+
+    with fio.open(outfile) as src:
+        assert src.schema['properties']['value'].startswith('float')
+    assert [f['properties']['value'] for f in read(outfile)] == [None, 1.5, 3.0, 4.5, 6.0]
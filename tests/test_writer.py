@@ -0,0 +1,50 @@
+"""
+Unittests for fio_geoprocessing.writer
+"""
+
+
+import threading
+import time
+
+import pytest
+
+from fio_geoprocessing import writer
+
+
+class _BlockedSink(object):
+
+    driver = 'GPKG'
+
+    def __init__(self):
+        self.unblock = threading.Event()
+        self.written = []
+
+    def writerecords(self, feats):
+        self.unblock.wait()
+        self.written.extend(feats)
+
+
+@pytest.mark.parametrize('max_inflight', [1, 30, 10000])
+def test_max_inflight(max_inflight):
+    sink = _BlockedSink()
+    accepted = []
+
+    def produce(w):
+        for i in range(max_inflight * 3):
+            w.write({'id': i})
+            accepted.append(i)
+
+    with writer.Writer(sink, max_inflight=max_inflight) as w:
+        thread = threading.Thread(target=produce, args=(w,))
+        thread.start()
+        try:
+            time.sleep(0.2)
+            held = len(accepted)
+        finally:
+            sink.unblock.set()
+            thread.join()
+
+    assert w.batch_size <= max(1, max_inflight // 3)
+    assert 0 < held <= max(3, max_inflight)
+
+    assert len(sink.written) == max_inflight * 3